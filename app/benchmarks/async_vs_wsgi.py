@@ -0,0 +1,108 @@
+"""
+Load test comparing the sync DRF endpoints served over WSGI with the native
+async endpoints served over ASGI.
+
+Run both deployments against the same database and broker, e.g.:
+
+    gunicorn core.wsgi:application -w 4 --threads 8 -b 0.0.0.0:8000
+    gunicorn core.asgi:application -w 4 -k uvicorn.workers.UvicornWorker -b 0.0.0.0:8001
+
+then:
+
+    python -m benchmarks.async_vs_wsgi --wsgi http://localhost:8000 \
+        --asgi http://localhost:8001 --flow verify-account -n 2000 -c 64
+
+``verify-account`` sends random phones with a wrong OTP, which exercises the
+validation query without creating rows. ``onboard`` creates pending users and
+publishes real SMS tasks, so point it at a broker without a Twilio worker.
+"""
+import argparse
+import json
+import random
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from .stats import format_summary, summarize
+
+FLOWS = {
+    "verify-account": ("/api/v1/auth/verify-account/", "/api/v1/async/auth/verify-account/"),
+    "initiate-password-reset": ("/api/v1/auth/initiate-password-reset/",
+                                "/api/v1/async/auth/initiate-password-reset/"),
+    "onboard": ("/api/v1/user/", "/api/v1/async/user/"),
+}
+
+
+def random_phone() -> str:
+    return "+234" + "".join(random.choices("0123456789", k=10))
+
+
+def build_payload(flow: str, phone: str = None) -> dict:
+    if flow == "verify-account":
+        return {"phone": random_phone(), "otp": "000000"}
+    if flow == "initiate-password-reset":
+        return {"phone": phone or random_phone()}
+    return {"phone": random_phone(), "password": "benchmark-pass"}
+
+
+def send(url: str, payload: dict, timeout: float):
+    """Returns (latency, failed); 4xx answers are expected and not failures"""
+    request = urllib.request.Request(
+        url, data=json.dumps(payload).encode(), method="POST",
+        headers={"Content-Type": "application/json"})
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+        failed = False
+    except urllib.error.HTTPError as e:
+        failed = e.code >= 500
+    except OSError:
+        failed = True
+    return time.perf_counter() - started, failed
+
+
+def run(url: str, flow: str, requests: int, concurrency: int, timeout: float, phone: str = None):
+    payloads = [build_payload(flow, phone) for _ in range(requests)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda payload: send(url, payload, timeout), payloads))
+    elapsed = time.perf_counter() - started
+    latencies = [latency for latency, failed in results if not failed]
+    errors = sum(1 for _, failed in results if failed)
+    return summarize(latencies, elapsed, errors)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--wsgi", required=True, help="Base URL of the WSGI deployment")
+    parser.add_argument("--asgi", required=True, help="Base URL of the ASGI deployment")
+    parser.add_argument("--flow", choices=sorted(FLOWS), default="verify-account")
+    parser.add_argument("--phone", help="Registered phone for initiate-password-reset")
+    parser.add_argument("-n", "--requests", type=int, default=1000)
+    parser.add_argument("-c", "--concurrency", type=int, default=32)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args(argv)
+
+    sync_path, async_path = FLOWS[args.flow]
+    results = {
+        "wsgi": run(args.wsgi.rstrip("/") + sync_path, args.flow,
+                    args.requests, args.concurrency, args.timeout, args.phone),
+        "asgi": run(args.asgi.rstrip("/") + async_path, args.flow,
+                    args.requests, args.concurrency, args.timeout, args.phone),
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name, summary in results.items():
+        print(format_summary(f"{args.flow} ({name})", summary))
+    if results["wsgi"]["throughput_rps"]:
+        ratio = results["asgi"]["throughput_rps"] / results["wsgi"]["throughput_rps"]
+        print(f"asgi/wsgi throughput ratio: {ratio:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""
+End-to-end throughput and latency of the OTP auth flows on one node.
+
+The full Django stack runs in-process: middleware, serializers, password
+hashing and the database. It uses a throwaway test database created next to
+DATABASE_URL, built from the models as the test suite does (keep it between
+runs with --keepdb):
+
+    python -m benchmarks.auth_flows -n 200 -c 4
+    python -m benchmarks.auth_flows -n 200 -c 4 --save-baseline main
+    python -m benchmarks.auth_flows -n 200 -c 4 --compare main
+
+Two flows run, one phase after the other, each for `-n` distinct phones:
+
+    signup: onboard -> verify-account -> login -> refresh
+    reset:  initiate-password-reset -> create-password
+
+Celery tasks run eagerly, and send_sms is replaced by an in-memory outbox.
+Each OTP is read from the outbox the way a user would read the SMS. OTP
+throttling and load shedding are turned off: every client shares one IP,
+and the aim is to measure capacity. --async-views sends the OTP steps to the
+native async endpoints instead of the DRF ones.
+
+Every step reports throughput (completed steps per second of its phase) and
+p50/p95/p99 latency. --compare exits with status 1 when any step's p95 grew,
+or its throughput fell, by more than --tolerance against the stored baseline.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from .baselines import compare, format_comparison, load_baseline, save_baseline
+from .stats import format_summary, summarize
+
+OTP_PATTERN = re.compile(r"\b(\d{6})\b")
+PASSWORD = "benchmark-pass"
+NEW_PASSWORD = "benchmark-pass-2"
+
+URL_NAMES = {
+    "onboard": ("user:user-list", "async-auth:onboard"),
+    "verify-account": ("auth:auth-verify-account", "async-auth:verify-account"),
+    "initiate-password-reset": ("auth:auth-initiate-password-reset",
+                                "async-auth:initiate-password-reset"),
+    "create-password": ("auth:auth-create-password", "async-auth:create-password"),
+    "login": ("auth:login", "auth:login"),
+    "refresh": ("auth:refresh-token", "auth:refresh-token"),
+}
+
+
+class FakeSMSOutbox:
+    """Stands in for send_sms; keeps the last message sent to each phone"""
+
+    def __init__(self):
+        self.messages = {}
+        self.sent = 0
+        self._lock = threading.Lock()
+
+    def send(self, message: str, phone: str) -> None:
+        with self._lock:
+            self.messages[phone] = message
+            self.sent += 1
+
+    def otp_for(self, phone: str):
+        match = OTP_PATTERN.search(self.messages.get(phone, ""))
+        return match.group(1) if match else None
+
+
+class DisableMigrations(dict):
+    """MIGRATION_MODULES that builds the schema straight from the models, as the tests do"""
+
+    def __contains__(self, item):
+        return True
+
+    def __getitem__(self, item):
+        return None
+
+
+def setup_django():
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings.dev")
+    import django
+    from django.conf import settings
+
+    django.setup()
+    settings.MIGRATION_MODULES = DisableMigrations()
+    settings.OTP_THROTTLE = {**settings.OTP_THROTTLE, "ENABLED": False}
+    settings.LOAD_SHEDDING = {**settings.LOAD_SHEDDING, "ENABLED": False}
+    from core.celery import APP
+    APP.conf.task_always_eager = True
+
+
+class FlowRunner:
+
+    def __init__(self, outbox: FakeSMSOutbox, async_views: bool):
+        from django.urls import reverse
+
+        self.outbox = outbox
+        self.urls = {step: reverse(names[1] if async_views else names[0])
+                     for step, names in URL_NAMES.items()}
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def step(self, client, name: str, payload: dict):
+        """POST one step; returns the JSON body, or None when it failed"""
+        started = time.perf_counter()
+        response = client.post(self.urls[name], payload, format="json")
+        latency = time.perf_counter() - started
+        with self._lock:
+            if response.status_code >= 400:
+                self.errors[name] += 1
+                return None
+            self.latencies[name].append(latency)
+        return response.json()
+
+    def signup(self, client, phone: str) -> bool:
+        if self.step(client, "onboard", {"phone": phone, "password": PASSWORD}) is None:
+            return False
+        otp = self.outbox.otp_for(phone)
+        if self.step(client, "verify-account", {"phone": phone, "otp": otp}) is None:
+            return False
+        tokens = self.step(client, "login", {"phone": phone, "password": PASSWORD})
+        if tokens is None:
+            return False
+        return self.step(client, "refresh", {"refresh": tokens["refresh"]}) is not None
+
+    def reset(self, client, phone: str) -> bool:
+        if self.step(client, "initiate-password-reset", {"phone": phone}) is None:
+            return False
+        otp = self.outbox.otp_for(phone)
+        return self.step(client, "create-password",
+                         {"phone": phone, "otp": otp, "new_password": NEW_PASSWORD}) is not None
+
+    def run_phase(self, flow, phones: list, concurrency: int) -> dict:
+        """Runs `flow` once per phone; returns the per-step and whole-flow summaries"""
+        from django.db import connections
+        from rest_framework.test import APIClient
+
+        flow_latencies, flow_errors = [], 0
+        steps_before = set(self.latencies) | set(self.errors)
+
+        def worker(share):
+            nonlocal flow_errors
+            client = APIClient()
+            try:
+                for phone in share:
+                    started = time.perf_counter()
+                    ok = flow(client, phone)
+                    latency = time.perf_counter() - started
+                    with self._lock:
+                        if ok:
+                            flow_latencies.append(latency)
+                        else:
+                            flow_errors += 1
+            finally:
+                connections.close_all()
+
+        shares = [phones[index::concurrency] for index in range(concurrency)]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(worker, shares))
+        elapsed = time.perf_counter() - started
+
+        name = flow.__name__
+        results = {f"{name} (flow)": summarize(flow_latencies, elapsed, flow_errors)}
+        for step in URL_NAMES:
+            if step in (set(self.latencies) | set(self.errors)) - steps_before:
+                results[f"{name}: {step}"] = summarize(
+                    self.latencies[step], elapsed, self.errors[step])
+        return results
+
+
+def benchmark_phones(count: int, seed: int) -> list:
+    """Distinct valid phones; a different seed avoids users left by --keepdb"""
+    return [f"+234{seed % 100:02d}{index:08d}" for index in range(count)]
+
+
+def run(iterations: int, concurrency: int, seed: int, keepdb: bool, async_views: bool) -> dict:
+    from django.test.utils import (setup_databases, setup_test_environment,
+                                   teardown_databases, teardown_test_environment)
+
+    from user.events import auth_events
+
+    setup_test_environment(debug=False)
+    old_config = setup_databases(verbosity=0, interactive=False, keepdb=keepdb)
+    outbox = FakeSMSOutbox()
+    try:
+        with mock.patch("user.tasks.send_sms", outbox.send):
+            runner = FlowRunner(outbox, async_views)
+            phones = benchmark_phones(iterations, seed)
+            results = runner.run_phase(runner.signup, phones, concurrency)
+            results.update(runner.run_phase(runner.reset, phones, concurrency))
+    finally:
+        # Buffered auth events belong in the test database, not the real one at exit
+        auth_events.flush()
+        teardown_databases(old_config, verbosity=0, keepdb=keepdb)
+        teardown_test_environment()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--iterations", type=int, default=100, help="Phones per flow")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="Client threads")
+    parser.add_argument("--seed", type=int, default=0, help="Varies the phones generated")
+    parser.add_argument("--keepdb", action="store_true", help="Reuse the test database")
+    parser.add_argument("--async-views", action="store_true",
+                        help="Use the async endpoints for the OTP steps")
+    parser.add_argument("--save-baseline", metavar="NAME", help="Store the results as NAME")
+    parser.add_argument("--compare", metavar="NAME", help="Compare with the stored NAME")
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="Allowed p95/throughput change against the baseline (fraction)")
+    parser.add_argument("--baseline-dir", help="Where baselines are stored")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args(argv)
+
+    setup_django()
+    results = run(args.iterations, args.concurrency, args.seed, args.keepdb, args.async_views)
+    directory = {"directory": args.baseline_dir} if args.baseline_dir else {}
+    options = {"iterations": args.iterations, "concurrency": args.concurrency,
+               "async_views": args.async_views}
+    rows = []
+    if args.compare:
+        baseline = load_baseline(args.compare, **directory)
+        if baseline["options"] != options:
+            print(f"Baseline {args.compare!r} ran with {baseline['options']}; "
+                  "the comparison is not like for like", file=sys.stderr)
+        rows = compare(results, baseline, args.tolerance)
+    if args.save_baseline:
+        path = save_baseline(args.save_baseline, results, options, **directory)
+        print(f"Baseline saved to {path}", file=sys.stderr)
+
+    if args.json:
+        print(json.dumps({"results": results, "comparison": rows}, indent=2))
+    else:
+        for name, summary in results.items():
+            print(format_summary(name, summary))
+        if rows:
+            print(f"\nAgainst baseline {args.compare!r} ({baseline['commit']}):")
+            for row in rows:
+                print(format_comparison(row))
+    if any(row["regressed"] for row in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
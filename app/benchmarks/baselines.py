@@ -0,0 +1,80 @@
+"""
+Stored benchmark results, so a run can be compared with an earlier commit.
+
+Baselines are JSON files in benchmarks/baselines/ (or --baseline-dir), named
+after the baseline. They are machine-specific: compare runs from the same
+host and the same options.
+"""
+import json
+import subprocess
+from datetime import datetime, timezone
+from pathlib import Path
+
+BASELINE_DIR = Path(__file__).resolve().parent / "baselines"
+
+
+def current_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def baseline_path(name: str, directory: Path = BASELINE_DIR) -> Path:
+    return Path(directory) / f"{name}.json"
+
+
+def save_baseline(name: str, results: dict, options: dict, directory: Path = BASELINE_DIR) -> Path:
+    path = baseline_path(name, directory)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps({
+        "commit": current_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "options": options,
+        "results": results,
+    }, indent=2))
+    return path
+
+
+def load_baseline(name: str, directory: Path = BASELINE_DIR) -> dict:
+    return json.loads(baseline_path(name, directory).read_text())
+
+
+def change(current: float, previous: float):
+    return round((current - previous) / previous, 4) if previous else None
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    One row per result also present in the baseline. A row regressed when its
+    p95 grew, or its throughput fell, by more than `tolerance` (a fraction).
+    """
+    rows = []
+    for name, summary in results.items():
+        previous = baseline["results"].get(name)
+        if previous is None:
+            continue
+        p95_change = change(summary["p95_ms"], previous["p95_ms"])
+        throughput_change = change(summary["throughput_rps"], previous["throughput_rps"])
+        rows.append({
+            "name": name,
+            "p95_ms": summary["p95_ms"],
+            "baseline_p95_ms": previous["p95_ms"],
+            "p95_change": p95_change,
+            "throughput_rps": summary["throughput_rps"],
+            "baseline_throughput_rps": previous["throughput_rps"],
+            "throughput_change": throughput_change,
+            "regressed": (p95_change or 0) > tolerance or (throughput_change or 0) < -tolerance,
+        })
+    return rows
+
+
+def format_comparison(row: dict) -> str:
+    def pct(value):
+        return "n/a" if value is None else f"{value:+.1%}"
+
+    flag = "  REGRESSED" if row["regressed"] else ""
+    return (f"{row['name']:<32} p95 {row['baseline_p95_ms']:>8} -> {row['p95_ms']:>8} ms "
+            f"({pct(row['p95_change'])})  throughput {row['baseline_throughput_rps']:>9} -> "
+            f"{row['throughput_rps']:>9} req/s ({pct(row['throughput_change'])}){flag}")
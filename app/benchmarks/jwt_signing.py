@@ -0,0 +1,92 @@
+"""
+Per-token cost of signing and verifying access tokens with each supported
+algorithm. No Django or database is needed:
+
+    python -m benchmarks.jwt_signing -n 2000
+
+HS256 is the shared-secret baseline; RS256 and EdDSA are what downstream
+services verify locally against the JWKS. Verification is what the fleet pays
+per request, so it usually matters more than signing.
+"""
+import argparse
+import json
+import time
+import uuid
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+
+from .stats import format_summary, summarize
+
+
+def sample_claims() -> dict:
+    """Same shape as the claims CustomObtainTokenPairSerializer.get_token adds"""
+    now = int(time.time())
+    return {
+        "token_type": "access",
+        "exp": now + 7 * 24 * 3600,
+        "iat": now,
+        "jti": uuid.uuid4().hex,
+        "user_id": str(uuid.uuid4()),
+        "firstname": "Benchmark",
+        "lastname": "User",
+        "email": "benchmark@example.com",
+        "roles": ["CUSTOMER"],
+    }
+
+
+def build_keys(rsa_key_size: int) -> dict:
+    """algorithm -> (signing key, verifying key)"""
+    rsa_key = rsa.generate_private_key(public_exponent=65537, key_size=rsa_key_size)
+    ed_key = ed25519.Ed25519PrivateKey.generate()
+    secret = "benchmark-secret-key-of-reasonable-length"
+    return {
+        "HS256": (secret, secret),
+        "RS256": (rsa_key, rsa_key.public_key()),
+        "EdDSA": (ed_key, ed_key.public_key()),
+    }
+
+
+def timed(operation, iterations: int) -> dict:
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        began = time.perf_counter()
+        operation()
+        latencies.append(time.perf_counter() - began)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def run(iterations: int, rsa_key_size: int) -> dict:
+    results = {}
+    for algorithm, (signing_key, verifying_key) in build_keys(rsa_key_size).items():
+        claims = sample_claims()
+        headers = {"kid": "benchmark"}
+        token = jwt.encode(claims, signing_key, algorithm=algorithm, headers=headers)
+        results[f"{algorithm} sign"] = timed(
+            lambda: jwt.encode(claims, signing_key, algorithm=algorithm, headers=headers),
+            iterations)
+        results[f"{algorithm} verify"] = timed(
+            lambda: jwt.decode(token, verifying_key, algorithms=[algorithm]), iterations)
+        results[f"{algorithm} verify"]["token_bytes"] = len(token)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--iterations", type=int, default=1000)
+    parser.add_argument("--rsa-key-size", type=int, default=2048)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args(argv)
+
+    results = run(args.iterations, args.rsa_key_size)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name, summary in results.items():
+        print(format_summary(name, summary).replace("req/s", "ops/s"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Per-request cost of logging with the old synchronous setup and with
+core.logs. No Django or database is needed:
+
+    python -m benchmarks.logging_overhead -n 5000 --queries 8
+
+Each simulated request logs one django.db.backends DEBUG record per query
+(with the same extras Django passes) and one django.request record. "before"
+is the previous FileHandler, which formats and writes each record on the
+request thread. "queued" only enqueues; "queued+sampled" also keeps 1% of the
+SQL records, as LOG['SAMPLE_RATES'] does by default. The listener's drain
+time after the run is reported separately: that work is off the request path.
+
+On a fast local disk, queueing alone mostly moves the cost around; the
+listener thread competes for the GIL. Use --write-latency-us to model a slow
+or busy volume. The synchronous handler then stalls every request, while
+the queued handlers do not.
+"""
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+
+from core.logs import JsonFormatter, QueuedRotatingFileHandler, SamplingFilter
+
+from .stats import format_summary, summarize
+
+SQL = ('SELECT "user_user"."id", "user_user"."phone", "user_user"."password" '
+       'FROM "user_user" WHERE "user_user"."phone" = %s LIMIT 21')
+
+
+def simulate_request(queries: int) -> None:
+    db_logger = logging.getLogger("django.db.backends")
+    for _ in range(queries):
+        db_logger.debug("(%.3f) %s; args=%s; alias=%s", 0.0004, SQL, ("+2348100000000",),
+                        "default", extra={"duration": 0.0004, "sql": SQL,
+                                          "params": ("+2348100000000",), "alias": "default"})
+    logging.getLogger("django.request").info("OK: /api/v1/auth/login/", extra={"status_code": 200})
+
+
+def file_handler(directory: str) -> logging.Handler:
+    handler = logging.FileHandler(os.path.join(directory, "before.log"))
+    handler.setLevel(logging.DEBUG)
+    return handler
+
+
+def queued_handler(directory: str, name: str, rates: dict = None,
+                   queue_size: int = 10000) -> logging.Handler:
+    handler = QueuedRotatingFileHandler(os.path.join(directory, f"{name}.log"),
+                                        queue_size=queue_size)
+    handler.setFormatter(JsonFormatter())
+    if rates:
+        handler.addFilter(SamplingFilter(rates))
+    return handler
+
+
+def slow_down(handler: logging.Handler, seconds: float) -> logging.Handler:
+    """Adds `seconds` to every write, as a slow volume would"""
+    emit = handler.emit
+
+    def slow_emit(record):
+        emit(record)
+        time.sleep(seconds)
+
+    handler.emit = slow_emit
+    return handler
+
+
+def timed(handler: logging.Handler, iterations: int, queries: int) -> dict:
+    django_logger = logging.getLogger("django")
+    django_logger.handlers = [handler]
+    django_logger.setLevel(logging.DEBUG)
+    django_logger.propagate = False
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        began = time.perf_counter()
+        simulate_request(queries)
+        latencies.append(time.perf_counter() - began)
+    elapsed = time.perf_counter() - started
+    drain_started = time.perf_counter()
+    handler.close()
+    summary = summarize(latencies, elapsed)
+    summary["mean_us"] = round(sum(latencies) / len(latencies) * 1e6, 1)
+    summary["drain_ms"] = round((time.perf_counter() - drain_started) * 1000, 1)
+    summary["dropped"] = getattr(handler, "dropped", 0)
+    django_logger.handlers = []
+    return summary
+
+
+def run(iterations: int, queries: int, write_latency: float) -> dict:
+    queue_size = iterations * (queries + 1)
+    with tempfile.TemporaryDirectory() as directory:
+        before = file_handler(directory)
+        queued = queued_handler(directory, "queued", queue_size=queue_size)
+        sampled = queued_handler(directory, "sampled", {"django.db.backends": 0.01},
+                                 queue_size=queue_size)
+        if write_latency:
+            slow_down(before, write_latency)
+            slow_down(queued.target, write_latency)
+            slow_down(sampled.target, write_latency)
+        return {
+            "before (FileHandler)": timed(before, iterations, queries),
+            "queued": timed(queued, iterations, queries),
+            "queued+sampled": timed(sampled, iterations, queries),
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--iterations", type=int, default=2000, help="Simulated requests")
+    parser.add_argument("--queries", type=int, default=8, help="SQL records per request")
+    parser.add_argument("--write-latency-us", type=float, default=0,
+                        help="Extra time per record written")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args(argv)
+
+    results = run(args.iterations, args.queries, args.write_latency_us / 1e6)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name, summary in results.items():
+        print(f"{format_summary(name, summary)}  mean {summary['mean_us']:>7} us  "
+              f"drain {summary['drain_ms']} ms  dropped {summary['dropped']}")
+
+
+if __name__ == "__main__":
+    main()
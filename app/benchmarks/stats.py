@@ -0,0 +1,29 @@
+import math
+from typing import Sequence
+
+
+def percentile(samples: Sequence[float], pct: float) -> float:
+    """Nearest-rank percentile of already sorted samples"""
+    if not samples:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(samples)))
+    return samples[rank - 1]
+
+
+def summarize(latencies: Sequence[float], elapsed: float, errors: int = 0) -> dict:
+    """Throughput and latency percentiles (ms) for one run"""
+    ordered = sorted(latencies)
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "throughput_rps": round(len(ordered) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(ordered, 50) * 1000, 2),
+        "p95_ms": round(percentile(ordered, 95) * 1000, 2),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 2),
+    }
+
+
+def format_summary(name: str, summary: dict) -> str:
+    return (f"{name:<32} {summary['throughput_rps']:>10} req/s  "
+            f"p50 {summary['p50_ms']:>8} ms  p95 {summary['p95_ms']:>8} ms  "
+            f"p99 {summary['p99_ms']:>8} ms  errors {summary['errors']}")
@@ -1,4 +1,6 @@
 import pytest
+from django.core.cache import cache
+from user.events import auth_events
 from user.models import User
 from rest_framework.test import APIClient
 from django.urls import reverse
@@ -11,6 +13,22 @@ register(UserFactory)
 register(TokenFactory)
 
 
+@pytest.fixture(autouse=True)
+def clear_cache():
+    '''Cache-backed counters and responses must not leak between tests'''
+    cache.clear()
+    yield
+    cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def clear_auth_events():
+    '''Buffered auth events must not be flushed into another test's transaction'''
+    auth_events.clear()
+    yield
+    auth_events.clear()
+
+
 @pytest.fixture
 def api_client():
     return APIClient()
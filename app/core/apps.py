@@ -0,0 +1,14 @@
+from django.apps import AppConfig
+
+
+class CoreConfig(AppConfig):
+    """Web request hooks of the core app; CeleryConfig extends it with the Celery setup"""
+    name = 'core'
+
+    def ready(self):
+        from django.core.signals import request_started
+
+        from .db import close_unusable_connections
+
+        # Runs after Django's close_old_connections, next to DatabaseRoutingMiddleware's routing
+        request_started.connect(close_unusable_connections)
@@ -1,9 +1,11 @@
-from django.apps import apps, AppConfig
+from django.apps import apps
 from django.conf import settings
 import os
 from celery import Celery
 from decouple import config
 
+from .apps import CoreConfig
+
 if not settings.configured:
     environment = config('ENVIRONMENT')
     os.environ.setdefault('DJANGO_SETTINGS_MODULE', "core.settings."+environment) 
@@ -11,11 +13,22 @@ if not settings.configured:
 APP = Celery('core')
 
 
-class CeleryConfig(AppConfig):
+class CeleryConfig(CoreConfig):
     name = 'core'
     verbose_name = 'Celery Config'
 
     def ready(self):
+        super().ready()
+        from celery.signals import (before_task_publish, task_prerun, worker_init,
+                                    worker_process_shutdown)
+
+        from .metrics import (mark_worker_process_dead, observe_queue_lag, stamp_publish_time,
+                              start_worker_exporter)
+
+        before_task_publish.connect(stamp_publish_time, weak=False)
+        task_prerun.connect(observe_queue_lag, weak=False)
+        worker_process_shutdown.connect(mark_worker_process_dead, weak=False)
+        worker_init.connect(start_worker_exporter, weak=False)
         APP.config_from_object('django.conf:settings', namespace='CELERY')
         installed_apps = [app_config.name for app_config in apps.get_app_configs()]
         APP.autodiscover_tasks(installed_apps, force=True)
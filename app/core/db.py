@@ -0,0 +1,114 @@
+"""
+Database connection handling and read-replica routing.
+
+Reads go to a replica only when a view opted in for the current request (see
+ReplicaReadMixin) and nothing has been written yet. After a write, the rest
+of the request reads from the primary, and so do the client's requests for
+the next REPLICA_PIN_SECONDS, which covers replication lag (read-your-writes).
+The pin is kept in the shared cache, so it holds on every worker. Responses
+that are about to be cached are built from the primary (use_primary_reads).
+"""
+import contextvars
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+
+class RoutingState:
+    __slots__ = ("replica", "wrote")
+
+    def __init__(self):
+        self.replica = None
+        self.wrote = False
+
+
+_routing_state = contextvars.ContextVar("db_routing_state", default=None)
+
+
+def start_request_routing() -> RoutingState:
+    """Fresh routing state for a request; threads are reused, so always reset"""
+    state = RoutingState()
+    _routing_state.set(state)
+    return state
+
+
+def pin_key(user) -> str:
+    return f"db-pin:{user.pk}"
+
+
+def is_pinned_to_primary(user) -> bool:
+    return bool(user and user.is_authenticated and cache.get(pin_key(user)))
+
+
+def allow_replica_reads(user) -> bool:
+    """Let the rest of the current request read from a replica, if it is safe"""
+    state = _routing_state.get()
+    if state is None or state.wrote or not settings.DATABASE_REPLICAS:
+        return False
+    if is_pinned_to_primary(user):
+        return False
+    state.replica = random.choice(settings.DATABASE_REPLICAS)
+    return True
+
+
+def use_primary_reads() -> None:
+    """Send the rest of the current request's reads to the primary"""
+    state = _routing_state.get()
+    if state is not None:
+        state.replica = None
+
+
+def finish_request_routing(user) -> None:
+    """Pin a client that wrote to the primary for REPLICA_PIN_SECONDS"""
+    state = _routing_state.get()
+    if state is not None and state.wrote and settings.DATABASE_REPLICAS \
+            and user is not None and user.is_authenticated:
+        cache.set(pin_key(user), True, timeout=settings.DATABASE_ROUTING["REPLICA_PIN_SECONDS"])
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        state = _routing_state.get()
+        if state is not None and state.replica and not state.wrote:
+            return state.replica
+        return "default"
+
+    def db_for_write(self, model, **hints):
+        state = _routing_state.get()
+        if state is not None:
+            state.wrote = True
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas mirror the primary, so objects from either may be related
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == "default"
+
+
+class ReplicaReadMixin:
+    """DRF view mixin: actions listed in `replica_actions` read from a replica"""
+    replica_actions = ()
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if getattr(self, "action", None) in self.replica_actions:
+            allow_replica_reads(request.user)
+
+
+def close_unusable_connections(**kwargs) -> None:
+    """
+    Pre-use health check for persistent connections, run on request_started
+    after Django's own close_old_connections. A connection the server or
+    pgbouncer dropped while idle is closed here and reopened on first use,
+    instead of failing the request's first query.
+    """
+    if not settings.DATABASE_ROUTING["HEALTH_CHECKS"]:
+        return
+    for conn in connections.all():
+        if conn.connection is not None and not conn.in_atomic_block and not conn.is_usable():
+            conn.close()
@@ -0,0 +1,129 @@
+"""
+Adaptive concurrency limits per route class.
+
+Each route class keeps an in-flight count and a concurrency limit adjusted
+AIMD-style: the limit grows by roughly one slot per ``limit`` fast requests
+while demand is near it, and is cut multiplicatively (at most once per target
+latency) when requests take longer than the target. Requests beyond the limit
+are shed; high priority classes may run past it up to a headroom factor.
+"""
+import re
+import threading
+import time
+
+from django.conf import settings
+
+
+class RouteClassLimiter:
+
+    def __init__(self, name: str, high_priority: bool, config: dict):
+        self.name = name
+        self.high_priority = high_priority
+        self.target_latency = config["TARGET_LATENCY"]
+        self.max_queue_time = config["MAX_QUEUE_TIME"]
+        self.min_limit = config["MIN_LIMIT"]
+        self.max_limit = config["MAX_LIMIT"]
+        self.headroom = config["HIGH_PRIORITY_HEADROOM"] if high_priority else 1.0
+        self.limit = float(config["INITIAL_LIMIT"])
+        self.in_flight = 0
+        self.admitted = 0
+        self.shed = 0
+        self.latency_ewma = 0.0
+        self.last_decrease = 0.0
+        self.lock = threading.Lock()
+
+    def try_acquire(self, queue_time: float = 0.0) -> bool:
+        with self.lock:
+            too_late = queue_time > self.max_queue_time and not self.high_priority
+            if too_late or self.in_flight >= int(self.limit * self.headroom):
+                self.shed += 1
+                return False
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+
+    def release(self, latency: float) -> None:
+        with self.lock:
+            near_limit = self.in_flight >= self.limit * 0.8
+            self.in_flight -= 1
+            self.latency_ewma = (latency if not self.latency_ewma
+                                 else self.latency_ewma * 0.9 + latency * 0.1)
+            now = time.monotonic()
+            if latency > self.target_latency:
+                if now - self.last_decrease >= self.target_latency:
+                    self.limit = max(self.min_limit, self.limit * 0.9)
+                    self.last_decrease = now
+            elif near_limit:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "limit": int(self.limit),
+                "in_flight": self.in_flight,
+                "admitted": self.admitted,
+                "shed": self.shed,
+                "latency_ewma_ms": round(self.latency_ewma * 1000, 2),
+                "high_priority": self.high_priority,
+            }
+
+
+class LoadShedder:
+    DEFAULT_CLASS = "default"
+
+    def __init__(self, config: dict):
+        self.config = config
+        self.routes = [(re.compile(pattern), name)
+                       for name, pattern, _ in config["ROUTE_CLASSES"]]
+        self.limiters = {
+            name: RouteClassLimiter(name, high_priority, config)
+            for name, _, high_priority in config["ROUTE_CLASSES"]
+        }
+        self.limiters[self.DEFAULT_CLASS] = RouteClassLimiter(
+            self.DEFAULT_CLASS, False, config)
+
+    def limiter_for(self, path: str) -> RouteClassLimiter:
+        for pattern, name in self.routes:
+            if pattern.match(path):
+                return self.limiters[name]
+        return self.limiters[self.DEFAULT_CLASS]
+
+    def snapshot(self) -> dict:
+        return {name: limiter.snapshot() for name, limiter in self.limiters.items()}
+
+
+_shedder = None
+_shedder_lock = threading.Lock()
+
+
+def get_load_shedder() -> LoadShedder:
+    """Process-wide shedder built from settings.LOAD_SHEDDING"""
+    global _shedder
+    if _shedder is None:
+        with _shedder_lock:
+            if _shedder is None:
+                _shedder = LoadShedder(settings.LOAD_SHEDDING)
+    return _shedder
+
+
+def reset_load_shedder() -> None:
+    global _shedder
+    _shedder = None
+
+
+def queue_time_from_header(value: str, now: float, limit: float) -> float:
+    """
+    Seconds a request waited before reaching Django, from an
+    X-Request-Start header set by the proxy ("t=<epoch secs|ms|us>" or bare),
+    clamped to `limit` so a bogus timestamp cannot dominate the latency signal.
+    """
+    if not value:
+        return 0.0
+    try:
+        started = float(value.strip().lstrip("t="))
+    except ValueError:
+        return 0.0
+    # Proxies report seconds, milliseconds or microseconds since the epoch
+    while started > now * 100:
+        started /= 1000
+    return min(limit, max(0.0, now - started))
@@ -0,0 +1,147 @@
+"""
+Non-blocking structured logging.
+
+QueuedRotatingFileHandler only puts records on an in-memory queue. A
+QueueListener thread formats them as JSON lines and writes them to a
+size-rotated file, so request threads never wait on the formatter or disk.
+When the queue is full, records are dropped and counted instead of blocking;
+the count is exported as the log_records_dropped metric.
+SamplingFilter thins out high-volume DEBUG/INFO sources such as
+django.db.backends before a record is even queued.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from .metrics import LOG_RECORDS_DROPPED
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {
+    "message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "module": record.module,
+            "line": record.lineno,
+            "process": record.process,
+            "thread": record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps `rate` of the records below WARNING from each logger in `rates`,
+    matched by the longest logger name prefix. WARNING and above always pass.
+    """
+
+    def __init__(self, rates: dict = None):
+        super().__init__()
+        self.rates = rates or {}
+        self._resolved = {}
+
+    def rate_for(self, name: str) -> float:
+        rate = self._resolved.get(name)
+        if rate is None:
+            rate = 1.0
+            candidate = name
+            while candidate:
+                if candidate in self.rates:
+                    rate = self.rates[candidate]
+                    break
+                candidate = candidate.rpartition(".")[0]
+            self._resolved[name] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rate_for(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class QueuedRotatingFileHandler(QueueHandler):
+    """
+    Queues records for a RotatingFileHandler running on a listener thread.
+    Rotation is per process: when several processes log, put "{pid}" in the
+    filename so each rotates its own file. The listener is restarted in
+    forked children (gunicorn --preload, Celery prefork).
+    """
+
+    def __init__(self, filename: str, max_bytes: int = 50 * 1024 * 1024,
+                 backup_count: int = 5, queue_size: int = 10000):
+        super().__init__(queue.Queue(maxsize=queue_size))
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.queue_size = queue_size
+        self.dropped = 0
+        self._target_formatter = None
+        self._start()
+        os.register_at_fork(after_in_child=self._restart_after_fork)
+        atexit.register(self.close)
+
+    def _start(self) -> None:
+        path = self.filename.format(pid=os.getpid())
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.target = RotatingFileHandler(
+            path, maxBytes=self.max_bytes, backupCount=self.backup_count,
+            encoding="utf-8", delay=True)
+        if self._target_formatter is not None:
+            self.target.setFormatter(self._target_formatter)
+        self.listener = QueueListener(self.queue, self.target)
+        self.listener.start()
+
+    def _restart_after_fork(self) -> None:
+        # The parent's listener thread does not exist in the child
+        self.queue = queue.Queue(maxsize=self.queue_size)
+        self.lock = threading.RLock()
+        self._start()
+
+    def setFormatter(self, fmt) -> None:
+        # Formatting happens on the listener thread, not the logging thread
+        self._target_formatter = fmt
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Only freezes the message, in place: later handlers get the same text
+        from getMessage(). The JSON formatting is left to the listener.
+        """
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            LOG_RECORDS_DROPPED.inc()
+
+    def close(self) -> None:
+        if self.listener is not None and self.listener._thread is not None:
+            # Writes out whatever is still queued
+            self.listener.stop()
+            self.target.close()
+        super().close()
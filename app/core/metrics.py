@@ -0,0 +1,143 @@
+"""
+Prometheus metrics for the auth and OTP hot paths.
+
+Metrics live in prometheus_client's default registry: updating one is a lock
+and an add, with no I/O. For gunicorn workers and Celery prefork children, set
+PROMETHEUS_MULTIPROC_DIR to an empty directory before the processes start.
+Each process then writes its values to mmap files in that directory, and the
+scrape endpoint merges them. Exiting processes are marked dead through
+gunicorn.conf.py and worker_process_shutdown, as multiprocess mode requires.
+
+The API serves its metrics from the scrape endpoint. The SMS and queue lag
+metrics are recorded by Celery workers, so each worker's main process serves
+the merged values of its children over HTTP on METRICS["WORKER_PORT"]. Give
+every container its own directory: the entrypoints use a subdirectory named
+after the host, so containers sharing a volume don't merge or wipe each
+other's files.
+"""
+import os
+import time
+
+from django.conf import settings
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter,
+                               Histogram, generate_latest, multiprocess, start_http_server)
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Time spent handling a request, by view",
+    ["endpoint", "method"], buckets=LATENCY_BUCKETS)
+REQUESTS = Counter(
+    "http_requests", "Requests handled, by view and status code",
+    ["endpoint", "method", "status"])
+DB_QUERIES = Histogram(
+    "http_request_db_queries", "Database queries run by one request",
+    ["endpoint"], buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100))
+DB_DURATION = Histogram(
+    "http_request_db_duration_seconds", "Time one request spent in database queries",
+    ["endpoint"], buckets=LATENCY_BUCKETS)
+PASSWORD_HASH_DURATION = Histogram(
+    "password_hash_duration_seconds", "Time to hash (encode) or check (verify) a password",
+    ["operation"], buckets=(.01, .025, .05, .1, .2, .3, .5, 1, 2))
+SMS_SENT = Counter("sms_sent", "SMS handed to the provider, by outcome", ["outcome"])
+SMS_LATENCY = Histogram(
+    "sms_issue_to_send_seconds",
+    "From the OTP being issued (task published) until the SMS provider accepted or refused it",
+    ["outcome"], buckets=(.05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 300))
+LOG_RECORDS_DROPPED = Counter(
+    "log_records_dropped", "Log records dropped because the log handler's queue was full")
+BLOOM_FILTER_INVALIDATIONS = Counter(
+    "bloom_filter_invalidations",
+    "Shared Bloom filters dropped because an addition could not be recorded safely",
+    ["namespace", "reason"])
+CELERY_QUEUE_LAG = Histogram(
+    "celery_queue_lag_seconds", "From a task being published until a worker started it",
+    ["task"], buckets=(.01, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 300))
+
+
+def is_multiprocess() -> bool:
+    return "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+
+def metrics_registry():
+    """The registry to expose: this process's, or every process's in multiprocess mode"""
+    if not is_multiprocess():
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def render_metrics() -> tuple:
+    """Returns (body, content type) in the Prometheus text format"""
+    return generate_latest(metrics_registry()), CONTENT_TYPE_LATEST
+
+
+def start_worker_exporter(**kwargs) -> None:
+    """worker_init: serve the worker's metrics, since it has no scrape endpoint"""
+    config = settings.METRICS
+    if config["ENABLED"] and config["WORKER_PORT"]:
+        start_http_server(config["WORKER_PORT"], registry=metrics_registry())
+
+
+def mark_process_dead(pid: int) -> None:
+    if is_multiprocess():
+        multiprocess.mark_process_dead(pid)
+
+
+class QueryStats:
+    """Database execute wrapper counting the queries and time of one request"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+
+def observe_request(request, response, duration: float, query_stats: QueryStats = None) -> None:
+    match = getattr(request, "resolver_match", None)
+    # View names keep the label set small; raw paths would include ids
+    endpoint = match.view_name if match else "unmatched"
+    REQUEST_LATENCY.labels(endpoint, request.method).observe(duration)
+    REQUESTS.labels(endpoint, request.method, str(response.status_code)).inc()
+    if query_stats is not None:
+        DB_QUERIES.labels(endpoint).observe(query_stats.count)
+        DB_DURATION.labels(endpoint).observe(query_stats.duration)
+
+
+def observe_sms(outcome: str, issued_at: float = None) -> None:
+    SMS_SENT.labels(outcome).inc()
+    if issued_at:
+        SMS_LATENCY.labels(outcome).observe(max(0.0, time.time() - issued_at))
+
+
+def stamp_publish_time(headers=None, **kwargs) -> None:
+    """before_task_publish: record when the task was published"""
+    if headers is not None:
+        headers.setdefault("published_at", time.time())
+
+
+def task_published_at(request):
+    """The stamped publish time of a task request, if it has one"""
+    # Workers expose custom message headers as request attributes; eager
+    # calls keep them under request.headers
+    return request.get("published_at") or (request.get("headers") or {}).get("published_at")
+
+
+def observe_queue_lag(task=None, **kwargs) -> None:
+    """task_prerun: how long the task waited in the broker"""
+    published_at = task_published_at(task.request) if task is not None else None
+    if published_at:
+        CELERY_QUEUE_LAG.labels(task.name).observe(max(0.0, time.time() - published_at))
+
+
+def mark_worker_process_dead(pid=None, **kwargs) -> None:
+    """worker_process_shutdown: drop the exiting prefork child's live values"""
+    mark_process_dead(pid or os.getpid())
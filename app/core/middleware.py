@@ -0,0 +1,176 @@
+import asyncio
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.http import JsonResponse
+
+from .db import finish_request_routing, start_request_routing
+from .load_shedding import get_load_shedder, queue_time_from_header
+from .metrics import QueryStats, observe_request
+from .profiling import RequestProfile, profile_buffer, sample_reason
+
+
+class AdaptiveLoadSheddingMiddleware:
+    """
+    Sheds requests with a fast 503 once their route class is at its adaptive
+    concurrency limit, so a spike on one class (e.g. login hashing) cannot
+    queue every other endpoint behind it.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = settings.LOAD_SHEDDING["ENABLED"]
+        self.retry_after = settings.LOAD_SHEDDING["RETRY_AFTER"]
+        self.trust_request_start = settings.LOAD_SHEDDING["TRUST_REQUEST_START"]
+        self.request_timeout = settings.LOAD_SHEDDING["REQUEST_TIMEOUT"]
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # Mark the instance itself as a coroutine function for the handler
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+        limiter, started = self.admit(request)
+        if limiter is None:
+            return self.shed_response()
+        try:
+            return self.get_response(request)
+        finally:
+            limiter.release(time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+        limiter, started = self.admit(request)
+        if limiter is None:
+            return self.shed_response()
+        try:
+            return await self.get_response(request)
+        finally:
+            limiter.release(time.perf_counter() - started)
+
+    def admit(self, request):
+        limiter = get_load_shedder().limiter_for(request.path_info)
+        queue_time = 0.0
+        if self.trust_request_start:
+            queue_time = queue_time_from_header(
+                request.META.get("HTTP_X_REQUEST_START"), time.time(), self.request_timeout)
+        if not limiter.try_acquire(queue_time):
+            return None, None
+        # Time spent queued in front of Django counts toward the latency signal
+        return limiter, time.perf_counter() - queue_time
+
+    def shed_response(self):
+        response = JsonResponse(
+            {"success": False, "errors": "Server is busy, please retry shortly."}, status=503)
+        response["Retry-After"] = str(self.retry_after)
+        return response
+
+
+class DatabaseRoutingMiddleware:
+    """Scopes replica routing to one request and pins clients that wrote to the primary"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        start_request_routing()
+        response = self.get_response(request)
+        finish_request_routing(getattr(request, "user", None))
+        return response
+
+    async def __acall__(self, request):
+        start_request_routing()
+        response = await self.get_response(request)
+        # request.user may be a lazy object that loads from the DB
+        await sync_to_async(finish_request_routing)(getattr(request, "user", None))
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Records latency, status and database query count/time per view. Async
+    views run their queries on other threads, so only latency and status are
+    recorded for them.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = settings.METRICS["ENABLED"]
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+        query_stats = QueryStats()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(query_stats))
+            response = self.get_response(request)
+        observe_request(request, response, time.perf_counter() - started, query_stats)
+        return response
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        observe_request(request, response, time.perf_counter() - started)
+        return response
+
+
+class ProfilingMiddleware:
+    """Profiles sampled sync requests (see core.profiling); async requests pass through"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        reason = sample_reason(request)
+        if reason is None:
+            return self.get_response(request)
+        profile = RequestProfile(request, reason)
+        query_stats = QueryStats()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(query_stats))
+            profile.start()
+            try:
+                response = self.get_response(request)
+            except BaseException:
+                profile.sampler.stop()
+                raise
+        profile_buffer.append(profile.finish(response, query_stats))
+        return response
+
+    async def __acall__(self, request):
+        return await self.get_response(request)
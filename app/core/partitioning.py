@@ -0,0 +1,144 @@
+"""
+Range partitioning by created_at for short-lived Postgres tables.
+
+Rows expire by dropping whole partitions rather than by deleting rows, which
+would leave dead tuples for vacuum. Queries that filter on created_at only
+touch the partitions inside that window (partition pruning). A DEFAULT
+partition catches rows if maintenance falls behind; they are moved into their
+own partition when it is created.
+"""
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+
+from django.db import connection, transaction
+
+INTERVALS = {
+    "hourly": (timedelta(hours=1), "%Y%m%d%H"),
+    "daily": (timedelta(days=1), "%Y%m%d"),
+}
+
+
+class PartitionedTable:
+
+    def __init__(self, table: str, interval: str, retention: timedelta,
+                 indexes: list = (), foreign_keys: list = ()):
+        """
+        `indexes` are column tuples and `foreign_keys` are (column, table,
+        column) tuples, recreated on the partitioned table when converting.
+        """
+        self.table = table
+        self.step, self.suffix_format = INTERVALS[interval]
+        self.interval = interval
+        self.retention = retention
+        self.indexes = indexes
+        self.foreign_keys = foreign_keys
+        self.default_partition = f"{table}_default"
+
+    def floor(self, moment: datetime) -> datetime:
+        moment = moment.replace(minute=0, second=0, microsecond=0)
+        return moment if self.interval == "hourly" else moment.replace(hour=0)
+
+    def partition_name(self, start: datetime) -> str:
+        return f"{self.table}_p{start.strftime(self.suffix_format)}"
+
+    def is_partitioned(self) -> bool:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+                "WHERE c.relname = %s", [self.table])
+            return cursor.fetchone() is not None
+
+    def partitions(self) -> dict:
+        """Start of each range partition -> its name"""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT c.relname FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid "
+                "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = %s", [self.table])
+            names = [row[0] for row in cursor.fetchall()]
+        prefix = f"{self.table}_p"
+        partitions = {}
+        for name in names:
+            if name.startswith(prefix):
+                start = datetime.strptime(name[len(prefix):], self.suffix_format)
+                partitions[start.replace(tzinfo=dt_timezone.utc)] = name
+        return partitions
+
+    @transaction.atomic
+    def convert(self, now: datetime, precreate: int) -> None:
+        """Swap the plain table for a partitioned one, keeping rows still inside retention"""
+        now = now.astimezone(dt_timezone.utc)
+        quote = connection.ops.quote_name
+        old = f"{self.table}_unpartitioned"
+        with connection.cursor() as cursor:
+            # Deferred FK checks queued on the old table would block dropping it
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+            cursor.execute(f"ALTER TABLE {quote(self.table)} RENAME TO {quote(old)}")
+            cursor.execute(
+                f"CREATE TABLE {quote(self.table)} (LIKE {quote(old)} INCLUDING DEFAULTS) "
+                f"PARTITION BY RANGE (created_at)")
+            # The partition key must be part of every unique constraint. The old
+            # table keeps its "<table>_pkey" name until it is dropped.
+            cursor.execute(
+                f"ALTER TABLE {quote(self.table)} ADD CONSTRAINT "
+                f"{quote(self.table + '_partitioned_pkey')} PRIMARY KEY (id, created_at)")
+            for columns in self.indexes:
+                cursor.execute(
+                    f"CREATE INDEX {quote(self.table + '_' + '_'.join(columns) + '_idx')} "
+                    f"ON {quote(self.table)} ({', '.join(quote(column) for column in columns)})")
+            for column, ref_table, ref_column in self.foreign_keys:
+                cursor.execute(
+                    f"ALTER TABLE {quote(self.table)} ADD FOREIGN KEY ({quote(column)}) "
+                    f"REFERENCES {quote(ref_table)} ({quote(ref_column)}) "
+                    f"ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED")
+            cursor.execute(
+                f"CREATE TABLE {quote(self.default_partition)} PARTITION OF {quote(self.table)} DEFAULT")
+        self.maintain(now, precreate)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {quote(self.table)} SELECT * FROM {quote(old)} WHERE created_at >= %s",
+                [now - self.retention])
+            cursor.execute(f"DROP TABLE {quote(old)}")
+
+    @transaction.atomic
+    def maintain(self, now: datetime, precreate: int):
+        """
+        Create partitions up to `precreate` steps ahead and drop expired ones.
+        Returns (created, dropped) partition names.
+        """
+        now = now.astimezone(dt_timezone.utc)
+        quote = connection.ops.quote_name
+        existing = self.partitions()
+        created, dropped = [], []
+        start = self.floor(now - self.retention)
+        while start <= self.floor(now) + self.step * precreate:
+            if start not in existing:
+                self.create_partition(start)
+                created.append(self.partition_name(start))
+            start += self.step
+
+        expired_before = now - self.retention
+        with connection.cursor() as cursor:
+            for start, name in sorted(existing.items()):
+                if start + self.step <= expired_before:
+                    cursor.execute(f"DROP TABLE {quote(name)}")
+                    dropped.append(name)
+            cursor.execute(
+                f"DELETE FROM {quote(self.default_partition)} WHERE created_at < %s",
+                [expired_before])
+        return created, dropped
+
+    def create_partition(self, start: datetime) -> None:
+        """Create and attach one partition, moving its rows out of the DEFAULT partition"""
+        quote = connection.ops.quote_name
+        name, end = self.partition_name(start), start + self.step
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TABLE {quote(name)} (LIKE {quote(self.table)} INCLUDING DEFAULTS)")
+            cursor.execute(
+                f"WITH moved AS (DELETE FROM {quote(self.default_partition)} "
+                f"WHERE created_at >= %s AND created_at < %s RETURNING *) "
+                f"INSERT INTO {quote(name)} SELECT * FROM moved", [start, end])
+            cursor.execute(
+                f"ALTER TABLE {quote(self.table)} ATTACH PARTITION {quote(name)} "
+                f"FOR VALUES FROM (%s) TO (%s)", [start, end])
@@ -0,0 +1,154 @@
+"""
+Sampling request profiler.
+
+A profiled request records its wall time, CPU time, SQL count and duration,
+and its hottest stack frames. A helper thread snapshots the request thread's
+stack every STACK_INTERVAL and counts the innermost frame, both overall and
+within this project's code. Requests are profiled when they send
+"X-Profile: <HEADER_TOKEN>", or at random at the rate of the first matching
+ROUTES pattern (SAMPLE_RATE otherwise). A request that is not profiled costs
+one random() call.
+
+Samples go into a ring buffer of BUFFER_SIZE slots in the default cache.
+Admins see samples from every worker process because CACHES points at Redis;
+with a per-process cache they would only see the worker that answered. Only
+sync views are profiled: the stack of an event loop thread mixes many requests.
+"""
+import hmac
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+PROJECT_ROOT = str(Path(__file__).resolve().parent.parent)
+
+
+def sample_reason(request):
+    """Why this request should be profiled, or None"""
+    config = settings.PROFILING
+    if not config["ENABLED"]:
+        return None
+    header = request.META.get("HTTP_X_PROFILE")
+    # Bytes: compare_digest raises TypeError on non-ASCII str
+    if header and config["HEADER_TOKEN"] and hmac.compare_digest(
+            header.encode(), config["HEADER_TOKEN"].encode()):
+        return "header"
+    rate = config["SAMPLE_RATE"]
+    for pattern, route_rate in config["ROUTES"]:
+        if re.match(pattern, request.path_info):
+            rate = route_rate
+            break
+    return "sampled" if rate and random.random() < rate else None
+
+
+def is_project_frame(filename: str) -> bool:
+    return filename.startswith(PROJECT_ROOT) and "site-packages" not in filename
+
+
+class StackSampler(threading.Thread):
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(name="request-profiler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = 0
+        self.leaf_frames = Counter()
+        self.project_frames = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.samples += 1
+            self.leaf_frames[self.describe(frame)] += 1
+            while frame is not None:
+                if is_project_frame(frame.f_code.co_filename):
+                    self.project_frames[self.describe(frame)] += 1
+                    break
+                frame = frame.f_back
+
+    @staticmethod
+    def describe(frame) -> str:
+        return f"{frame.f_code.co_name} ({frame.f_code.co_filename}:{frame.f_lineno})"
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+
+    def top(self, counter: Counter, limit: int) -> list:
+        return [{"frame": frame, "samples": count, "ratio": round(count / self.samples, 3)}
+                for frame, count in counter.most_common(limit)]
+
+
+class ProfileBuffer:
+    """Fixed number of cache slots written round-robin; the oldest sample is overwritten"""
+
+    def __init__(self, namespace: str):
+        self.seq_key = f"{namespace}:seq"
+        self.slot_prefix = f"{namespace}:slot"
+
+    def slot_keys(self) -> list:
+        return [f"{self.slot_prefix}:{index}" for index in range(settings.PROFILING["BUFFER_SIZE"])]
+
+    def append(self, sample: dict) -> None:
+        cache.add(self.seq_key, 0, timeout=None)
+        seq = cache.incr(self.seq_key)
+        sample["id"] = seq
+        slot = seq % settings.PROFILING["BUFFER_SIZE"]
+        cache.set(f"{self.slot_prefix}:{slot}", sample, timeout=None)
+
+    def samples(self) -> list:
+        """Newest first"""
+        return sorted(cache.get_many(self.slot_keys()).values(),
+                      key=lambda sample: sample["id"], reverse=True)
+
+    def clear(self) -> None:
+        cache.delete_many(self.slot_keys() + [self.seq_key])
+
+
+profile_buffer = ProfileBuffer("request-profiles")
+
+
+class RequestProfile:
+
+    def __init__(self, request, reason: str):
+        self.request = request
+        self.reason = reason
+        self.sampler = StackSampler(threading.get_ident(), settings.PROFILING["STACK_INTERVAL"])
+
+    def start(self) -> None:
+        self.started_at = timezone.now()
+        self.wall_started = time.perf_counter()
+        self.cpu_started = time.thread_time()
+        self.sampler.start()
+
+    def finish(self, response, query_stats) -> dict:
+        wall = time.perf_counter() - self.wall_started
+        cpu = time.thread_time() - self.cpu_started
+        self.sampler.stop()
+        match = getattr(self.request, "resolver_match", None)
+        limit = settings.PROFILING["TOP_FRAMES"]
+        return {
+            "endpoint": match.view_name if match else None,
+            "method": self.request.method,
+            "path": self.request.path_info,
+            "status": response.status_code,
+            "reason": self.reason,
+            "started_at": self.started_at.isoformat(),
+            "wall_ms": round(wall * 1000, 2),
+            "cpu_ms": round(cpu * 1000, 2),
+            "sql_count": query_stats.count,
+            "sql_ms": round(query_stats.duration * 1000, 2),
+            "stack_samples": self.sampler.samples,
+            "top_frames": self.sampler.top(self.sampler.leaf_frames, limit),
+            "top_project_frames": self.sampler.top(self.sampler.project_frames, limit),
+        }
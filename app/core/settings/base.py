@@ -13,7 +13,7 @@ import os
 from pathlib import Path
 from corsheaders.defaults import default_headers
 from datetime import timedelta
-from decouple import config
+from decouple import Csv, config
 import dj_database_url
 
 
@@ -56,18 +56,31 @@ INSTALLED_APPS = [
 AUTH_USER_MODEL = "user.User"
 
 MIDDLEWARE = [
+    "core.middleware.AdaptiveLoadSheddingMiddleware",
+    "core.middleware.MetricsMiddleware",
+    "core.middleware.ProfilingMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "core.middleware.DatabaseRoutingMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
 ROOT_URLCONF = 'core.urls'
 
+# Prometheus metrics (core.metrics), scraped from /api/v1/ops/metrics/ on the API
+# and from WORKER_PORT on each Celery worker (SMS and queue lag metrics).
+# With several worker processes also set PROMETHEUS_MULTIPROC_DIR in the environment.
+METRICS = {
+    "ENABLED": config("METRICS_ENABLED", default=True, cast=bool),
+    "SCRAPE_TOKEN": config("METRICS_SCRAPE_TOKEN", default=""), #bearer token; empty refuses every scrape
+    "WORKER_PORT": config("METRICS_WORKER_PORT", default=9540, cast=int), #internal network only; 0 disables
+}
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -100,11 +113,52 @@ LOGOUT_URL = "rest_framework:logout"
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
 
 
-DATABASES = {
-    "default": dj_database_url.config(default=config('DATABASE_URL'))
+DATABASE_ROUTING = {
+    "CONN_MAX_AGE": config('DB_CONN_MAX_AGE', default=60, cast=int), #secs a connection is reused; 0 closes it after each request
+    "HEALTH_CHECKS": config('DB_HEALTH_CHECKS', default=True, cast=bool), #ping persistent connections before each request
+    # pgbouncer in transaction pooling mode can't keep server-side cursors open across statements
+    "PGBOUNCER": config('DB_PGBOUNCER', default=False, cast=bool),
+    "REPLICA_PIN_SECONDS": 5, #secs a client that wrote keeps reading from the primary
 }
 
+DATABASES = {
+    "default": dj_database_url.config(
+        default=config('DATABASE_URL'), conn_max_age=DATABASE_ROUTING["CONN_MAX_AGE"])
+}
+for index, url in enumerate(config('DATABASE_REPLICA_URLS', default='', cast=Csv())):
+    DATABASES[f"replica_{index}"] = {
+        **dj_database_url.parse(url, conn_max_age=DATABASE_ROUTING["CONN_MAX_AGE"]),
+        "TEST": {"MIRROR": "default"},
+    }
+for database in DATABASES.values():
+    database["DISABLE_SERVER_SIDE_CURSORS"] = DATABASE_ROUTING["PGBOUNCER"]
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != "default"]
+DATABASE_ROUTERS = ["core.db.ReplicaRouter"]
+
+
+
+# Sampling request profiler (core.profiling); samples are listed at /api/v1/ops/profiles/
+PROFILING = {
+    "ENABLED": config("PROFILING_ENABLED", default=False, cast=bool),
+    "SAMPLE_RATE": 0.0, #fraction of requests profiled when no route matches
+    # (path regex, sample rate); the first match wins
+    "ROUTES": [
+        (r"^/api/v1/auth/login/", 0.01),
+    ],
+    "HEADER_TOKEN": config("PROFILING_HEADER_TOKEN", default=""), #"X-Profile: <token>" profiles a request
+    "STACK_INTERVAL": 0.005, #secs between stack samples
+    "TOP_FRAMES": 10,
+    "BUFFER_SIZE": 200, #samples kept
+}
 
+# Django's default hashers, with PBKDF2 timed for the password_hash_duration_seconds metric
+PASSWORD_HASHERS = [
+    "core.hashers.InstrumentedPBKDF2PasswordHasher",
+    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+    "django.contrib.auth.hashers.Argon2PasswordHasher",
+    "django.contrib.auth.hashers.BCryptSHA256PasswordHasher",
+    "django.contrib.auth.hashers.ScryptPasswordHasher",
+]
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -129,11 +183,16 @@ REST_FRAMEWORK = {
     "DEFAULT_PAGINATION_CLASS": "core.pagination.CustomPagination",
     "PAGE_SIZE": 20,
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "user.authentication.JWTAuthentication",
+        "user.authentication.APIKeyAuthentication",
         "rest_framework.authentication.BasicAuthentication",
         "rest_framework.authentication.SessionAuthentication",
     ),
     "TEST_REQUEST_DEFAULT_FORMAT": "json",
+    # Proxies in front of the app that append to X-Forwarded-For. With 0 the client
+    # IP used by the per-IP throttles is REMOTE_ADDR; unset, DRF would trust any
+    # X-Forwarded-For a client sends, so the per-IP limits could be bypassed.
+    "NUM_PROXIES": config('NUM_PROXIES', default=0, cast=int),
 }
 
 
@@ -147,8 +206,38 @@ SIMPLE_JWT = {
     "AUTH_HEADER_TYPES": ("Bearer",),
     "AUTH_HEADER_NAME": "HTTP_AUTHORIZATION",
     "USER_ID_FIELD": "id",
-    "USER_ID_CLAIM": "user_id"
-    
+    "USER_ID_CLAIM": "user_id",
+    "TOKEN_REFRESH_SERIALIZER": "user.serializers.TokenRefreshSerializer",
+}
+
+API_KEYS = {
+    "CACHE_SIZE": 1024, #verified keys kept per process
+    "CACHE_TTL": 60, #secs a verified key is trusted before it is re-checked against the DB (revocations apply at once)
+}
+
+TOKEN_REVOCATION = {
+    "SYNC_INTERVAL": 1.0, #secs a process answers revocation checks from memory before re-checking the cache
+    "REQUEST_LOCK_WAIT": 0.2, #secs a request waits for the state lock before revoking in a Celery task
+}
+
+# Batch introspection for internal services (gateway) authenticated by
+# an X-Internal-Service-Token header matching one of SERVICE_TOKENS
+TOKEN_INTROSPECTION = {
+    "SERVICE_TOKENS": config('INTERNAL_SERVICE_TOKENS', default='', cast=Csv()),
+    "MAX_BATCH": 100,
+    "INVALID_RESULT_TTL": 60, #secs a rejected token's result stays cached
+}
+
+# Asymmetric signing replaces SIMPLE_JWT's ALGORITHM/SIGNING_KEY for new tokens;
+# set JWT_ALGORITHM=HS256 to keep signing with SECRET_KEY
+JWT_SIGNING = {
+    "ALGORITHM": config('JWT_ALGORITHM', default='RS256'), #RS256 or EdDSA
+    "RSA_KEY_SIZE": 2048,
+    "ROTATION_INTERVAL": timedelta(days=30),
+    "PUBLISH_AHEAD": timedelta(days=1), #new keys are in the JWKS this long before they sign
+    "KEY_CACHE_TTL": 60, #secs each process reuses the loaded keys
+    "JWKS_MAX_AGE": 60 * 60, #secs verifiers may cache the JWKS; keep well below PUBLISH_AHEAD
+    "ACCEPT_LEGACY_TOKENS": True, #verify kid-less HS256 tokens issued before the switch
 }
 # Internationalization
 # https://docs.djangoproject.com/en/4.0/topics/i18n/
@@ -178,20 +267,50 @@ DATE_INPUT_FORMATS = [
 ]
 
 
+# Request threads only enqueue records (core.logs); a listener thread writes
+# them as JSON lines to a size-rotated file, one per process ("{pid}"), since
+# gunicorn and Celery run several processes that would otherwise rotate one file.
+# Dropped records are counted in the log_records_dropped metric.
+LOG = {
+    'FILE': config('LOG_FILE', default='logs/debug-{pid}.log'),
+    'LEVEL': config('LOG_LEVEL', default='DEBUG'),
+    'MAX_BYTES': config('LOG_MAX_BYTES', default=50 * 1024 * 1024, cast=int), #bytes
+    'BACKUP_COUNT': config('LOG_BACKUP_COUNT', default=5, cast=int),
+    'QUEUE_SIZE': 10000, #records; further records are dropped, never waited on
+    # Fraction of DEBUG/INFO records kept per logger (and its children)
+    'SAMPLE_RATES': {
+        'django.db.backends': config('LOG_SQL_SAMPLE_RATE', default=0.01, cast=float),
+    },
+}
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'core.logs.JsonFormatter'},
+    },
+    'filters': {
+        'sampling': {
+            '()': 'core.logs.SamplingFilter',
+            'rates': LOG['SAMPLE_RATES'],
+        },
+    },
     'handlers': {
         'file': {
-            'level': 'DEBUG',
-            'class': 'logging.FileHandler',
-            'filename': 'logs/debug.log'
+            'level': LOG['LEVEL'],
+            'class': 'core.logs.QueuedRotatingFileHandler',
+            'filename': LOG['FILE'],
+            'max_bytes': LOG['MAX_BYTES'],
+            'backup_count': LOG['BACKUP_COUNT'],
+            'queue_size': LOG['QUEUE_SIZE'],
+            'formatter': 'json',
+            'filters': ['sampling'],
         },
     },
     'loggers': {
         'django': {
             'handlers': ['file'],
-            'level': 'DEBUG',
+            'level': LOG['LEVEL'],
             'propagate': True,
         },
     }
@@ -199,16 +318,136 @@ LOGGING = {
 
 TOKEN_LIFESPAN = 10 #mins
 
+# Adaptive per-route-class concurrency limits (core.middleware.AdaptiveLoadSheddingMiddleware)
+LOAD_SHEDDING = {
+    "ENABLED": config('LOAD_SHEDDING_ENABLED', default=True, cast=bool),
+    "TARGET_LATENCY": 0.5, #secs; slower requests shrink the limit
+    "MAX_QUEUE_TIME": 2.0, #secs waited in front of Django (X-Request-Start) before shedding
+    # Only turn on behind a proxy that overwrites X-Request-Start; otherwise
+    # any client could claim a huge queue time and shrink every limit
+    "TRUST_REQUEST_START": config('LOAD_SHEDDING_TRUST_REQUEST_START', default=False, cast=bool),
+    "REQUEST_TIMEOUT": 30, #secs; reported queue times are clamped to this
+    "INITIAL_LIMIT": 20,
+    "MIN_LIMIT": 2,
+    "MAX_LIMIT": 200,
+    "HIGH_PRIORITY_HEADROOM": 2.0, #high priority classes may run this far past the limit
+    "RETRY_AFTER": 2, #secs
+    # (name, path regex, high priority); unmatched paths use the "default" class
+    "ROUTE_CLASSES": [
+        ("token", r"^/api/v1/auth/token/(refresh|verify)/", True),
+        ("login", r"^/api/v1/auth/login/", False),
+        ("otp", r"^/api/v1/(async/)?(user/$|auth/(verify-account|initiate-password-reset|create-password)/)", False),
+    ],
+}
+
 OTP_EXPIRE_TIME = 10 #mins
 
+# Range partitions by created_at for PendingUser and Token, so expired OTPs are
+# dropped a partition at a time. Opt in with `manage.py partition_otp_tables --convert`;
+# unconverted tables have their expired rows deleted by the same beat task.
+OTP_PARTITIONING = {
+    "INTERVAL": config("OTP_PARTITION_INTERVAL", default="hourly"), #hourly or daily
+    "PRECREATE": 3, #partitions created ahead of time
+}
+
+IDEMPOTENCY_KEY_TTL = OTP_EXPIRE_TIME * 60 #secs a response is replayed for retries with the same key
+IDEMPOTENCY_LOCK_TTL = 30 #secs a key stays locked while its first request runs
+
+# OTP issuance limits, checked before any DB or broker work
+OTP_THROTTLE = {
+    "ENABLED": config('OTP_THROTTLE_ENABLED', default=True, cast=bool),
+    "PHONE": (3, 10 * 60), #OTPs per phone per sliding window (secs)
+    "IP": (20, 60 * 60), #OTPs per client IP per sliding window (secs)
+    "GLOBAL_BUCKET": (50, 5.0), #burst capacity, sustained OTPs per sec across all clients
+}
+
+# Password checks by anonymous endpoints that don't issue OTPs (API key creation)
+CREDENTIAL_THROTTLE = {
+    "ENABLED": config('CREDENTIAL_THROTTLE_ENABLED', default=True, cast=bool),
+    "PHONE": (5, 15 * 60), #attempts per phone per sliding window (secs)
+    "IP": (20, 60 * 60), #attempts per client IP per sliding window (secs)
+}
+
+# Failed OTP guesses allowed before the code is invalidated and guesses are
+# rejected without a DB lookup, per phone
+OTP_VERIFICATION_ATTEMPTS = {
+    "MAX_FAILURES": 5,
+    "LOCKOUT": OTP_EXPIRE_TIME * 60, #secs
+}
+
+# Authenticator-app (TOTP) second factor
+FIELD_ENCRYPTION_KEY = config('FIELD_ENCRYPTION_KEY', default=SECRET_KEY)
+TOTP = {
+    "ISSUER": config('TOTP_ISSUER', default='Django OTP'),
+    "DIGITS": 6,
+    "INTERVAL": 30, #secs per time step
+    "VALID_WINDOW": 1, #time steps of clock drift accepted either side of now
+    "CHALLENGE_TTL": 5 * 60, #secs a login challenge stays valid
+}
+
+# Bloom filter of registered phones that lets onboarding/reset skip the DB on definite misses.
+# Rebuild with `manage.py rebuild_phone_filter`; until then every check goes to the DB.
+REGISTERED_PHONE_FILTER = {
+    "CAPACITY": 1_000_000,
+    "ERROR_RATE": 0.001,
+    "COMPACT_AFTER": 1000, #phones added before the shared snapshot is rewritten
+}
+
+# Auth event log (user.events): buffered per process, written in batches
+AUTH_EVENTS = {
+    "ENABLED": config("AUTH_EVENTS_ENABLED", default=True, cast=bool),
+    "BATCH_SIZE": 200, #events per bulk insert
+    "FLUSH_INTERVAL": 5, #secs an event may wait in the buffer, checked as requests finish
+    "MAX_BUFFERED": 5000, #events held before a flush is forced inline
+}
+
+FUNNEL_MAX_RANGE_DAYS = 366 #widest onboarding funnel report, in days
+
+USER_EXPORT_CHUNK_SIZE = 2000 #rows fetched per server-side cursor round trip
+
+BULK_ONBOARD_MAX_ROWS = 10000
+BULK_OTP_CHUNK_SIZE = 100 #SMS sent per celery task
+BULK_DELETE_CHUNK_SIZE = 500 #users deleted per statement batch
+BULK_JOB_PROGRESS_TTL = 24 * 60 * 60 #secs
+
+# Seconds admin responses of each UserViewsets action stay cached; 0/absent disables
+USER_RESPONSE_CACHE_TIMEOUTS = {
+    "list": 5 * 60,
+    "retrieve": 0,
+}
+
 
 
 CELERY_ACCEPT_CONTENT = ['application/json']
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_BROKER_URL = config('RABBITMQ_URL')
+CELERY_BEAT_SCHEDULE = {
+    "rotate-jwt-signing-keys": {
+        "task": "user.tasks.rotate_signing_keys",
+        "schedule": 60 * 60, #secs
+    },
+    "maintain-otp-partitions": {
+        "task": "user.tasks.maintain_otp_partitions",
+        "schedule": 15 * 60, #secs
+    },
+    "rebuild-phone-filter": {
+        "task": "user.tasks.rebuild_phone_filter",
+        "schedule": 5 * 60, #secs; only rebuilds a missing or invalidated filter
+    },
+}
 FLOWER_BASIC_AUTH = os.environ.get('FLOWER_BASIC_AUTH')
 
+# Shared by every gunicorn worker, Celery worker and host: rate limits, OTP
+# lockouts, token revocations, job progress and cached responses live here.
+# A per-process cache would silently split all of them per worker.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": config("REDIS_URL", default="redis://redis:6379/0"),
+    }
+}
+
 SESSION_ENGINE = "django.contrib.sessions.backends.cache"
 SESSION_CACHE_ALIAS = "default"
 
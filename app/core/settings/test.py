@@ -0,0 +1,8 @@
+from .dev import *
+
+# Tests run in one process, so an in-memory cache is shared by everything
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+}
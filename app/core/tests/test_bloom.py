@@ -0,0 +1,68 @@
+import logging
+
+from django.core.cache import cache
+
+from core.utils.bloom import BloomFilter, SharedBloomFilter
+
+
+class TestBloomFilter:
+
+    def test_no_false_negatives(self):
+        bloom = BloomFilter.for_capacity(1000, 0.01)
+        phones = [f"+23480{n:08d}" for n in range(1000)]
+        for phone in phones:
+            bloom.add(phone)
+        assert all(phone in bloom for phone in phones)
+
+    def test_false_positive_rate_close_to_target(self):
+        bloom = BloomFilter.for_capacity(1000, 0.01)
+        for n in range(1000):
+            bloom.add(f"+23480{n:08d}")
+        false_positives = sum(f"+23490{n:08d}" in bloom for n in range(10000))
+        assert false_positives < 300
+
+
+class TestSharedBloomFilter:
+
+    def test_unbuilt_filter_reports_maybe_present(self):
+        shared = SharedBloomFilter("test-phones", 1000, 0.01)
+        assert shared.might_contain("+2348000000001")
+        shared.add("+2348000000001")  # no-op until built
+        assert not shared.is_ready()
+
+    def test_additions_reach_other_processes(self):
+        writer = SharedBloomFilter("test-phones", 1000, 0.01, compact_after=3)
+        reader = SharedBloomFilter("test-phones", 1000, 0.01, compact_after=3)
+        writer.rebuild(["+2348000000001"])
+        assert reader.might_contain("+2348000000001")
+        assert not reader.might_contain("+2348000000002")
+
+        for n in range(2, 6):  # crosses compact_after, forcing a new snapshot
+            writer.add(f"+234800000000{n}")
+        assert all(reader.might_contain(f"+234800000000{n}") for n in range(1, 6))
+
+    def test_additions_during_rebuild_are_kept(self):
+        shared = SharedBloomFilter("test-phones", 1000, 0.01)
+        other = SharedBloomFilter("test-phones", 1000, 0.01)
+
+        def phones():
+            yield "+2348000000001"
+            other.add("+2348000000002")  # committed after the rebuild's query started
+
+        shared.rebuild(phones())
+        assert other.might_contain("+2348000000002")
+        assert not other.might_contain("+2348000000003")
+        assert cache.get(shared.pending_key) is None
+
+    def test_lost_snapshot_invalidates_on_add(self, caplog):
+        writer = SharedBloomFilter("test-phones", 1000, 0.01)
+        writer.rebuild(["+2348000000001"])
+        cache.delete(writer.snapshot_key)
+
+        fresh = SharedBloomFilter("test-phones", 1000, 0.01)
+        with caplog.at_level(logging.WARNING, logger="core.utils.bloom"):
+            fresh.add("+2348000000002")
+        assert "test-phones invalidated (state_lost)" in caplog.text
+        assert not fresh.is_ready()
+        assert fresh.needs_rebuild()
+        assert fresh.might_contain("+2348000000002")
@@ -0,0 +1,86 @@
+from unittest import mock
+
+import pytest
+from django.contrib.auth.models import AnonymousUser
+from django.urls import reverse
+
+import core.db
+from core.db import (ReplicaRouter, allow_replica_reads, close_unusable_connections,
+                     finish_request_routing, start_request_routing)
+from user.models import User
+from user.tests.conftest import api_client_with_credentials
+
+
+class TestReplicaRouter:
+    router = ReplicaRouter()
+
+    def test_reads_use_replica_until_first_write(self, settings):
+        settings.DATABASE_REPLICAS = ["replica_0"]
+        start_request_routing()
+        assert self.router.db_for_read(User) == "default"
+        assert allow_replica_reads(AnonymousUser())
+        assert self.router.db_for_read(User) == "replica_0"
+        assert self.router.db_for_write(User) == "default"
+        assert self.router.db_for_read(User) == "default"
+
+    def test_no_replica_reads_without_replicas(self, settings):
+        settings.DATABASE_REPLICAS = []
+        start_request_routing()
+        assert not allow_replica_reads(AnonymousUser())
+        assert self.router.db_for_read(User) == "default"
+
+    @pytest.mark.django_db
+    def test_client_that_wrote_is_pinned_to_primary(self, settings, active_user):
+        settings.DATABASE_REPLICAS = ["replica_0"]
+        start_request_routing()
+        self.router.db_for_write(User)
+        finish_request_routing(active_user)
+
+        start_request_routing()
+        assert not allow_replica_reads(active_user)
+        start_request_routing()
+        assert allow_replica_reads(AnonymousUser())
+
+
+@pytest.mark.django_db
+class TestReplicaReadViews:
+
+    def test_list_reads_from_replica_unless_pinned(self, api_client, authenticate_user, settings,
+                                                   mocker):
+        # Route "replica" reads to the test database itself
+        settings.DATABASE_REPLICAS = ["default"]
+        spy = mocker.spy(core.db, "allow_replica_reads")
+        user = authenticate_user(is_admin=True)
+        api_client_with_credentials(user['token'], api_client)
+        assert api_client.get(reverse("user:user-list")).status_code == 200
+        assert spy.spy_return is True
+
+        url = reverse("user:user-detail", args=[user['user_instance'].id])
+        assert api_client.patch(url, {"firstname": "Pinned"}).status_code == 200
+        assert api_client.get(reverse("user:user-list")).status_code == 200
+        assert spy.spy_return is False
+
+    def test_cached_responses_are_built_from_primary(self, api_client, authenticate_user,
+                                                     settings):
+        settings.DATABASE_REPLICAS = ["default"]
+        user = authenticate_user(is_admin=True)
+        api_client_with_credentials(user['token'], api_client)
+        assert api_client.get(reverse("user:user-list")).status_code == 200
+        assert core.db._routing_state.get().replica is None
+
+        user = authenticate_user()
+        api_client_with_credentials(user['token'], api_client)
+        assert api_client.get(reverse("user:user-list")).status_code == 200
+        assert core.db._routing_state.get().replica == "default"
+
+
+def test_close_unusable_connections(settings):
+    settings.DATABASE_ROUTING = {**settings.DATABASE_ROUTING, "HEALTH_CHECKS": True}
+    healthy = mock.Mock(connection=object(), in_atomic_block=False)
+    healthy.is_usable.return_value = True
+    broken = mock.Mock(connection=object(), in_atomic_block=False)
+    broken.is_usable.return_value = False
+    with mock.patch.object(core.db.connections, "all", return_value=[healthy, broken]):
+        close_unusable_connections()
+    healthy.close.assert_not_called()
+    broken.close.assert_called_once()
@@ -0,0 +1,89 @@
+import pytest
+from django.urls import reverse
+
+from core.load_shedding import (RouteClassLimiter, get_load_shedder,
+                                queue_time_from_header, reset_load_shedder)
+from user.tests.conftest import api_client_with_credentials
+
+LIMITER_CONFIG = {
+    "TARGET_LATENCY": 0.5,
+    "MAX_QUEUE_TIME": 2.0,
+    "INITIAL_LIMIT": 2,
+    "MIN_LIMIT": 1,
+    "MAX_LIMIT": 10,
+    "HIGH_PRIORITY_HEADROOM": 2.0,
+}
+
+
+@pytest.fixture(autouse=True)
+def fresh_load_shedder():
+    reset_load_shedder()
+    yield
+    reset_load_shedder()
+
+
+class TestRouteClassLimiter:
+
+    def test_sheds_beyond_limit(self):
+        limiter = RouteClassLimiter("login", False, LIMITER_CONFIG)
+        assert limiter.try_acquire()
+        assert limiter.try_acquire()
+        assert not limiter.try_acquire()
+        limiter.release(0.01)
+        assert limiter.try_acquire()
+        assert limiter.snapshot()["shed"] == 1
+
+    def test_high_priority_headroom(self):
+        limiter = RouteClassLimiter("token", True, LIMITER_CONFIG)
+        assert all(limiter.try_acquire() for _ in range(4))
+        assert not limiter.try_acquire()
+
+    def test_slow_requests_shrink_limit(self):
+        limiter = RouteClassLimiter("login", False, {**LIMITER_CONFIG, "INITIAL_LIMIT": 10})
+        limiter.try_acquire()
+        limiter.release(1.0)
+        assert limiter.snapshot()["limit"] == 9
+
+    def test_sheds_requests_queued_too_long(self):
+        limiter = RouteClassLimiter("login", False, LIMITER_CONFIG)
+        assert not limiter.try_acquire(queue_time=3.0)
+
+    def test_queue_time_from_header(self):
+        assert queue_time_from_header("t=1000.5", 1001.0, 30) == pytest.approx(0.5)
+        assert queue_time_from_header("t=1000500", 1001.0, 30) == pytest.approx(0.5)
+        assert queue_time_from_header("garbage", 1001.0, 30) == 0.0
+        assert queue_time_from_header("t=1", 1001.0, 30) == 30
+
+
+@pytest.mark.django_db
+class TestLoadSheddingMiddleware:
+
+    def test_saturated_route_class_returns_503(self, api_client):
+        limiter = get_load_shedder().limiter_for("/api/v1/auth/login/")
+        while limiter.try_acquire():
+            pass
+        response = api_client.post(reverse("auth:login"), {"phone": "x", "password": "y"})
+        assert response.status_code == 503
+        assert response["Retry-After"] == "2"
+
+    def test_client_request_start_is_ignored_unless_trusted(self, api_client, settings):
+        settings.LOAD_SHEDDING = {**settings.LOAD_SHEDDING, "TRUST_REQUEST_START": False}
+        response = api_client.post(reverse("auth:login"), {"phone": "x", "password": "y"},
+                                   HTTP_X_REQUEST_START="t=1")
+        assert response.status_code != 503
+        limiter = get_load_shedder().limiter_for("/api/v1/auth/login/")
+        assert limiter.snapshot()["limit"] == settings.LOAD_SHEDDING["INITIAL_LIMIT"]
+
+    def test_trusted_request_start_sheds_stale_requests(self, api_client, settings):
+        settings.LOAD_SHEDDING = {**settings.LOAD_SHEDDING, "TRUST_REQUEST_START": True}
+        response = api_client.post(reverse("auth:login"), {"phone": "x", "password": "y"},
+                                   HTTP_X_REQUEST_START="t=1")
+        assert response.status_code == 503
+
+    def test_admin_views_load_shedding_status(self, api_client, authenticate_user):
+        user = authenticate_user(is_admin=True)
+        api_client_with_credentials(user['token'], api_client)
+        response = api_client.get(reverse("load-shedding-status"))
+        assert response.status_code == 200
+        assert response.json()['data']['login']['admitted'] == 1
+        assert response.json()['data']['token']['high_priority'] is True
@@ -0,0 +1,96 @@
+import json
+import logging
+import sys
+
+import pytest
+from prometheus_client import REGISTRY
+
+from core.logs import JsonFormatter, QueuedRotatingFileHandler, SamplingFilter
+
+
+def make_record(name="django.db.backends", level=logging.DEBUG, msg="(%.3f) %s",
+                args=(0.001, "SELECT 1"), **extra):
+    record = logging.LogRecord(name, level, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+@pytest.fixture
+def handler(tmp_path):
+    handler = QueuedRotatingFileHandler(
+        str(tmp_path / "app-{pid}.log"), max_bytes=2000, backup_count=2)
+    handler.setFormatter(JsonFormatter())
+    yield handler
+    handler.close()
+
+
+def read_lines(tmp_path) -> list:
+    return [json.loads(line) for path in sorted(tmp_path.glob("app-*.log*"))
+            for line in path.read_text().splitlines()]
+
+
+class TestJsonFormatter:
+
+    def test_record_with_extras(self):
+        entry = json.loads(JsonFormatter().format(make_record(sql="SELECT 1", duration=0.001)))
+        assert entry["level"] == "DEBUG"
+        assert entry["logger"] == "django.db.backends"
+        assert entry["message"] == "(0.001) SELECT 1"
+        assert entry["sql"] == "SELECT 1"
+        assert entry["duration"] == 0.001
+
+    def test_exception_is_included(self):
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            record = logging.LogRecord("django.request", logging.ERROR, __file__, 1, "failed", None,
+                                       sys.exc_info())
+        entry = json.loads(JsonFormatter().format(record))
+        assert "ValueError: boom" in entry["exception"]
+
+
+class TestSamplingFilter:
+
+    def test_rate_applies_to_logger_and_children(self):
+        sampling = SamplingFilter({"django.db.backends": 0})
+        assert not sampling.filter(make_record())
+        assert not sampling.filter(make_record(name="django.db.backends.schema"))
+        assert sampling.filter(make_record(name="django.request"))
+
+    def test_warnings_are_never_sampled_out(self):
+        sampling = SamplingFilter({"django.db.backends": 0})
+        assert sampling.filter(make_record(level=logging.WARNING))
+
+    def test_partial_rate(self, mocker):
+        sampling = SamplingFilter({"django": 0.5})
+        mocker.patch("core.logs.random.random", side_effect=[0.2, 0.8])
+        assert sampling.filter(make_record())
+        assert not sampling.filter(make_record())
+
+
+class TestQueuedRotatingFileHandler:
+
+    def test_records_are_written_as_json_lines_on_close(self, handler, tmp_path):
+        handler.handle(make_record(sql="SELECT 1"))
+        handler.close()
+        [entry] = read_lines(tmp_path)
+        assert entry["message"] == "(0.001) SELECT 1"
+        assert entry["sql"] == "SELECT 1"
+
+    def test_full_queue_drops_instead_of_blocking(self, tmp_path):
+        handler = QueuedRotatingFileHandler(str(tmp_path / "app.log"), queue_size=1)
+        handler.listener.stop()
+        before = REGISTRY.get_sample_value("log_records_dropped_total") or 0
+        handler.handle(make_record())
+        handler.handle(make_record())
+        assert handler.dropped == 1
+        assert REGISTRY.get_sample_value("log_records_dropped_total") == before + 1
+        handler.close()
+
+    def test_file_is_rotated_by_size(self, handler, tmp_path):
+        for _ in range(50):
+            handler.handle(make_record())
+        handler.close()
+        files = list(tmp_path.glob("app-*.log*"))
+        assert 1 < len(files) <= 3
+        assert all(path.stat().st_size <= 2000 for path in files)
@@ -0,0 +1,98 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+from celery.app.task import Context
+from django.contrib.auth.hashers import check_password, make_password
+from django.urls import reverse
+from prometheus_client import REGISTRY
+
+from core.metrics import observe_queue_lag, stamp_publish_time, start_worker_exporter
+from user.tasks import send_phone_notification
+
+
+def sample(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+@pytest.mark.django_db
+class TestRequestMetrics:
+    login_url = reverse("auth:login")
+
+    def test_login_latency_and_queries_are_recorded(self, api_client, active_user, auth_user_password):
+        before = sample("http_request_duration_seconds_count", endpoint="auth:login", method="POST")
+        queries_before = sample("http_request_db_queries_sum", endpoint="auth:login")
+        response = api_client.post(
+            self.login_url, {"phone": active_user.phone, "password": auth_user_password})
+        assert response.status_code == 200
+        assert sample("http_request_duration_seconds_count",
+                      endpoint="auth:login", method="POST") == before + 1
+        assert sample("http_requests_total", endpoint="auth:login", method="POST", status="200") >= 1
+        assert sample("http_request_db_queries_sum", endpoint="auth:login") > queries_before
+
+    def test_scrape_endpoint_requires_token_when_configured(self, client, settings):
+        settings.METRICS = {**settings.METRICS, "SCRAPE_TOKEN": "scrape-secret"}
+        url = reverse("metrics")
+        assert client.get(url).status_code == 403
+        response = client.get(url, HTTP_AUTHORIZATION="Bearer scrape-secret")
+        assert response.status_code == 200
+        assert b"http_request_duration_seconds" in response.content
+
+    def test_scrape_endpoint_is_closed_without_token(self, client, settings):
+        settings.METRICS = {**settings.METRICS, "SCRAPE_TOKEN": ""}
+        assert client.get(reverse("metrics")).status_code == 403
+        assert client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer ").status_code == 403
+
+    def test_scrape_endpoint_rejects_non_ascii_token(self, client, settings):
+        settings.METRICS = {**settings.METRICS, "SCRAPE_TOKEN": "scrape-secret"}
+        response = client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer scrapé-secret")
+        assert response.status_code == 403
+
+    def test_scrape_endpoint_can_be_disabled(self, client, settings):
+        settings.METRICS = {**settings.METRICS, "ENABLED": False}
+        assert client.get(reverse("metrics")).status_code == 404
+
+
+class TestBackgroundMetrics:
+
+    def test_worker_serves_its_metrics(self, mocker, settings):
+        server = mocker.patch("core.metrics.start_http_server")
+        settings.METRICS = {**settings.METRICS, "WORKER_PORT": 9540}
+        start_worker_exporter()
+        server.assert_called_once_with(9540, registry=REGISTRY)
+
+        server.reset_mock()
+        settings.METRICS = {**settings.METRICS, "WORKER_PORT": 0}
+        start_worker_exporter()
+        server.assert_not_called()
+
+    def test_password_hashing_is_timed(self):
+        before = sample("password_hash_duration_seconds_count", operation="encode")
+        make_password("simplepass@")
+        assert sample("password_hash_duration_seconds_count", operation="encode") == before + 1
+
+    def test_password_check_is_timed_once(self):
+        encoded = make_password("simplepass@")
+        encodes = sample("password_hash_duration_seconds_count", operation="encode")
+        verifies = sample("password_hash_duration_seconds_count", operation="verify")
+        assert check_password("simplepass@", encoded)
+        assert not check_password("wrongpass@", encoded)
+        assert sample("password_hash_duration_seconds_count", operation="encode") == encodes
+        assert sample("password_hash_duration_seconds_count", operation="verify") == verifies + 2
+
+    def test_queue_lag_from_publish_header(self):
+        headers = {}
+        stamp_publish_time(headers=headers)
+        headers["published_at"] -= 2
+        task = SimpleNamespace(name="user.tasks.example", request=Context(headers))
+        observe_queue_lag(task=task)
+        assert sample("celery_queue_lag_seconds_sum", task="user.tasks.example") >= 2
+
+    def test_sms_issue_to_send_latency(self, mocker):
+        mocker.patch("user.tasks.send_sms")
+        before = sample("sms_issue_to_send_seconds_count", outcome="sent")
+        send_phone_notification.apply(
+            args=[{"message": "OTP", "phone": "+2348100000000"}],
+            headers={"published_at": time.time() - 1})
+        assert sample("sms_issue_to_send_seconds_count", outcome="sent") == before + 1
+        assert sample("sms_sent_total", outcome="sent") >= 1
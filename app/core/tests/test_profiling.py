@@ -0,0 +1,73 @@
+import pytest
+from django.urls import reverse
+
+from core.profiling import profile_buffer
+from user.tests.conftest import api_client_with_credentials
+
+PROFILING = {
+    "ENABLED": True,
+    "SAMPLE_RATE": 0.0,
+    "ROUTES": [],
+    "HEADER_TOKEN": "profile-me",
+    "STACK_INTERVAL": 0.001,
+    "TOP_FRAMES": 5,
+    "BUFFER_SIZE": 3,
+}
+
+
+@pytest.fixture(autouse=True)
+def profiling_settings(settings):
+    settings.PROFILING = dict(PROFILING)
+    return settings.PROFILING
+
+
+@pytest.mark.django_db
+class TestRequestProfiler:
+    login_url = reverse("auth:login")
+
+    def login(self, api_client, user, password, **headers):
+        return api_client.post(self.login_url, {"phone": user.phone, "password": password}, **headers)
+
+    def test_header_profiles_request(self, api_client, active_user, auth_user_password):
+        assert self.login(api_client, active_user, auth_user_password).status_code == 200
+        assert profile_buffer.samples() == []
+
+        self.login(api_client, active_user, auth_user_password, HTTP_X_PROFILE="wrong")
+        assert profile_buffer.samples() == []
+
+        response = self.login(api_client, active_user, auth_user_password, HTTP_X_PROFILE="profilé")
+        assert response.status_code == 200
+        assert profile_buffer.samples() == []
+
+        self.login(api_client, active_user, auth_user_password, HTTP_X_PROFILE="profile-me")
+        [sample] = profile_buffer.samples()
+        assert sample["endpoint"] == "auth:login"
+        assert sample["reason"] == "header"
+        assert sample["status"] == 200
+        assert sample["sql_count"] > 0
+        assert sample["wall_ms"] >= sample["cpu_ms"] * 0.5
+        # Password hashing keeps the thread busy long enough to be sampled
+        assert sample["stack_samples"] > 0 and sample["top_frames"]
+
+    def test_route_sample_rate_and_ring_buffer(self, api_client, active_user, auth_user_password,
+                                               profiling_settings):
+        profiling_settings["ROUTES"] = [(r"^/api/v1/auth/login/", 1.0)]
+        for _ in range(4):
+            self.login(api_client, active_user, auth_user_password)
+        samples = profile_buffer.samples()
+        assert len(samples) == 3
+        assert [sample["id"] for sample in samples] == [4, 3, 2]
+        assert {sample["reason"] for sample in samples} == {"sampled"}
+
+    def test_samples_are_admin_only(self, api_client, authenticate_user):
+        url = reverse("profile-samples")
+        user = authenticate_user(is_admin=False)
+        api_client_with_credentials(user['token'], api_client)
+        assert api_client.get(url).status_code == 403
+
+        admin = authenticate_user(is_admin=True)
+        api_client_with_credentials(admin['token'], api_client)
+        response = api_client.get(url, HTTP_X_PROFILE="profile-me")
+        assert response.status_code == 200
+        assert api_client.delete(url).status_code == 204
+        assert profile_buffer.samples() == []
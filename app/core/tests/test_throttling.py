@@ -0,0 +1,71 @@
+import pytest
+from django.core.cache.backends.locmem import LocMemCache
+
+from core.settings import base as base_settings
+from core.utils.throttling import FailedAttemptCounter, SlidingWindowLimiter, TokenBucket
+
+
+class TestSharedState:
+
+    def test_deployed_cache_is_shared_between_processes(self):
+        backend = base_settings.CACHES["default"]["BACKEND"]
+        assert backend.rsplit(".", 1)[-1] not in {"LocMemCache", "DummyCache", "FileBasedCache"}
+
+    def test_two_cache_clients_share_one_limit(self, mocker):
+        """Two clients of one cache server, as two workers would hold"""
+        clients = [LocMemCache("shared-limit", {}), LocMemCache("shared-limit", {})]
+        limiter = SlidingWindowLimiter("test-shared", limit=2, window=60)
+        for client, now in zip(clients, (0, 1)):
+            mocker.patch("core.utils.throttling.cache", client)
+            assert limiter.hit("key", now=now)[0]
+        mocker.patch("core.utils.throttling.cache", clients[0])
+        assert not limiter.hit("key", now=2)[0]
+
+        counter = FailedAttemptCounter("test-shared", max_failures=2, lockout=60)
+        mocker.patch("core.utils.throttling.cache", clients[0])
+        counter.record_failure("phone", now=0)
+        mocker.patch("core.utils.throttling.cache", clients[1])
+        assert counter.record_failure("phone", now=1)
+        mocker.patch("core.utils.throttling.cache", clients[0])
+        assert counter.locked_for("phone", now=2) > 0
+
+
+class TestSlidingWindowLimiter:
+
+    def test_limits_within_window(self):
+        limiter = SlidingWindowLimiter("test-sliding", limit=2, window=60)
+        assert limiter.hit("key", now=0)[0]
+        assert limiter.hit("key", now=1)[0]
+        allowed, wait = limiter.hit("key", now=2)
+        assert not allowed
+        assert wait == pytest.approx(58)
+        assert limiter.hit("other-key", now=2)[0]
+
+    def test_previous_window_weighs_on_current(self):
+        limiter = SlidingWindowLimiter("test-sliding", limit=2, window=60)
+        limiter.hit("key", now=50)
+        limiter.hit("key", now=55)
+        # 10s into the next window, 5/6 of the previous two requests still count
+        assert limiter.hit("key", now=70)[0]
+        assert not limiter.hit("key", now=71)[0]
+        # 55s in, only 1/12 of them does
+        assert limiter.hit("key", now=115)[0]
+
+
+    def test_check_does_not_record(self):
+        limiter = SlidingWindowLimiter("test-sliding", limit=1, window=60)
+        for now in range(3):
+            assert limiter.check("key", now=now)[0]
+        limiter.record("key", now=3)
+        assert not limiter.check("key", now=4)[0]
+
+class TestTokenBucket:
+
+    def test_burst_then_refill(self):
+        bucket = TokenBucket("test-bucket", capacity=2, refill_rate=1.0)
+        assert bucket.consume(now=0)[0]
+        assert bucket.consume(now=0)[0]
+        allowed, wait = bucket.consume(now=0)
+        assert not allowed
+        assert wait == pytest.approx(1.0)
+        assert bucket.consume(now=1)[0]
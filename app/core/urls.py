@@ -6,6 +6,8 @@ from drf_spectacular.views import (
     SpectacularSwaggerView,
 )
 
+from .views import LoadSheddingStatusView, ProfileSamplesView, metrics_view
+
 urlpatterns = [
     path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
     path('api/v1/doc/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
@@ -13,4 +15,8 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/v1/auth/', include('user.urls.auth')),
     path('api/v1/user/', include('user.urls.user')),
+    path('api/v1/async/', include('user.urls.async_auth')),
+    path('api/v1/ops/load-shedding/', LoadSheddingStatusView.as_view(), name='load-shedding-status'),
+    path('api/v1/ops/metrics/', metrics_view, name='metrics'),
+    path('api/v1/ops/profiles/', ProfileSamplesView.as_view(), name='profile-samples'),
 ]
@@ -0,0 +1,213 @@
+"""
+Bloom filters for cheap "definitely not present" checks.
+
+``SharedBloomFilter`` keeps a full snapshot of the bit array in the shared cache
+plus a short list of items added since the snapshot. Each process holds a local
+copy and only re-reads the snapshot when it is replaced, so a membership check
+normally costs one small cache read. Whenever the shared state is missing or
+could not be updated safely the filter reports "maybe present", and callers fall
+back to the database. It can give false positives but never false negatives.
+
+While ``rebuild`` builds a new snapshot, items added in the meantime are kept in
+a pending list and merged when it is published. Callers should add items once
+they are committed, so that anything missing from the rebuild's query is added
+after the rebuild started. An invalidated filter stays unused until it is
+rebuilt, so owners should poll ``needs_rebuild`` (e.g. from Celery beat).
+"""
+import hashlib
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.cache import cache
+
+from core.metrics import BLOOM_FILTER_INVALIDATIONS
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+
+    def __init__(self, num_bits: int, num_hashes: int, bits: bytearray = None):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bits if bits is not None else bytearray((num_bits + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, capacity: int, error_rate: float) -> "BloomFilter":
+        num_bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        num_hashes = max(1, round(num_bits / capacity * math.log(2)))
+        return cls(num_bits, num_hashes)
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.num_hashes):
+            yield (first + i * second) % self.num_bits
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(item))
+
+    def copy(self) -> "BloomFilter":
+        return BloomFilter(self.num_bits, self.num_hashes, bytearray(self.bits))
+
+
+class SharedBloomFilter:
+    PENDING_TIMEOUT = 24 * 60 * 60 #secs; outlives any rebuild, bounds a crashed one
+
+    def __init__(self, namespace: str, capacity: int, error_rate: float,
+                 compact_after: int = 1000):
+        self.namespace = namespace
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.compact_after = compact_after
+        self.meta_key = f"{namespace}:meta"
+        self.snapshot_key = f"{namespace}:snapshot"
+        self.recent_key = f"{namespace}:recent"
+        self.lock_key = f"{namespace}:lock"
+        self.pending_key = f"{namespace}:pending"
+        self._local = None
+        self._local_meta = None
+        self._mutex = threading.Lock()
+
+    def _sync(self):
+        """Bring the local copy up to date; returns None if no usable shared state"""
+        meta = cache.get(self.meta_key)
+        if meta is None:
+            return None
+        with self._mutex:
+            if meta == self._local_meta:
+                return self._local
+            snapshot_id, recent_count = meta
+            local = self._local
+            if local is None or self._local_meta[0] != snapshot_id:
+                snapshot = cache.get(self.snapshot_key)
+                if snapshot is None or snapshot[0] != snapshot_id:
+                    return None
+                local = BloomFilter(snapshot[1], snapshot[2], bytearray(snapshot[3]))
+            else:
+                local = local.copy()
+            if recent_count:
+                recent = cache.get(self.recent_key)
+                if recent is None or recent[0] != snapshot_id or len(recent[1]) < recent_count:
+                    return None
+                for item in recent[1][:recent_count]:
+                    local.add(item)
+            self._local, self._local_meta = local, meta
+            return local
+
+    def might_contain(self, item: str) -> bool:
+        bloom = self._sync()
+        return bloom is None or item in bloom
+
+    def is_ready(self) -> bool:
+        return self._sync() is not None
+
+    @contextmanager
+    def _locked(self, attempts: int = 50):
+        """Yields whether the lock guarding the shared state was acquired"""
+        for _ in range(attempts):
+            if cache.add(self.lock_key, 1, timeout=5):
+                break
+            time.sleep(0.01)
+        else:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            cache.delete(self.lock_key)
+
+    def add(self, item: str) -> None:
+        bloom = self._sync()
+        if bloom is not None and item in bloom:
+            return
+        if (bloom is None and cache.get(self.meta_key) is None
+                and cache.get(self.pending_key) is None):
+            return  # not built, and no rebuild running to pick the item up
+        with self._locked() as locked:
+            if not locked:
+                # Couldn't record the item safely: drop the shared state so every
+                # check falls back to the database until the filter is rebuilt.
+                self.invalidate("lock_timeout")
+                return
+            meta = cache.get(self.meta_key)
+            if meta is None:
+                pending = cache.get(self.pending_key)
+                if pending is not None:
+                    cache.set(self.pending_key, pending + [item], timeout=self.PENDING_TIMEOUT)
+                return
+            bloom = self._sync()
+            recent = cache.get(self.recent_key)
+            if bloom is None or recent is None or recent[0] != meta[0]:
+                # The snapshot or recent additions were lost (e.g. evicted)
+                self.invalidate("state_lost")
+                return
+            if item in bloom:
+                return
+            items = recent[1][:meta[1]] + [item]
+            if len(items) >= self.compact_after:
+                bloom = bloom.copy()
+                bloom.add(item)
+                self._publish(bloom)
+            else:
+                cache.set(self.recent_key, (meta[0], items), timeout=None)
+                cache.set(self.meta_key, (meta[0], len(items)), timeout=None)
+
+    def rebuild(self, items) -> int:
+        """
+        Replace the shared filter with one built from `items`; returns the count.
+        `items` should be lazy (e.g. a queryset iterator), so that it is read
+        after additions start going to the pending list.
+        """
+        with self._locked(attempts=1000) as locked:
+            if not locked:
+                raise RuntimeError(f"Could not lock {self.lock_key} to rebuild the filter")
+            self.invalidate()
+            cache.set(self.pending_key, [], timeout=self.PENDING_TIMEOUT)
+        bloom = BloomFilter.for_capacity(self.capacity, self.error_rate)
+        count = 0
+        try:
+            for item in items:
+                bloom.add(item)
+                count += 1
+        except BaseException:
+            cache.delete(self.pending_key)
+            raise
+        with self._locked(attempts=1000) as locked:
+            if not locked:
+                cache.delete(self.pending_key)
+                raise RuntimeError(f"Could not lock {self.lock_key} to publish the filter")
+            for item in cache.get(self.pending_key) or []:
+                bloom.add(item)
+            cache.delete(self.pending_key)
+            self._publish(bloom)
+        return count
+
+    def _publish(self, bloom: BloomFilter) -> None:
+        """Write a new snapshot; callers hold the lock"""
+        snapshot_id = time.time_ns()
+        cache.set(self.snapshot_key,
+                  (snapshot_id, bloom.num_bits, bloom.num_hashes, bytes(bloom.bits)), timeout=None)
+        cache.set(self.recent_key, (snapshot_id, []), timeout=None)
+        cache.set(self.meta_key, (snapshot_id, 0), timeout=None)
+
+    def needs_rebuild(self) -> bool:
+        """True when the filter is unbuilt or invalidated and no rebuild is running"""
+        return cache.get(self.meta_key) is None and cache.get(self.pending_key) is None
+
+    def invalidate(self, reason: str = None) -> None:
+        """Drop the shared state; a reason marks an unplanned invalidation"""
+        if reason is not None:
+            logger.warning("Bloom filter %s invalidated (%s); checks use the database "
+                           "until it is rebuilt", self.namespace, reason)
+            BLOOM_FILTER_INVALIDATIONS.labels(self.namespace, reason).inc()
+        cache.delete(self.meta_key)
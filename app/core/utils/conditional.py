@@ -0,0 +1,35 @@
+import hashlib
+from datetime import datetime
+
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+
+def make_etag(*parts) -> str:
+    """Weak ETag derived from the given parts"""
+    digest = hashlib.sha1("|".join(str(part) for part in parts).encode()).hexdigest()
+    return "W/" + quote_etag(digest)
+
+
+def has_conditional_headers(request) -> bool:
+    return bool(request.META.get("HTTP_IF_NONE_MATCH")
+                or request.META.get("HTTP_IF_MODIFIED_SINCE"))
+
+
+def not_modified_response(request, etag: str, last_modified: datetime = None):
+    """Return a 304 response if the client's validators match, else None"""
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(
+        request, etag=etag, last_modified=timestamp)
+    if response is not None:
+        set_validators(response, etag, last_modified)
+    return response
+
+
+def set_validators(response, etag: str, last_modified: datetime = None):
+    response["ETag"] = etag
+    if last_modified:
+        response["Last-Modified"] = http_date(last_modified.timestamp())
+    # Bodies depend on who is asking, so shared caches must key on the credentials
+    patch_vary_headers(response, ("Authorization",))
+    return response
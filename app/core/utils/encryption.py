@@ -0,0 +1,26 @@
+"""
+Symmetric encryption for secrets that have to be stored in the database.
+
+Values are Fernet tokens (AES-CBC + HMAC) keyed from FIELD_ENCRYPTION_KEY, so a
+database dump alone does not reveal them.
+"""
+import base64
+import functools
+import hashlib
+
+from cryptography.fernet import Fernet
+from django.conf import settings
+
+
+@functools.lru_cache(maxsize=4)
+def _fernet(key: str) -> Fernet:
+    return Fernet(base64.urlsafe_b64encode(hashlib.sha256(key.encode()).digest()))
+
+
+def encrypt_value(value: str) -> str:
+    return _fernet(settings.FIELD_ENCRYPTION_KEY).encrypt(value.encode()).decode()
+
+
+def decrypt_value(token: str) -> str:
+    """Raises cryptography.fernet.InvalidToken if the key or token is wrong"""
+    return _fernet(settings.FIELD_ENCRYPTION_KEY).decrypt(token.encode()).decode()
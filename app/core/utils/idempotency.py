@@ -0,0 +1,151 @@
+import functools
+import hashlib
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import JsonResponse
+from rest_framework.response import Response
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+REPLAYED_RESPONSE_HEADERS = ("Location", "ETag", "Last-Modified")
+MAX_KEY_LENGTH = 255
+KEY_TOO_LONG = f"{IDEMPOTENCY_HEADER} must be at most {MAX_KEY_LENGTH} characters"
+
+
+def request_fingerprint(request) -> str:
+    digest = hashlib.sha256()
+    digest.update(request.method.encode())
+    digest.update(request.get_full_path().encode())
+    digest.update(request.body)
+    return digest.hexdigest()
+
+
+def is_final(status_code: int) -> bool:
+    """
+    Outcomes a retry must get again. 409, 429 and 5xx tell the client to try
+    later, so replaying them would refuse the retry they ask for.
+    """
+    if 200 <= status_code < 300:
+        return True
+    return 400 <= status_code < 500 and status_code not in (409, 429)
+
+
+def claim(request, key: str, user_id) -> tuple:
+    """
+    Lock the key for the first request. Returns (cache key, fingerprint, replay),
+    where replay is None when this request got the key and must run the view.
+    """
+    cache_key = "idempotency:{}:{}:{}".format(
+        request.resolver_match.view_name, user_id, hashlib.sha256(key.encode()).hexdigest())
+    fingerprint = request_fingerprint(request)
+    in_progress = {"fingerprint": fingerprint, "in_progress": True}
+    if cache.add(cache_key, in_progress, timeout=settings.IDEMPOTENCY_LOCK_TTL):
+        return cache_key, fingerprint, None
+    return cache_key, fingerprint, replay(cache.get(cache_key), fingerprint)
+
+
+def release(cache_key: str, fingerprint: str, response, data) -> None:
+    """Store a final outcome for retries; otherwise free the key so a retry runs the view"""
+    if not is_final(response.status_code):
+        cache.delete(cache_key)
+        return
+    cache.set(cache_key, {
+        "fingerprint": fingerprint,
+        "status": response.status_code,
+        "data": data,
+        "headers": {name: response[name] for name in REPLAYED_RESPONSE_HEADERS if name in response},
+    }, timeout=settings.IDEMPOTENCY_KEY_TTL)
+
+
+def replay(cached: dict, fingerprint: str) -> tuple:
+    """(data, status, headers) answering a retry of a key that was already used"""
+    if cached is None or cached.get("in_progress"):
+        return ({"success": False,
+                 "errors": "A request with this Idempotency-Key is still being processed"}, 409, {})
+    if cached["fingerprint"] != fingerprint:
+        return ({"success": False,
+                 "errors": "Idempotency-Key was already used with a different request"}, 422, {})
+    return cached["data"], cached["status"], {**cached.get("headers", {}), REPLAYED_HEADER: "true"}
+
+
+def idempotent(view_method):
+    """
+    Honour an Idempotency-Key header on a DRF view method.
+
+    The first final response (2xx, or 4xx other than 409 and 429) is stored in
+    the cache for IDEMPOTENCY_KEY_TTL and replayed, with its Location, ETag and
+    Last-Modified headers, for retries with the same key and body, without
+    running the view again. Other responses free the key, so a retry runs the
+    view. A key reused with a different body gets 422; a retry that arrives
+    while the first request is still running gets 409.
+    """
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response({"success": False, "errors": KEY_TOO_LONG}, status=400)
+
+        user_id = request.user.id if request.user.is_authenticated else "anon"
+        cache_key, fingerprint, replayed = claim(request, key, user_id)
+        if replayed is not None:
+            data, status, headers = replayed
+            return Response(data, status=status, headers=headers)
+
+        response = None
+        try:
+            try:
+                response = view_method(self, request, *args, **kwargs)
+            except Exception as exc:
+                response = self.handle_exception(exc)
+            return response
+        finally:
+            if response is None:
+                cache.delete(cache_key)
+            else:
+                release(cache_key, fingerprint, response, response.data)
+    return wrapper
+
+
+def async_idempotent(view):
+    """
+    `idempotent` for plain async views that answer with JsonResponse. Apply
+    it outside `async_api_view`; keys are shared by all anonymous callers.
+    """
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return await view(request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return JsonResponse({"success": False, "errors": KEY_TOO_LONG}, status=400)
+
+        cache_key, fingerprint, replayed = await sync_to_async(claim)(request, key, "anon")
+        if replayed is not None:
+            data, status, headers = replayed
+            response = JsonResponse(data, status=status, safe=False)
+            for name, value in headers.items():
+                response[name] = value
+            return response
+
+        response = None
+        try:
+            response = await view(request, *args, **kwargs)
+            return response
+        finally:
+            await sync_to_async(release_json)(cache_key, fingerprint, response)
+    return wrapper
+
+
+def release_json(cache_key: str, fingerprint: str, response) -> None:
+    """`release` for a JsonResponse; anything else (or no response) frees the key"""
+    try:
+        data = json.loads(response.content)
+    except (AttributeError, ValueError):
+        cache.delete(cache_key)
+        return
+    release(cache_key, fingerprint, response, data)
@@ -0,0 +1,77 @@
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+class VersionedResponseCache:
+    """
+    Cache of serialized response bodies keyed on the query parameters and a
+    generation counter. Bumping the generation makes every existing entry
+    unreachable, so writers never have to know which pages to delete.
+    """
+
+    def __init__(self, namespace: str):
+        self.namespace = namespace
+        self.generation_key = f"{namespace}:generation"
+
+    def generation(self) -> int:
+        generation = cache.get(self.generation_key)
+        if generation is None:
+            # Seed with the clock so an evicted counter can never come back as
+            # a generation that older entries were stored under.
+            cache.add(self.generation_key, time.time_ns(), timeout=None)
+            generation = cache.get(self.generation_key)
+        return generation
+
+    def bump(self) -> None:
+        try:
+            cache.incr(self.generation_key)
+        except ValueError:
+            cache.add(self.generation_key, time.time_ns(), timeout=None)
+
+    def bump_on_commit(self) -> None:
+        """
+        Bump once the current transaction commits (immediately outside one).
+        A bump before the commit would let a concurrent read refill the new
+        generation with the old rows.
+        """
+        transaction.on_commit(self.bump)
+
+    def make_key(self, action: str, request, scope: str = "") -> str:
+        """Build the key up front, before any data is read for the response"""
+        params = sorted((name, value) for name, values in request.query_params.lists()
+                        for value in values)
+        digest = hashlib.sha1(repr(params).encode()).hexdigest()
+        return f"{self.namespace}:{self.generation()}:{action}:{scope}:{digest}"
+
+    def get(self, action: str, key: str):
+        value = cache.get(key)
+        self._record(action, "hits" if value is not None else "misses")
+        return value
+
+    def set(self, key: str, value, timeout: int) -> None:
+        cache.set(key, value, timeout=timeout)
+
+    def _record(self, action: str, outcome: str) -> None:
+        stat_key = f"{self.namespace}:stats:{action}:{outcome}"
+        if not cache.add(stat_key, 1, timeout=None):
+            try:
+                cache.incr(stat_key)
+            except ValueError:
+                pass
+
+    def stats(self, actions) -> dict:
+        """Hit/miss counts and hit ratio per action"""
+        stats = {}
+        for action in actions:
+            hits = cache.get(f"{self.namespace}:stats:{action}:hits", 0)
+            misses = cache.get(f"{self.namespace}:stats:{action}:misses", 0)
+            lookups = hits + misses
+            stats[action] = {
+                "hits": hits,
+                "misses": misses,
+                "hit_ratio": round(hits / lookups, 4) if lookups else None,
+            }
+        return stats
@@ -0,0 +1,49 @@
+import csv
+import json
+from typing import Iterable, Iterator, Sequence
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+
+class Echo:
+    """File-like object that returns written values instead of buffering them."""
+
+    def write(self, value):
+        return value
+
+
+def iter_ndjson(rows: Iterable[dict]) -> Iterator[str]:
+    """Yield one JSON document per line for each row."""
+    encoder = DjangoJSONEncoder()
+    for row in rows:
+        yield encoder.encode(row) + "\n"
+
+
+def iter_csv(rows: Iterable[dict], fields: Sequence[str]) -> Iterator[str]:
+    """Yield a CSV header followed by one line per row."""
+    writer = csv.writer(Echo())
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow([_csv_value(row.get(field)) for field in fields])
+
+
+def _csv_value(value):
+    if isinstance(value, (list, tuple)):
+        return json.dumps(value)
+    return value
+
+
+def streaming_export_response(rows: Iterable[dict], fields: Sequence[str],
+                              export_format: str, filename: str) -> StreamingHttpResponse:
+    """Stream rows as NDJSON or CSV without materializing them in memory."""
+    if export_format == "csv":
+        response = StreamingHttpResponse(
+            iter_csv(rows, fields), content_type="text/csv")
+        extension = "csv"
+    else:
+        response = StreamingHttpResponse(
+            iter_ndjson(rows), content_type="application/x-ndjson")
+        extension = "ndjson"
+    response["Content-Disposition"] = f'attachment; filename="{filename}.{extension}"'
+    return response
@@ -0,0 +1,115 @@
+"""
+Cache-backed rate limiting primitives.
+
+All state lives in the default cache, which must be shared (Redis, see
+CACHES in settings) for limits to hold across workers and hosts; with a
+per-process cache every limit is multiplied by the number of processes.
+
+Updates are not transactional; under heavy contention a few extra requests
+may slip through, which is acceptable for abuse protection.
+"""
+import time
+
+from django.core.cache import cache
+
+
+class SlidingWindowLimiter:
+    """
+    Sliding window approximated from two fixed windows: the previous window's
+    count is weighted by how much of it still overlaps the sliding window.
+    """
+
+    def __init__(self, namespace: str, limit: int, window: int):
+        self.namespace = namespace
+        self.limit = limit
+        self.window = window
+
+    def _keys(self, key: str, now: float):
+        current = int(now // self.window)
+        return f"{self.namespace}:{key}:{current}", f"{self.namespace}:{key}:{current - 1}"
+
+    def check(self, key: str, now: float = None):
+        """Whether a request would be allowed, without recording it; returns (allowed, wait)"""
+        now = time.time() if now is None else now
+        current_key, previous_key = self._keys(key, now)
+        counts = cache.get_many([current_key, previous_key])
+        elapsed = (now % self.window) / self.window
+        estimated = counts.get(previous_key, 0) * (1 - elapsed) + counts.get(current_key, 0)
+        if estimated >= self.limit:
+            return False, self.window - (now % self.window)
+        return True, 0
+
+    def record(self, key: str, now: float = None) -> None:
+        now = time.time() if now is None else now
+        current_key = self._keys(key, now)[0]
+        if not cache.add(current_key, 1, timeout=self.window * 2):
+            try:
+                cache.incr(current_key)
+            except ValueError:
+                cache.set(current_key, 1, timeout=self.window * 2)
+
+    def hit(self, key: str, now: float = None):
+        """Record a request; returns (allowed, seconds to wait if not allowed)"""
+        now = time.time() if now is None else now
+        allowed, wait = self.check(key, now)
+        if allowed:
+            self.record(key, now)
+        return allowed, wait
+
+
+class TokenBucket:
+    """Bucket of `capacity` tokens refilled at `refill_rate` tokens per second"""
+
+    def __init__(self, namespace: str, capacity: int, refill_rate: float):
+        self.key = f"{namespace}:bucket"
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+
+    def consume(self, tokens: int = 1, now: float = None):
+        """Take tokens; returns (allowed, seconds until enough tokens refill)"""
+        now = time.time() if now is None else now
+        available, updated_at = cache.get(self.key, (self.capacity, now))
+        available = min(self.capacity, available + (now - updated_at) * self.refill_rate)
+        if available < tokens:
+            return False, (tokens - available) / self.refill_rate
+        timeout = int(self.capacity / self.refill_rate) + 1
+        cache.set(self.key, (available - tokens, now), timeout=timeout)
+        return True, 0
+
+
+class FailedAttemptCounter:
+    """Counts failures per key and locks the key once `max_failures` is reached"""
+
+    def __init__(self, namespace: str, max_failures: int, lockout: int):
+        self.namespace = namespace
+        self.max_failures = max_failures
+        self.lockout = lockout
+
+    def _keys(self, key: str):
+        return f"{self.namespace}:{key}:failures", f"{self.namespace}:{key}:locked-until"
+
+    def locked_for(self, key: str, now: float = None) -> float:
+        """Seconds left on the key's lockout, 0 if it isn't locked"""
+        now = time.time() if now is None else now
+        locked_until = cache.get(self._keys(key)[1])
+        return max(0.0, locked_until - now) if locked_until else 0.0
+
+    def record_failure(self, key: str, now: float = None) -> bool:
+        """Returns True when this failure locks the key"""
+        now = time.time() if now is None else now
+        failures_key, locked_key = self._keys(key)
+        if cache.add(failures_key, 1, timeout=self.lockout):
+            failures = 1
+        else:
+            try:
+                failures = cache.incr(failures_key)
+            except ValueError:
+                cache.set(failures_key, 1, timeout=self.lockout)
+                failures = 1
+        if failures >= self.max_failures:
+            cache.set(locked_key, now + self.lockout, timeout=self.lockout)
+            return True
+        return False
+
+    def reset(self, key: str) -> None:
+        cache.delete_many(self._keys(key))
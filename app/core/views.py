@@ -0,0 +1,50 @@
+import hmac
+
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from user.utils import IsAdmin
+
+from .load_shedding import get_load_shedder
+from .metrics import render_metrics
+from .profiling import profile_buffer
+
+
+class LoadSheddingStatusView(APIView):
+    """Current concurrency limit, in-flight and shed counts per route class"""
+    permission_classes = [IsAdmin]
+
+    def get(self, request, *args, **kwargs):
+        return Response({"success": True, "data": get_load_shedder().snapshot()}, status=200)
+
+
+class ProfileSamplesView(APIView):
+    """Request profiles in the ring buffer, newest first; DELETE empties it"""
+    permission_classes = [IsAdmin]
+
+    def get(self, request, *args, **kwargs):
+        return Response({"success": True, "data": profile_buffer.samples()}, status=200)
+
+    def delete(self, request, *args, **kwargs):
+        profile_buffer.clear()
+        return Response(status=204)
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint. A plain view: scrapers send the
+    SCRAPE_TOKEN as a bearer token, which JWT authentication would reject.
+    """
+    config = settings.METRICS
+    if not config["ENABLED"]:
+        raise Http404
+    # Without a configured token nobody may scrape
+    expected = f"Bearer {config['SCRAPE_TOKEN']}"
+    # Bytes: compare_digest raises TypeError on non-ASCII str
+    if not config["SCRAPE_TOKEN"] or not hmac.compare_digest(
+            request.META.get("HTTP_AUTHORIZATION", "").encode(), expected.encode()):
+        return HttpResponseForbidden()
+    body, content_type = render_metrics()
+    return HttpResponse(body, content_type=content_type)
@@ -0,0 +1,5 @@
+from core.metrics import mark_process_dead
+
+
+def child_exit(server, worker):
+    mark_process_dead(worker.pid)
@@ -1,9 +1,24 @@
 
 from django.contrib import admin
 
-from .models import Token, User
+from .models import APIKey, AuthEvent, Token, User
 
 admin.site.register(User)
 admin.site.register(Token)
 
 
+admin.site.register(APIKey)
+
+
+@admin.register(AuthEvent)
+class AuthEventAdmin(admin.ModelAdmin):
+    list_display = ("event_type", "phone", "user_id", "ip_address", "created_at")
+    list_filter = ("event_type",)
+    search_fields = ("phone",)
+    date_hierarchy = "created_at"
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
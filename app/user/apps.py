@@ -5,3 +5,20 @@ from django.utils.translation import gettext_lazy as _
 class UserConfig(AppConfig):
     name = 'user'
     verbose_name = _('user')
+
+    def ready(self):
+        import atexit
+
+        from django.core.signals import request_finished
+        from rest_framework_simplejwt.tokens import Token
+
+        from . import signals  # noqa: F401
+        from .events import auth_events
+        from .signing import asymmetric_signing_enabled, token_backend
+
+        request_finished.connect(auth_events.flush_if_due, dispatch_uid="flush-auth-events")
+        atexit.register(auth_events.flush)
+
+        if asymmetric_signing_enabled():
+            # Every simplejwt token class resolves its backend through Token
+            Token._token_backend = token_backend
@@ -0,0 +1,123 @@
+"""
+Native async versions of the onboarding and OTP flows for ASGI deployments.
+
+Django 4.0 has no async ORM, so queries run through ``sync_to_async`` on the
+thread-sensitive executor (sharing the request's connection), while password
+hashing and Celery publishing run on the general thread pool so they never
+hold that executor.
+"""
+import functools
+import json
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.hashers import make_password
+from django.http import HttpResponseNotAllowed, JsonResponse
+from rest_framework import exceptions
+
+from core.utils.idempotency import async_idempotent
+
+from .enums import AuthEventEnum
+from .events import emit_auth_event
+from .models import Token
+from .serializers import (AccountVerificationSerializer,
+                          CreatePasswordFromResetOTPSerializer,
+                          InitiatePasswordResetSerializer,
+                          OnboardUserSerializer)
+from .tasks import send_phone_notification
+
+
+async def run_in_thread(func, *args, **kwargs):
+    """Run blocking, connection-free work (hashing, broker I/O) off the event loop"""
+    return await sync_to_async(func, thread_sensitive=False)(*args, **kwargs)
+
+
+def async_api_view(view):
+    """JSON body parsing and DRF exception handling for plain async views"""
+    # Django 4.0's csrf_exempt/require_POST return sync wrappers, which would
+    # hide the coroutine from the handler, so both are applied by hand.
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != "POST":
+            return HttpResponseNotAllowed(["POST"])
+        try:
+            payload = json.loads(request.body or b"{}")
+        except ValueError:
+            return JsonResponse({"detail": "Malformed JSON body."}, status=400)
+        if not isinstance(payload, dict):
+            return JsonResponse({"detail": "Expected a JSON object."}, status=400)
+        try:
+            return await view(request, payload, *args, **kwargs)
+        except exceptions.APIException as exc:
+            response = JsonResponse(
+                exc.detail if isinstance(exc.detail, (dict, list)) else {"detail": exc.detail},
+                status=exc.status_code, safe=False)
+            wait = getattr(exc, "wait", None)
+            if wait:
+                response["Retry-After"] = str(int(wait))
+            return response
+    wrapper.csrf_exempt = True
+    return wrapper
+
+
+async def is_valid(serializer) -> bool:
+    return await sync_to_async(serializer.is_valid)()
+
+
+@async_idempotent
+@async_api_view
+async def onboard_user(request, payload):
+    """Sign up with a phone number; sends an OTP for verification"""
+    serializer = OnboardUserSerializer(data=payload, context={"request": request})
+    if not await is_valid(serializer):
+        return JsonResponse(serializer.errors, status=400)
+    password_hash = await run_in_thread(
+        make_password, serializer.validated_data["password"])
+    _, message_info = await sync_to_async(serializer.save_pending_user)(
+        serializer.validated_data, password_hash)
+    await run_in_thread(send_phone_notification.delay, message_info)
+    return JsonResponse({"success": True, "message": "OTP sent for verification!"}, status=200)
+
+
+@async_api_view
+async def verify_account(request, payload):
+    """Activate a user account using the OTP sent to the user phone"""
+    serializer = AccountVerificationSerializer(data=payload, context={"request": request})
+    if not await is_valid(serializer):
+        return JsonResponse(serializer.errors, status=400)
+    await sync_to_async(serializer.save)()
+    return JsonResponse({"success": True, "message": "Acount Verification Successful"}, status=200)
+
+
+@async_idempotent
+@async_api_view
+async def initiate_password_reset(request, payload):
+    """Send a temporary OTP to the user phone to be used for password reset"""
+    serializer = InitiatePasswordResetSerializer(data=payload, context={"request": request})
+    if not await is_valid(serializer):
+        return JsonResponse(serializer.errors, status=400)
+    _, message_info = await sync_to_async(serializer.save_reset_token)(
+        serializer.validated_data)
+    await run_in_thread(send_phone_notification.delay, message_info)
+    return JsonResponse({"success": True,
+                         "message": "Temporary password sent to your mobile!"}, status=200)
+
+
+def complete_password_reset(token: Token, password: str, password_hash: str, request=None) -> None:
+    token.reset_user_password(password, password_hash=password_hash)
+    token.delete()
+    emit_auth_event(AuthEventEnum.PASSWORD_RESET, request, token.user)
+
+
+@async_api_view
+async def create_password(request, payload):
+    """Create a new password given the reset OTP sent to user phone number"""
+    serializer = CreatePasswordFromResetOTPSerializer(data=payload, context={"request": request})
+    if not await is_valid(serializer):
+        return JsonResponse(serializer.errors, status=400)
+    token = await sync_to_async(serializer.get_valid_token)()
+    if token is None:
+        return JsonResponse({"success": False, "errors": "Invalid password reset otp"}, status=400)
+    new_password = serializer.validated_data["new_password"]
+    password_hash = await run_in_thread(make_password, new_password)
+    await sync_to_async(complete_password_reset)(token, new_password, password_hash, request)
+    return JsonResponse({"success": True, "message": "Password successfully reset"}, status=200)
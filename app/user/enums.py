@@ -20,3 +20,34 @@ class SystemRoleEnum:
     ADMIN = "ADMIN"
     CUSTOMER = "CUSTOMER"
 
+
+
+@dataclass
+class AuthEventEnum:
+    LOGIN = "LOGIN"
+    LOGIN_FAILED = "LOGIN_FAILED"
+    TOTP_CHALLENGE = "TOTP_CHALLENGE"
+    OTP_ISSUED = "OTP_ISSUED"
+    ACCOUNT_VERIFIED = "ACCOUNT_VERIFIED"
+    VERIFICATION_FAILED = "VERIFICATION_FAILED"
+    PASSWORD_RESET_REQUESTED = "PASSWORD_RESET_REQUESTED"
+    PASSWORD_RESET = "PASSWORD_RESET"
+    PASSWORD_RESET_FAILED = "PASSWORD_RESET_FAILED"
+    PASSWORD_CHANGED = "PASSWORD_CHANGED"
+    TOTP_ENABLED = "TOTP_ENABLED"
+    TOTP_DISABLED = "TOTP_DISABLED"
+
+
+AUTH_EVENT_CHOICE = tuple(
+    (value, value) for name, value in vars(AuthEventEnum).items() if not name.startswith("_"))
+
+
+@dataclass
+class FunnelStageEnum:
+    OTP_ISSUED = "OTP_ISSUED"
+    VERIFIED = "VERIFIED"
+    FIRST_LOGIN = "FIRST_LOGIN"
+
+
+FUNNEL_STAGE_CHOICE = tuple(
+    (value, value) for name, value in vars(FunnelStageEnum).items() if not name.startswith("_"))
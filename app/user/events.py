@@ -0,0 +1,107 @@
+"""
+Append-only log of authentication events.
+
+Emitting an event only appends it to a per-process buffer; no auth call waits
+on an insert. The buffer is written with bulk_create once it holds BATCH_SIZE
+events or its oldest event is FLUSH_INTERVAL old. Both are checked when a
+request finishes, after its response was sent. A buffer that reaches
+MAX_BUFFERED is flushed at once, or when the emitting transaction commits, so
+other requests' events never share its fate. Whatever is left is flushed at
+process exit. Events buffered in a process that is killed are lost.
+"""
+import ipaddress
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+from rest_framework.throttling import BaseThrottle
+
+from .models import AuthEvent
+
+logger = logging.getLogger(__name__)
+
+
+class AuthEventBuffer:
+
+    def __init__(self):
+        self._events = []
+        self._oldest = None
+        self._overflow_scheduled = False
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._events)
+
+    def add(self, event: AuthEvent) -> None:
+        with self._lock:
+            self._events.append(event)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            overflow = (not self._overflow_scheduled
+                        and len(self._events) >= settings.AUTH_EVENTS["MAX_BUFFERED"])
+            if overflow:
+                self._overflow_scheduled = True
+        if overflow:
+            # Not inside the caller's transaction: a rollback there would take
+            # every buffered event with it. Runs at once outside a transaction.
+            transaction.on_commit(self.flush)
+
+    def is_due(self) -> bool:
+        config = settings.AUTH_EVENTS
+        oldest = self._oldest
+        return oldest is not None and (
+            len(self._events) >= config["BATCH_SIZE"]
+            or time.monotonic() - oldest >= config["FLUSH_INTERVAL"])
+
+    def flush(self) -> int:
+        """Write every buffered event; returns how many were taken from the buffer"""
+        with self._lock:
+            events, self._events, self._oldest = self._events, [], None
+            self._overflow_scheduled = False
+        if not events:
+            return 0
+        try:
+            # A savepoint keeps a failed insert from breaking an enclosing transaction
+            with transaction.atomic():
+                AuthEvent.objects.bulk_create(events, batch_size=settings.AUTH_EVENTS["BATCH_SIZE"])
+        except DatabaseError:
+            logger.exception("Dropped %d auth events", len(events))
+        return len(events)
+
+    def flush_if_due(self, **kwargs) -> None:
+        if self.is_due():
+            self.flush()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._events, self._oldest = [], None
+            self._overflow_scheduled = False
+
+
+auth_events = AuthEventBuffer()
+
+
+def client_ip(request):
+    if request is None:
+        return None
+    ident = BaseThrottle().get_ident(request)
+    try:
+        return str(ipaddress.ip_address(ident))
+    except ValueError:
+        return None
+
+
+def emit_auth_event(event_type: str, request=None, user=None, phone: str = "", **metadata) -> None:
+    if not settings.AUTH_EVENTS["ENABLED"]:
+        return
+    auth_events.add(AuthEvent(
+        event_type=event_type,
+        user_id=user.pk if user is not None else None,
+        phone=phone or getattr(user, "phone", None) or "",
+        ip_address=client_ip(request),
+        metadata=metadata,
+        created_at=timezone.now(),
+    ))
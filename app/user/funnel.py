@@ -0,0 +1,63 @@
+"""
+Onboarding funnel rollups: OTP issued -> account verified -> first login.
+
+Each step adds one to its (stage, hour) FunnelCount row with a single upsert,
+inside the caller's transaction, so a step is only counted if it committed.
+Reports read one row per stage and hour in the requested range and never
+touch PendingUser or User.
+"""
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+
+from django.db import connections, router
+from django.utils import timezone
+
+from .enums import FunnelStageEnum
+from .models import FunnelCount
+
+STAGES = (FunnelStageEnum.OTP_ISSUED, FunnelStageEnum.VERIFIED, FunnelStageEnum.FIRST_LOGIN)
+
+
+def hour_bucket(moment: datetime) -> datetime:
+    return moment.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def record_funnel_step(stage: str, count: int = 1, at: datetime = None) -> None:
+    connection = connections[router.db_for_write(FunnelCount)]
+    table = connection.ops.quote_name(FunnelCount._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} (stage, hour, count) VALUES (%s, %s, %s) "
+            f"ON CONFLICT (stage, hour) DO UPDATE SET count = {table}.count + EXCLUDED.count",
+            [stage, hour_bucket(at or timezone.now()), count])
+
+
+def conversion(numerator: int, denominator: int):
+    return round(numerator / denominator, 4) if denominator else None
+
+
+def funnel_report(start: datetime, end: datetime, granularity: str = "day") -> dict:
+    """Totals, step conversion rates and per-bucket counts for [start, end)"""
+    rows = FunnelCount.objects.filter(
+        hour__gte=hour_bucket(start), hour__lt=end).values_list("hour", "stage", "count")
+    step = timedelta(hours=1) if granularity == "hour" else timedelta(days=1)
+    buckets = {}
+    totals = dict.fromkeys(STAGES, 0)
+    for hour, stage, count in rows:
+        bucket_start = hour_bucket(hour)
+        if granularity == "day":
+            bucket_start = bucket_start.replace(hour=0)
+        bucket = buckets.setdefault(bucket_start, dict.fromkeys(STAGES, 0))
+        bucket[stage] += count
+        totals[stage] += count
+    return {
+        "totals": totals,
+        "conversion": {
+            FunnelStageEnum.VERIFIED: conversion(
+                totals[FunnelStageEnum.VERIFIED], totals[FunnelStageEnum.OTP_ISSUED]),
+            FunnelStageEnum.FIRST_LOGIN: conversion(
+                totals[FunnelStageEnum.FIRST_LOGIN], totals[FunnelStageEnum.VERIFIED]),
+        },
+        "buckets": [{"start": bucket_start, "end": bucket_start + step, **counts}
+                    for bucket_start, counts in sorted(buckets.items())],
+    }
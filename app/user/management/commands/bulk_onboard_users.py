@@ -0,0 +1,40 @@
+import csv
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.utils.helpers import chunked
+from user.serializers import BulkOnboardUserSerializer
+from user.utils import read_phones_from_file, summarize_bulk_report
+
+
+class Command(BaseCommand):
+    help = "Onboard phones from a CSV/text file (one phone per line) and send verification OTPs"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File with a phone in the first column")
+        parser.add_argument("--report", help="Write the per-row report to this CSV file")
+
+    def handle(self, *args, **options):
+        try:
+            with open(options["path"], "rb") as upload:
+                phones = read_phones_from_file(upload)
+        except OSError as e:
+            raise CommandError(str(e))
+
+        report = []
+        for batch in chunked(phones, settings.BULK_ONBOARD_MAX_ROWS):
+            serializer = BulkOnboardUserSerializer(data={"phones": batch})
+            if not serializer.is_valid():
+                raise CommandError(serializer.errors)
+            report.extend(serializer.save())
+
+        if options["report"]:
+            with open(options["report"], "w", newline="") as report_file:
+                writer = csv.DictWriter(
+                    report_file, fieldnames=["phone", "normalized_phone", "status"])
+                writer.writeheader()
+                writer.writerows(report)
+
+        for status, count in sorted(summarize_bulk_report(report).items()):
+            self.stdout.write(f"{status}: {count}")
@@ -0,0 +1,75 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from user.models import PendingUser, Token, User
+from user.synthetic import SyntheticData, analyze, copy_rows, pending_phone, user_phone
+from user.utils import user_response_cache
+
+
+class Command(BaseCommand):
+    help = ("Generate synthetic users, pending users and reset tokens for performance testing. "
+            "The same --seed and --start reproduce the same rows.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100000)
+        parser.add_argument("--pending-users", type=int, help="Defaults to a tenth of --users")
+        parser.add_argument("--tokens", type=int,
+                            help="At most --users; defaults to a twentieth of --users")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--start", type=int, default=0,
+                            help="First phone/email index; use a new range to add more data")
+        parser.add_argument("--days", type=int, default=365, help="Signups spread over this many days")
+        parser.add_argument("--otp-window-hours", type=int, default=24,
+                            help="Pending users and tokens spread over this many hours")
+        parser.add_argument("--password", default="passer@@@111", help="Shared by every user")
+        parser.add_argument("--batch-size", type=int, default=50000, help="Rows per COPY")
+
+    def handle(self, *args, **options):
+        users, start = options["users"], options["start"]
+        pending_users = options["pending_users"]
+        pending_users = users // 10 if pending_users is None else pending_users
+        tokens = options["tokens"]
+        tokens = users // 20 if tokens is None else tokens
+        if tokens > users:
+            raise CommandError("Each token belongs to a different generated user; "
+                               "--tokens can't exceed --users")
+        self.check_free(User, user_phone, start, users)
+        self.check_free(PendingUser, pending_phone, start, pending_users)
+
+        data = SyntheticData(options["seed"], timezone.now(), options["days"],
+                             timedelta(hours=options["otp_window_hours"]), options["password"])
+        batch_size = options["batch_size"]
+        self.load(User, data.users(start, users), users, batch_size)
+        self.load(PendingUser, data.pending_users(start, pending_users), pending_users, batch_size)
+        self.load(Token, data.tokens(start, users, tokens), tokens, batch_size)
+        analyze(User, PendingUser, Token)
+
+        # COPY skips the post_save signals that keep these up to date
+        user_response_cache.bump()
+        call_command("rebuild_phone_filter", stdout=self.stdout)
+        if User.objects.count() > settings.REGISTERED_PHONE_FILTER["CAPACITY"]:
+            self.stdout.write(self.style.WARNING(
+                "More users than REGISTERED_PHONE_FILTER['CAPACITY']; the filter's "
+                "false positive rate is above ERROR_RATE"))
+
+    def check_free(self, model, phone, start: int, count: int) -> None:
+        """Phones are unique per range; refuse to COPY a batch that would collide"""
+        if count and model.objects.filter(
+                phone__gte=phone(start), phone__lte=phone(start + count - 1)).exists():
+            raise CommandError(
+                f"{model.__name__} rows already use phones {phone(start)}..{phone(start + count - 1)}; "
+                "pass a different --start")
+
+    def load(self, model, rows, count: int, batch_size: int) -> None:
+        if not count:
+            return
+        name = model._meta.verbose_name_plural
+
+        def progress(written):
+            self.stdout.write(f"{name}: {written}/{count}")
+
+        copy_rows(model, rows, batch_size, progress)
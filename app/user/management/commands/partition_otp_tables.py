@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from user.utils import otp_partitioned_tables
+
+
+class Command(BaseCommand):
+    help = "Create upcoming partitions and drop expired ones for the partitioned OTP tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--convert", action="store_true",
+            help="Convert plain OTP tables to the partitioned layout first. Takes an "
+                 "exclusive lock on each table while its unexpired rows are copied")
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        precreate = settings.OTP_PARTITIONING["PRECREATE"]
+        for _, table in otp_partitioned_tables():
+            if not table.is_partitioned():
+                if not options["convert"]:
+                    self.stdout.write(f"{table.table} is not partitioned; use --convert")
+                    continue
+                table.convert(now, precreate)
+                self.stdout.write(f"Converted {table.table}")
+            created, dropped = table.maintain(now, precreate)
+            self.stdout.write(
+                f"{table.table}: {len(table.partitions())} partitions, "
+                f"created {len(created)}, dropped {len(dropped)}")
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from user.utils import rebuild_registered_phones
+
+
+class Command(BaseCommand):
+    help = "Rebuild the registered-phone Bloom filter used by onboarding and password reset"
+
+    def handle(self, *args, **options):
+        count = rebuild_registered_phones()
+        self.stdout.write(f"Registered-phone filter rebuilt with {count} phones")
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from user.signing import asymmetric_signing_enabled, rotate_signing_keys
+
+
+class Command(BaseCommand):
+    help = "Rotate the JWT signing keys now instead of waiting for the scheduled task"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force", action="store_true",
+            help="Sign new tokens with a new key immediately. The current key stays in the "
+                 "JWKS and keeps verifying the tokens it signed until they expire, so this "
+                 "does not contain a leaked key")
+
+    def handle(self, *args, **options):
+        if not asymmetric_signing_enabled():
+            raise CommandError("JWT_SIGNING['ALGORITHM'] is not an asymmetric algorithm")
+        created = rotate_signing_keys(force=options["force"])
+        if created:
+            self.stdout.write(f"Created signing key {created.kid}, active from {created.activates_at}")
+        else:
+            self.stdout.write("Signing keys are up to date")
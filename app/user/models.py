@@ -1,15 +1,22 @@
+import hashlib
+import hmac
+import secrets
 import uuid
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 
 
 from core.models import AuditableModel
+from core.utils.encryption import decrypt_value, encrypt_value
 from django.conf import settings
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 from django.contrib.postgres.fields import ArrayField
-from .enums import TOKEN_TYPE_CHOICE, ROLE_CHOICE
+from django.contrib.postgres.indexes import BrinIndex
+from django.utils import timezone as dj_timezone
+from .enums import AUTH_EVENT_CHOICE, FUNNEL_STAGE_CHOICE, TOKEN_TYPE_CHOICE, ROLE_CHOICE
 from .managers import CustomUserManager
+from .revocation import revoke_user_tokens
 
 
 def default_role():
@@ -33,6 +40,8 @@ class User(AbstractBaseUser, PermissionsMixin):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     verified = models.BooleanField(default=False)
+    totp_secret = models.CharField(max_length=255, blank=True, null=True)
+    totp_enabled = models.BooleanField(default=False)
     USERNAME_FIELD = "phone"
     REQUIRED_FIELDS = []
     objects = CustomUserManager()
@@ -45,9 +54,23 @@ class User(AbstractBaseUser, PermissionsMixin):
     def __str__(self) -> str:
         return self.phone
 
-    def save_last_login(self) -> None:
-        self.last_login = datetime.now()
-        self.save()
+    def save_last_login(self) -> bool:
+        """Stamp last_login; True only for the one call that recorded the first login"""
+        now = datetime.now()
+        # Conditional, so concurrent first logins can't both see a NULL last_login
+        first_login = self.last_login is None and type(self).objects.filter(
+            pk=self.pk, last_login__isnull=True).update(last_login=now) == 1
+        self.last_login = now
+        if not first_login:
+            self.save(update_fields=["last_login"])
+        return first_login
+
+    def set_totp_secret(self, secret: str) -> None:
+        """Store the authenticator secret encrypted; None removes it"""
+        self.totp_secret = encrypt_value(secret) if secret else None
+
+    def get_totp_secret(self):
+        return decrypt_value(self.totp_secret) if self.totp_secret else None
 
 
 class PendingUser(AuditableModel):
@@ -58,6 +81,11 @@ class PendingUser(AuditableModel):
 
     def __str__(self):
         return f"{str(self.phone)} {self.verification_code}"
+
+    @staticmethod
+    def window_start() -> datetime:
+        """Rows created before this have expired; filtering on it prunes partitions"""
+        return datetime.now(timezone.utc) - timedelta(minutes=settings.OTP_EXPIRE_TIME)
     
     def is_valid(self) -> bool:
         """10 mins OTP validation"""
@@ -81,6 +109,11 @@ class Token(models.Model):
     def __str__(self):
         return f"{str(self.user)} {self.token}"
 
+    @staticmethod
+    def window_start() -> datetime:
+        """Rows created before this have expired; filtering on it prunes partitions"""
+        return datetime.now(timezone.utc) - timedelta(minutes=settings.TOKEN_LIFESPAN)
+
     def is_valid(self) -> bool:
         lifespan_in_seconds = float(settings.TOKEN_LIFESPAN * 60 )
         now = datetime.now(timezone.utc)
@@ -90,6 +123,111 @@ class Token(models.Model):
             return False
         return True
 
-    def reset_user_password(self, password: str) -> None:
-        self.user.set_password(password)
+    def reset_user_password(self, password: str, password_hash: str = None) -> None:
+        """Pass password_hash when the password was already hashed off-thread"""
+        if password_hash:
+            self.user.password = password_hash
+        else:
+            self.user.set_password(password)
         self.user.save()
+        revoke_user_tokens(self.user.id)
+
+
+class SigningKey(models.Model):
+    """Asymmetric JWT signing key; see user.signing for the rotation rules"""
+    kid = models.CharField(max_length=64, primary_key=True)
+    algorithm = models.CharField(max_length=10)
+    private_key = models.TextField()  # encrypted PEM
+    public_key = models.TextField()
+    activates_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ("-activates_at",)
+
+    def __str__(self):
+        return f"{self.kid} ({self.algorithm})"
+
+
+class APIKey(models.Model):
+    """Long-lived credential for server-to-server clients; only a hash of the secret is stored"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
+                             related_name="api_keys")
+    name = models.CharField(max_length=100, blank=True)
+    prefix = models.CharField(max_length=16, unique=True)
+    hashed_secret = models.CharField(max_length=64)
+    expires_at = models.DateTimeField(null=True, blank=True)
+    revoked = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ("-created_at",)
+
+    def __str__(self):
+        return f"{self.user} {self.prefix}"
+
+    @staticmethod
+    def hash_secret(secret: str) -> str:
+        # Secrets are 256 random bits, so a fast hash is as strong as a slow one
+        return hashlib.sha256(secret.encode()).hexdigest()
+
+    @classmethod
+    def create_key(cls, user, name: str = "", expires_at: datetime = None):
+        """Returns (api_key, raw key); the raw key is never stored and only shown once"""
+        prefix, secret = secrets.token_hex(4), secrets.token_urlsafe(32)
+        api_key = cls.objects.create(user=user, name=name, prefix=prefix,
+                                     hashed_secret=cls.hash_secret(secret), expires_at=expires_at)
+        return api_key, f"{prefix}.{secret}"
+
+    def matches(self, secret: str) -> bool:
+        return hmac.compare_digest(self.hashed_secret, self.hash_secret(secret))
+
+    def is_valid(self) -> bool:
+        return not self.revoked and (
+            self.expires_at is None or self.expires_at > datetime.now(timezone.utc))
+
+
+class AuthEvent(models.Model):
+    """
+    Append-only record of an authentication event, written in batches by
+    user.events. Rows are never updated; user is kept without a constraint so
+    inserts skip the FK check and events outlive deleted users.
+    """
+    id = models.BigAutoField(primary_key=True)
+    event_type = models.CharField(max_length=40, choices=AUTH_EVENT_CHOICE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True,
+                             on_delete=models.DO_NOTHING, db_constraint=False,
+                             db_index=False, related_name="+")
+    phone = models.CharField(max_length=20, blank=True)
+    ip_address = models.GenericIPAddressField(null=True, blank=True)
+    metadata = models.JSONField(default=dict, blank=True)
+    # When the event happened, not when its batch was flushed
+    created_at = models.DateTimeField(default=dj_timezone.now)
+
+    class Meta:
+        ordering = ("-created_at",)
+        indexes = [
+            # Rows arrive in created_at order, so a BRIN index stays tiny and
+            # cheap to maintain while still narrowing time-range scans
+            BrinIndex(fields=["created_at"], name="user_authevent_created_brin"),
+            models.Index(fields=["user", "created_at"], name="user_authevent_user_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} {self.phone or self.user_id} {self.created_at}"
+
+
+class FunnelCount(models.Model):
+    """Onboarding funnel rollup: how many users reached `stage` during `hour`"""
+    stage = models.CharField(max_length=20, choices=FUNNEL_STAGE_CHOICE)
+    hour = models.DateTimeField()
+    count = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["stage", "hour"], name="user_funnelcount_stage_hour"),
+        ]
+
+    def __str__(self):
+        return f"{self.stage} {self.hour}: {self.count}"
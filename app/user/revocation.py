@@ -0,0 +1,157 @@
+"""
+Access and refresh token revocation.
+
+A token is revoked when its jti was revoked, or when it was issued before its
+user's "tokens issued before" cutoff. iat only has one-second resolution, so
+tokens also carry their issue time in milliseconds (ISSUED_AT_MS_CLAIM, set by
+stamp_issued_at) and a login right after a revocation is not revoked with the
+tokens it replaces. Tokens without that claim are compared on iat. The default cache, which must be shared
+between processes (Redis, see CACHES), holds every entry that can still affect
+an unexpired token in one versioned state value. Each process
+keeps an in-memory copy and re-reads the state only when the version moved,
+checking the version at most once per SYNC_INTERVAL. A revocation check is
+therefore two dict lookups; other processes honour a new revocation up to
+SYNC_INTERVAL late.
+
+The state is stored without a timeout and must not be evicted (with Redis,
+use a volatile-* eviction policy).
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework_simplejwt.settings import api_settings
+
+logger = logging.getLogger(__name__)
+
+STATE_KEY = "revocation:state"
+VERSION_KEY = "revocation:version"
+LOCK_KEY = "revocation:lock"
+ISSUED_AT_MS_CLAIM = "iat_ms"
+LOCK_TIMEOUT = 5 #secs
+
+
+def max_token_lifetime() -> int:
+    """Seconds after which no token issued now can still be valid"""
+    lifetime = max(api_settings.ACCESS_TOKEN_LIFETIME, api_settings.REFRESH_TOKEN_LIFETIME)
+    return int(lifetime.total_seconds()) + 1
+
+
+def compact_jti(jti: str):
+    """simplejwt jtis are 32 hex digits; an int takes about half the memory of the str"""
+    try:
+        return int(jti, 16)
+    except (TypeError, ValueError):
+        return jti
+
+
+class RevocationStateLocked(RuntimeError):
+    pass
+
+
+class RevocationSet:
+
+    def __init__(self):
+        self.jtis = {}  # compact jti -> exp
+        self.cutoffs = {}  # user id -> tokens issued up to this epoch time (secs) are revoked
+        self.version = None
+        self.checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def sync(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self.checked_at < settings.TOKEN_REVOCATION["SYNC_INTERVAL"]:
+            return
+        version = cache.get(VERSION_KEY)
+        self.checked_at = now
+        if version == self.version and not force:
+            return
+        state = cache.get(STATE_KEY) or {"jti": {}, "users": {}}
+        with self._lock:
+            self.jtis = {compact_jti(jti): exp for jti, exp in state["jti"].items()}
+            self.cutoffs = dict(state["users"])
+            self.version = version
+
+    def is_revoked(self, payload: dict) -> bool:
+        self.sync()
+        jti = payload.get(api_settings.JTI_CLAIM)
+        if jti is not None and compact_jti(jti) in self.jtis:
+            return True
+        cutoff = self.cutoffs.get(str(payload.get(api_settings.USER_ID_CLAIM)))
+        if cutoff is None:
+            return False
+        issued_at_ms = payload.get(ISSUED_AT_MS_CLAIM)
+        if issued_at_ms is None:
+            return payload.get("iat", 0) < cutoff
+        return issued_at_ms <= cutoff * 1000
+
+    def update(self, jtis: dict = None, cutoffs: dict = None, wait: float = LOCK_TIMEOUT + 1) -> None:
+        """
+        Merge entries into the shared state, dropping ones no token can need.
+        Raises RevocationStateLocked when the lock isn't free within `wait`
+        secs: writing without it could lose a concurrent revocation. The
+        default waits past the lock's timeout, so only live contention fails.
+        """
+        deadline = time.monotonic() + wait
+        while not cache.add(LOCK_KEY, 1, timeout=LOCK_TIMEOUT):
+            if time.monotonic() >= deadline:
+                raise RevocationStateLocked("Token revocation state is locked")
+            time.sleep(0.01)
+        try:
+            now = time.time()
+            lifetime = max_token_lifetime()
+            state = cache.get(STATE_KEY) or {"jti": {}, "users": {}}
+            state = {
+                "jti": {jti: exp for jti, exp in state["jti"].items() if exp > now},
+                "users": {user_id: cutoff for user_id, cutoff in state["users"].items()
+                          if cutoff + lifetime > now},
+            }
+            state["jti"].update(jtis or {})
+            for user_id, cutoff in (cutoffs or {}).items():
+                state["users"][user_id] = max(cutoff, state["users"].get(user_id, cutoff))
+            cache.set(STATE_KEY, state, timeout=None)
+            cache.set(VERSION_KEY, time.time_ns(), timeout=None)
+        finally:
+            cache.delete(LOCK_KEY)
+        self.sync(force=True)
+
+
+revocation_set = RevocationSet()
+
+
+def apply_revocations(jtis: dict = None, cutoffs: dict = None) -> None:
+    """
+    Write revocations from a request in one locked update. Request threads only
+    wait REQUEST_LOCK_WAIT for the lock; after that the write goes to a Celery
+    task, which waits longer and retries, and other processes honour it late.
+    """
+    try:
+        revocation_set.update(jtis, cutoffs, wait=settings.TOKEN_REVOCATION["REQUEST_LOCK_WAIT"])
+    except RevocationStateLocked:
+        from .tasks import apply_token_revocations
+
+        logger.warning("Token revocation state is busy; revoking in the background")
+        apply_token_revocations.delay(jtis=jtis, cutoffs=cutoffs)
+
+
+def revoke_token(jti: str, expires_at: int) -> None:
+    if expires_at > time.time():
+        apply_revocations(jtis={jti: expires_at})
+
+
+def stamp_issued_at(token) -> None:
+    """Record the token's issue time with sub-second resolution; copied into its access tokens"""
+    token[ISSUED_AT_MS_CLAIM] = int(time.time() * 1000)
+
+
+def revoke_user_tokens(*user_ids) -> None:
+    """Revoke every token issued to the given users so far"""
+    if user_ids:
+        cutoff = time.time()
+        apply_revocations(cutoffs={str(user_id): cutoff for user_id in user_ids})
+
+
+def is_token_revoked(payload: dict) -> bool:
+    return revocation_set.is_revoked(payload)
@@ -1,29 +1,66 @@
-from datetime import datetime, timezone
+import hashlib
+import time
+from datetime import datetime, timedelta, timezone
 
+import pyotp
+from django.conf import settings
 from django.contrib.auth import authenticate, get_user_model
 from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
 from django.db import transaction
 from django.utils.translation import gettext_lazy as _
 from rest_framework import exceptions, serializers
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
-
-from .enums import TokenEnum
-from .models import PendingUser, Token, User
-from .tasks import send_phone_notification
-from .utils import clean_phone, generate_otp, is_admin_user
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.serializers import (TokenObtainPairSerializer,
+                                                  TokenObtainSerializer)
+from rest_framework_simplejwt.serializers import \
+    TokenRefreshSerializer as BaseTokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from core.utils.helpers import chunked
+
+from .enums import ROLE_CHOICE, AuthEventEnum, FunnelStageEnum, TokenEnum
+from .events import emit_auth_event
+from .funnel import record_funnel_step
+from .models import APIKey, PendingUser, Token, User
+from .revocation import is_token_revoked, revoke_user_tokens, stamp_issued_at
+from .tasks import send_bulk_phone_notifications, send_phone_notification
+from .utils import (clean_phone, create_totp_challenge, discard_totp_challenge,
+                    generate_otp, get_totp_challenge_user, is_admin_user,
+                    otp_attempt_counter, otp_matches, read_phones_from_file,
+                    registered_phones, reject_if_locked, throttle_otp_issuance,
+                    totp_provisioning_uri, verify_totp)
 
 
 class CustomObtainTokenPairSerializer(TokenObtainPairSerializer):
 
     def validate(self, attrs):
-        data = super().validate(attrs)
-        refresh = self.get_token(self.user)
-        access_token = refresh.access_token
-        self.user.save_last_login()
-        data['refresh'] = str(refresh)
-        data['access'] = str(access_token)
+        request = self.context.get("request")
+        # Only check the password here; tokens are issued once every factor passed
+        try:
+            data = TokenObtainSerializer.validate(self, attrs)
+        except exceptions.AuthenticationFailed:
+            emit_auth_event(AuthEventEnum.LOGIN_FAILED, request,
+                            phone=str(attrs.get(self.username_field, ""))[:20])
+            raise
+        if self.user.totp_enabled:
+            if not self.user.verified:
+                raise exceptions.AuthenticationFailed(
+                    _('Account not verified.'), code='authentication')
+            emit_auth_event(AuthEventEnum.TOTP_CHALLENGE, request, self.user)
+            return {"totp_required": True, "challenge": create_totp_challenge(self.user)}
+        data.update(self.token_pair_for(self.user))
+        emit_auth_event(AuthEventEnum.LOGIN, request, self.user, method="password")
         return data
 
+    @classmethod
+    def token_pair_for(cls, user: User) -> dict:
+        refresh = cls.get_token(user)
+        if user.save_last_login():
+            record_funnel_step(FunnelStageEnum.FIRST_LOGIN)
+        return {"refresh": str(refresh), "access": str(refresh.access_token)}
+
     @classmethod
     def get_token(cls, user: User):
         if not user.verified:
@@ -35,24 +72,153 @@ class CustomObtainTokenPairSerializer(TokenObtainPairSerializer):
         token['lastname'] = user.lastname
         token["email"] = user.email
         token["roles"] = user.roles
+        stamp_issued_at(token)
         return token
 
 
+class TOTPLoginSerializer(serializers.Serializer):
+    """Second login step for users with an authenticator app enrolled"""
+    challenge = serializers.CharField()
+    code = serializers.CharField()
+
+    def validate(self, attrs: dict):
+        challenge = attrs["challenge"]
+        user = get_totp_challenge_user(challenge)
+        if user is None:
+            raise exceptions.AuthenticationFailed(
+                _('Login challenge is invalid or has expired.'), code='authentication')
+        counter, attempt_key = otp_attempt_counter(), f"totp:{user.id}"
+        reject_if_locked(counter, attempt_key)
+        request = self.context.get("request")
+        if not verify_totp(user, attrs["code"]):
+            emit_auth_event(AuthEventEnum.LOGIN_FAILED, request, user, method="totp")
+            if counter.record_failure(attempt_key):
+                discard_totp_challenge(challenge)
+            raise serializers.ValidationError({"code": "Invalid authenticator code."})
+        counter.reset(attempt_key)
+        discard_totp_challenge(challenge)
+        tokens = CustomObtainTokenPairSerializer.token_pair_for(user)
+        emit_auth_event(AuthEventEnum.LOGIN, request, user, method="totp")
+        return tokens
+
+
+class TOTPSetupSerializer(serializers.Serializer):
+
+    def validate(self, attrs: dict):
+        if self.context["request"].user.totp_enabled:
+            raise serializers.ValidationError("Authenticator app is already enabled.")
+        return attrs
+
+    def save(self):
+        """Store a fresh secret, not yet enabled; returns (secret, provisioning uri)"""
+        user: User = self.context["request"].user
+        secret = pyotp.random_base32()
+        user.set_totp_secret(secret)
+        user.save(update_fields=["totp_secret"])
+        return secret, totp_provisioning_uri(user, secret)
+
+
+class TOTPCodeSerializer(serializers.Serializer):
+    """Confirms enrollment (enable=True) or disables TOTP given a current code"""
+    code = serializers.CharField()
+
+    def validate_code(self, value):
+        user: User = self.context["request"].user
+        if not user.totp_secret:
+            raise serializers.ValidationError("Authenticator app is not set up.")
+        if self.context.get("enable") and user.totp_enabled:
+            raise serializers.ValidationError("Authenticator app is already enabled.")
+        counter, attempt_key = otp_attempt_counter(), f"totp:{user.id}"
+        reject_if_locked(counter, attempt_key)
+        if not verify_totp(user, value):
+            counter.record_failure(attempt_key)
+            raise serializers.ValidationError("Invalid authenticator code.")
+        counter.reset(attempt_key)
+        return value
+
+    def save(self):
+        user: User = self.context["request"].user
+        if self.context.get("enable"):
+            user.totp_enabled = True
+        else:
+            user.totp_enabled = False
+            user.set_totp_secret(None)
+        user.save(update_fields=["totp_secret", "totp_enabled"])
+        emit_auth_event(AuthEventEnum.TOTP_ENABLED if user.totp_enabled else AuthEventEnum.TOTP_DISABLED,
+                        self.context["request"], user)
+
+
+class TokenRefreshSerializer(BaseTokenRefreshSerializer):
+    """Refuse to refresh tokens that were revoked"""
+
+    def validate(self, attrs):
+        if is_token_revoked(self.token_class(attrs["refresh"]).payload):
+            raise exceptions.AuthenticationFailed(
+                _('Token has been revoked'), code='token_not_valid')
+        return super().validate(attrs)
+
+
+class TokenIntrospectionSerializer(serializers.Serializer):
+    """
+    Verify a batch of access tokens from their signature and claims alone.
+    Decoded results are cached for the token's remaining lifetime; revocation
+    is checked on every call.
+    """
+    tokens = serializers.ListField(child=serializers.CharField(), allow_empty=False)
+
+    def validate_tokens(self, value):
+        max_batch = settings.TOKEN_INTROSPECTION["MAX_BATCH"]
+        if len(value) > max_batch:
+            raise serializers.ValidationError(f"At most {max_batch} tokens per request.")
+        return value
+
+    def validate(self, attrs: dict):
+        tokens = attrs["tokens"]
+        cache_keys = {token: "introspect:" + hashlib.sha256(token.encode()).hexdigest()
+                      for token in set(tokens)}
+        cached = cache.get_many(cache_keys.values())
+        results = {}
+        for token, cache_key in cache_keys.items():
+            result = cached.get(cache_key)
+            if result is None:
+                result, timeout = self.introspect(token)
+                cache.set(cache_key, result, timeout=timeout)
+            if result["active"] and is_token_revoked(result):
+                result = {"active": False}
+            results[token] = result
+        return {"results": [results[token] for token in tokens]}
+
+    @staticmethod
+    def introspect(token: str):
+        """Returns (result, seconds it may be cached)"""
+        try:
+            payload = AccessToken(token).payload
+        except TokenError:
+            return {"active": False}, settings.TOKEN_INTROSPECTION["INVALID_RESULT_TTL"]
+        result = {
+            "active": True,
+            jwt_settings.USER_ID_CLAIM: payload.get(jwt_settings.USER_ID_CLAIM),
+            "roles": payload.get("roles", []),
+            "exp": payload["exp"],
+            "iat": payload.get("iat"),
+            "jti": payload.get(jwt_settings.JTI_CLAIM),
+        }
+        return result, max(1, int(payload["exp"] - time.time()))
+
+
 class AuthTokenSerializer(serializers.Serializer):
     """Serializer for user authentication object"""
 
-    email = serializers.CharField()
+    phone = serializers.CharField()
     password = serializers.CharField(
         style={"input_type": "password"}, trim_whitespace=False)
+    name = serializers.CharField(max_length=100, required=False, default="")
 
     def validate(self, attrs):
         """Validate and authenticate the user"""
-        email = attrs.get("email")
-        password = attrs.get("password")
-        if email:
-            user = authenticate(request=self.context.get(
-                "request"), username=email.lower().strip(), password=password)
-
+        user = authenticate(request=self.context.get("request"),
+                            phone=clean_phone(attrs["phone"].strip()),
+                            password=attrs["password"])
         if not user:
             msg = _("Unable to authenticate with provided credentials")
             raise serializers.ValidationError(msg, code="authentication")
@@ -60,6 +226,13 @@ class AuthTokenSerializer(serializers.Serializer):
         return attrs
 
 
+class APIKeySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = APIKey
+        fields = ["prefix", "name", "expires_at", "revoked", "created_at"]
+        read_only_fields = ["prefix", "revoked", "created_at"]
+
+
 class PasswordChangeSerializer(serializers.Serializer):
     old_password = serializers.CharField(max_length=128, required=False)
     new_password = serializers.CharField(max_length=128, min_length=5)
@@ -76,11 +249,40 @@ class PasswordChangeSerializer(serializers.Serializer):
         new_password = self.validated_data["new_password"]
         user.set_password(new_password)
         user.save(update_fields=["password"])
+        revoke_user_tokens(user.id)
+        emit_auth_event(AuthEventEnum.PASSWORD_CHANGED, self.context["request"], user)
 
 
 class CreatePasswordFromResetOTPSerializer(serializers.Serializer):
     otp = serializers.CharField(required=True)
     new_password = serializers.CharField(required=True)
+    phone = serializers.CharField(required=True, allow_blank=False)
+
+    def validate(self, attrs: dict):
+        attrs['phone'] = clean_phone(attrs['phone'].lower().strip())
+        return super().validate(attrs)
+
+    def get_valid_token(self):
+        """
+        Look up the reset token for the submitted phone and OTP, counting failed
+        guesses per phone; the token is invalidated once they run out.
+        """
+        otp, phone = self.validated_data['otp'], self.validated_data['phone']
+        counter, attempt_key = otp_attempt_counter(), f"reset:{phone}"
+        reject_if_locked(counter, attempt_key)
+
+        token = Token.objects.select_related('user').filter(
+            user__phone=phone, token_type=TokenEnum.PASSWORD_RESET,
+            created_at__gte=Token.window_start()).first()
+        matched = token is not None and otp_matches(token.token, otp)
+        if matched and token.is_valid():
+            counter.reset(attempt_key)
+            return token
+        emit_auth_event(AuthEventEnum.PASSWORD_RESET_FAILED, self.context['request'],
+                        token.user if matched else None, phone=phone)
+        if counter.record_failure(attempt_key) and token:
+            token.delete()
+        return None
 
 
 class AccountVerificationSerializer(serializers.Serializer):
@@ -90,13 +292,22 @@ class AccountVerificationSerializer(serializers.Serializer):
     def validate(self, attrs: dict):
         phone_number: str = attrs.get('phone').strip().lower()
         mobile: str = clean_phone(phone_number)
+        counter, attempt_key = otp_attempt_counter(), f"verify:{mobile}"
+        reject_if_locked(counter, attempt_key)
         pending_user: PendingUser = PendingUser.objects.filter(
-            phone=mobile, verification_code=attrs.get('otp')).first()
-        if pending_user and pending_user.is_valid():
+            phone=mobile, created_at__gte=PendingUser.window_start()).first()
+        if (pending_user and otp_matches(pending_user.verification_code, attrs.get('otp'))
+                and pending_user.is_valid()):
+            counter.reset(attempt_key)
             attrs['phone'] = mobile
             attrs['password'] = pending_user.password
             attrs['pending_user'] = pending_user
         else:
+            emit_auth_event(AuthEventEnum.VERIFICATION_FAILED, self.context.get('request'),
+                            phone=mobile)
+            if counter.record_failure(attempt_key) and pending_user:
+                # Out of guesses: the code can no longer be used
+                PendingUser.objects.filter(pk=pending_user.pk).update(verification_code=None)
             raise serializers.ValidationError(
                 {'otp': 'Verification failed. Invalid OTP or Number'})
         return super().validate(attrs)
@@ -105,8 +316,10 @@ class AccountVerificationSerializer(serializers.Serializer):
     def create(self, validated_data: dict):
         validated_data.pop('otp')
         pending_user = validated_data.pop('pending_user')
-        User.objects.create_user_with_phone(**validated_data)
+        user = User.objects.create_user_with_phone(**validated_data)
         pending_user.delete()
+        emit_auth_event(AuthEventEnum.ACCOUNT_VERIFIED, self.context.get('request'), user)
+        record_funnel_step(FunnelStageEnum.VERIFIED)
         return validated_data
 
 
@@ -121,7 +334,10 @@ class InitiatePasswordResetSerializer(serializers.Serializer):
         phone = attrs.get('phone')
         strip_number = phone.lower().strip()
         mobile = clean_phone(strip_number)
-        user = get_user_model().objects.filter(phone=mobile, is_active=True).first()
+        throttle_otp_issuance(mobile, self.context.get('request'))
+        user = None
+        if registered_phones.might_contain(mobile):
+            user = get_user_model().objects.filter(phone=mobile, is_active=True).first()
         if not user:
             raise serializers.ValidationError({'phone':'Phone number not registered.'})
         attrs['phone'] = mobile
@@ -129,6 +345,12 @@ class InitiatePasswordResetSerializer(serializers.Serializer):
         return super().validate(attrs)
     
     def create(self, validated_data):
+        token, message_info = self.save_reset_token(validated_data)
+        send_phone_notification.delay(message_info)
+        return token
+
+    def save_reset_token(self, validated_data: dict):
+        """Store a fresh reset OTP; returns the token and the SMS to send"""
         phone = validated_data.get('phone')
         user = validated_data.get('user')
         otp = generate_otp()
@@ -147,9 +369,9 @@ class InitiatePasswordResetSerializer(serializers.Serializer):
             'message': f"Password Reset!\nUse {otp} to reset your password.\nIt expires in 10 minutes",
             'phone': phone
         }
-
-        send_phone_notification.delay(message_info)
-        return token
+        otp_attempt_counter().reset(f"reset:{phone}")
+        emit_auth_event(AuthEventEnum.PASSWORD_RESET_REQUESTED, self.context.get('request'), user)
+        return token, message_info
 
 
 class ListUserSerializer(serializers.ModelSerializer):
@@ -206,7 +428,11 @@ class UpdateUserSerializer(serializers.ModelSerializer):
         """Prevent user from updating password"""
         if validated_data.get("password", False):
             validated_data.pop('password')
+        previous_roles = set(instance.roles)
         instance = super().update(instance, validated_data)
+        if not previous_roles <= set(instance.roles):
+            # Tokens carry the roles claim, so a downgrade must invalidate them
+            revoke_user_tokens(instance.id)
         return instance
 
 
@@ -228,13 +454,24 @@ class OnboardUserSerializer(serializers.Serializer):
         phone = attrs.get('phone')
         strip_number = phone.lower().strip()
         cleaned_number = clean_phone(strip_number)
-        if get_user_model().objects.filter(phone__iexact=cleaned_number).exists():
+        throttle_otp_issuance(cleaned_number, self.context.get('request'))
+        # Phones are stored normalized by clean_phone, so an exact lookup can use
+        # the unique index; definite filter misses skip the query entirely.
+        if (registered_phones.might_contain(cleaned_number)
+                and get_user_model().objects.filter(phone=cleaned_number).exists()):
             raise serializers.ValidationError(
                 {'phone': 'Phone number already exists'})
         attrs['phone'] = cleaned_number
         return super().validate(attrs)
 
     def create(self, validated_data: dict):
+        user, message_info = self.save_pending_user(
+            validated_data, make_password(validated_data.get('password')))
+        send_phone_notification.delay(message_info)
+        return user
+
+    def save_pending_user(self, validated_data: dict, password_hash: str):
+        """Store the pending user and OTP; returns the user and the SMS to send"""
         otp = generate_otp()
         phone_number = validated_data.get('phone')
         user, _ = PendingUser.objects.update_or_create(
@@ -242,13 +479,132 @@ class OnboardUserSerializer(serializers.Serializer):
             defaults={
                 "phone": phone_number,
                 "verification_code": otp,
-                "password": make_password(validated_data.get('password')),
+                "password": password_hash,
                 "created_at": datetime.now(timezone.utc)
             }
         )
+        otp_attempt_counter().reset(f"verify:{phone_number}")
+        emit_auth_event(AuthEventEnum.OTP_ISSUED, self.context.get('request'), phone=phone_number)
+        record_funnel_step(FunnelStageEnum.OTP_ISSUED)
         message_info = {
             'message': f"Account Verification!\nYour OTP for BotoApp is {otp}.\nIt expires in 10 minutes",
             'phone': user.phone
         }
-        send_phone_notification.delay(message_info)
-        return user
+        return user, message_info
+
+
+class BulkOnboardUserSerializer(serializers.Serializer):
+    """Onboard many phones at once; accepts a list of phones and/or a CSV file"""
+    phones = serializers.ListField(
+        child=serializers.CharField(allow_blank=True), required=False)
+    file = serializers.FileField(required=False)
+
+    def validate(self, attrs: dict):
+        phones = list(attrs.get('phones', []))
+        upload = attrs.pop('file', None)
+        if upload:
+            phones.extend(read_phones_from_file(upload))
+        if not phones:
+            raise serializers.ValidationError(
+                {'phones': 'Provide a list of phones or a file.'})
+        if len(phones) > settings.BULK_ONBOARD_MAX_ROWS:
+            raise serializers.ValidationError(
+                {'phones': f'At most {settings.BULK_ONBOARD_MAX_ROWS} phones per request.'})
+        attrs['phones'] = phones
+        return super().validate(attrs)
+
+    def create(self, validated_data: dict):
+        """Returns a per-row report in input order"""
+        report = []
+        rows_by_phone = {}
+        for raw_phone in validated_data['phones']:
+            row = {'phone': raw_phone, 'status': 'invalid'}
+            report.append(row)
+            try:
+                mobile = clean_phone(raw_phone.lower().strip())
+            except serializers.ValidationError:
+                continue
+            row['normalized_phone'] = mobile
+            if mobile in rows_by_phone:
+                row['status'] = 'duplicate'
+                continue
+            rows_by_phone[mobile] = row
+
+        existing = set(get_user_model().objects.filter(
+            phone__in=list(rows_by_phone)).values_list('phone', flat=True))
+        messages = []
+        pending_users = []
+        # Bulk onboarded users get an unusable password; they set one through
+        # the password reset flow once the account is verified.
+        unusable_password = make_password(None)
+        for mobile, row in rows_by_phone.items():
+            if mobile in existing:
+                row['status'] = 'exists'
+                continue
+            otp = generate_otp()
+            pending_users.append(PendingUser(
+                phone=mobile, verification_code=otp, password=unusable_password))
+            messages.append({
+                'message': f"Account Verification!\nYour OTP for BotoApp is {otp}.\nIt expires in 10 minutes",
+                'phone': mobile
+            })
+            row['status'] = 'created'
+
+        new_phones = [pending_user.phone for pending_user in pending_users]
+        with transaction.atomic():
+            PendingUser.objects.filter(phone__in=new_phones).delete()
+            PendingUser.objects.bulk_create(
+                pending_users, batch_size=settings.BULK_OTP_CHUNK_SIZE)
+            if pending_users:
+                record_funnel_step(FunnelStageEnum.OTP_ISSUED, count=len(pending_users))
+        for pending_user in pending_users:
+            emit_auth_event(AuthEventEnum.OTP_ISSUED, self.context.get('request'),
+                            phone=pending_user.phone, bulk=True)
+
+        for chunk in chunked(messages, settings.BULK_OTP_CHUNK_SIZE):
+            send_bulk_phone_notifications.delay(chunk)
+        return report
+
+
+class BulkUserSelectionSerializer(serializers.Serializer):
+    """Select users by id, or every user matching the request's filter/search params"""
+    ids = serializers.ListField(child=serializers.UUIDField(), required=False)
+    all_matching = serializers.BooleanField(default=False)
+
+    def validate(self, attrs: dict):
+        if not attrs.get('ids') and not attrs.get('all_matching'):
+            raise serializers.ValidationError(
+                {'ids': 'Provide ids or set all_matching to apply to the filtered users.'})
+        return super().validate(attrs)
+
+
+class BulkUserUpdateSerializer(BulkUserSelectionSerializer):
+    roles = serializers.ListField(
+        child=serializers.ChoiceField(choices=ROLE_CHOICE), required=False, min_length=1)
+    is_active = serializers.BooleanField(required=False)
+    verified = serializers.BooleanField(required=False)
+
+    def validate(self, attrs: dict):
+        attrs = super().validate(attrs)
+        changes = {field: attrs[field]
+                   for field in ['roles', 'is_active', 'verified'] if field in attrs}
+        if not changes:
+            raise serializers.ValidationError(
+                'Provide at least one of roles, is_active or verified.')
+        attrs['changes'] = changes
+        return attrs
+
+
+class FunnelQuerySerializer(serializers.Serializer):
+    start = serializers.DateTimeField()
+    end = serializers.DateTimeField(required=False)
+    granularity = serializers.ChoiceField(choices=("hour", "day"), default="day")
+
+    def validate(self, attrs: dict):
+        attrs.setdefault("end", datetime.now(timezone.utc))
+        if attrs["end"] <= attrs["start"]:
+            raise serializers.ValidationError({"end": "end must be after start."})
+        if attrs["end"] - attrs["start"] > timedelta(days=settings.FUNNEL_MAX_RANGE_DAYS):
+            raise serializers.ValidationError(
+                {"end": f"At most {settings.FUNNEL_MAX_RANGE_DAYS} days per query."})
+        return attrs
@@ -0,0 +1,29 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import User
+from .utils import registered_phones, user_response_cache
+
+# Saves limited to these fields don't change anything the user endpoints return
+UNLISTED_FIELDS = {"last_login", "password"}
+
+
+@receiver(post_save, sender=User)
+def track_registered_phone(sender, instance, update_fields=None, **kwargs):
+    if instance.phone and (update_fields is None or "phone" in update_fields):
+        # After commit, so a filter rebuild either reads the row or gets the phone
+        phone = instance.phone
+        transaction.on_commit(lambda: registered_phones.add(phone))
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_responses_on_save(sender, instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= UNLISTED_FIELDS:
+        return
+    user_response_cache.bump_on_commit()
+
+
+@receiver(post_delete, sender=User)
+def invalidate_user_responses_on_delete(sender, instance, **kwargs):
+    user_response_cache.bump_on_commit()
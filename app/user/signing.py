@@ -0,0 +1,253 @@
+"""
+Asymmetric JWT signing with rotating, kid-tagged keys.
+
+Keys live in the SigningKey table, with the private halves encrypted. The newest
+key whose activates_at has passed signs new tokens. A rotated-out key keeps
+verifying until every token it could have signed has expired. A new key is
+published in the JWKS PUBLISH_AHEAD before it starts signing, so services that
+cache the JWKS already know it when they see the first token signed with it.
+"""
+import base64
+import hashlib
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+from django.conf import settings
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from jwt.algorithms import OKPAlgorithm, RSAAlgorithm
+from rest_framework_simplejwt.backends import TokenBackend
+from rest_framework_simplejwt.exceptions import TokenBackendError
+from rest_framework_simplejwt.settings import api_settings
+
+from core.utils.conditional import make_etag
+from core.utils.encryption import decrypt_value, encrypt_value
+
+from .models import SigningKey
+
+ASYMMETRIC_ALGORITHMS = ("RS256", "EdDSA")
+
+
+def asymmetric_signing_enabled() -> bool:
+    return settings.JWT_SIGNING["ALGORITHM"] in ASYMMETRIC_ALGORITHMS
+
+
+def generate_private_key(algorithm: str):
+    if algorithm == "RS256":
+        return rsa.generate_private_key(
+            public_exponent=65537, key_size=settings.JWT_SIGNING["RSA_KEY_SIZE"])
+    if algorithm == "EdDSA":
+        return ed25519.Ed25519PrivateKey.generate()
+    raise ValueError(f"Unsupported JWT signing algorithm {algorithm}")
+
+
+def create_signing_key(algorithm: str, activates_at: datetime = None) -> SigningKey:
+    private_key = generate_private_key(algorithm)
+    public_der = private_key.public_key().public_bytes(
+        serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo)
+    private_pem = private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption())
+    return SigningKey.objects.create(
+        kid=base64.urlsafe_b64encode(hashlib.sha256(public_der).digest()[:16]).decode().rstrip("="),
+        algorithm=algorithm,
+        private_key=encrypt_value(private_pem.decode()),
+        public_key=private_key.public_key().public_bytes(
+            serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo).decode(),
+        activates_at=activates_at or timezone.now(),
+    )
+
+
+def max_token_lifetime():
+    lifetime = max(api_settings.ACCESS_TOKEN_LIFETIME, api_settings.REFRESH_TOKEN_LIFETIME)
+    return lifetime + token_backend.get_leeway()
+
+
+@dataclass
+class LoadedKey:
+    kid: str
+    algorithm: str
+    activates_at: datetime
+    expires_at: datetime
+    public_key: object
+    row: SigningKey
+    _private_key: object = None
+
+    @property
+    def private_key(self):
+        if self._private_key is None:
+            self._private_key = serialization.load_pem_private_key(
+                decrypt_value(self.row.private_key).encode(), password=None)
+        return self._private_key
+
+    def jwk(self) -> dict:
+        algorithm = RSAAlgorithm if self.algorithm == "RS256" else OKPAlgorithm
+        jwk = algorithm.to_jwk(self.public_key, as_dict=True)
+        jwk.update(kid=self.kid, alg=self.algorithm, use="sig")
+        return jwk
+
+
+class KeyRing:
+    """Per-process view of the SigningKey table, reloaded every KEY_CACHE_TTL"""
+    MIN_RELOAD_INTERVAL = 5  # secs between reloads forced by an unknown kid
+
+    def __init__(self):
+        self._keys = None
+        self._loaded_at = 0.0
+        self._jwks = None
+        self._lock = threading.Lock()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._keys, self._jwks = None, None
+
+    def _load(self, force: bool = False) -> list:
+        with self._lock:
+            age = time.monotonic() - self._loaded_at
+            if self._keys is not None and not (
+                    age >= settings.JWT_SIGNING["KEY_CACHE_TTL"]
+                    or (force and age >= self.MIN_RELOAD_INTERVAL)):
+                return self._keys
+            rows = list(SigningKey.objects.order_by("activates_at"))
+            previous = {key.kid: key for key in self._keys or []}
+            lifetime = max_token_lifetime()
+            keys = []
+            for index, row in enumerate(rows):
+                successor = rows[index + 1] if index + 1 < len(rows) else None
+                loaded = previous.get(row.kid) or LoadedKey(
+                    kid=row.kid, algorithm=row.algorithm, activates_at=row.activates_at,
+                    expires_at=None, row=row,
+                    public_key=serialization.load_pem_public_key(row.public_key.encode()))
+                loaded.expires_at = successor.activates_at + lifetime if successor else None
+                keys.append(loaded)
+            self._keys, self._jwks, self._loaded_at = keys, None, time.monotonic()
+            return keys
+
+    def signing_key(self) -> LoadedKey:
+        now = timezone.now()
+        active = [key for key in self._load() if key.activates_at <= now]
+        if not active:
+            # First token ever signed: bootstrap a key instead of failing logins
+            created = create_signing_key(settings.JWT_SIGNING["ALGORITHM"], activates_at=now)
+            self.clear()
+            active = [key for key in self._load() if key.kid == created.kid]
+        return active[-1]
+
+    def verifying_key(self, kid: str):
+        for force in (False, True):
+            for key in self._load(force=force):
+                if key.kid == kid:
+                    if key.expires_at and key.expires_at <= timezone.now():
+                        return None
+                    return key
+        return None
+
+    def jwks(self) -> tuple:
+        """Returns ({"keys": [...]}, etag) for every key that can still verify"""
+        keys = self._load()
+        with self._lock:
+            if self._jwks is None:
+                now = timezone.now()
+                document = {"keys": [key.jwk() for key in keys
+                                     if not key.expires_at or key.expires_at > now]}
+                self._jwks = (document, make_etag(*(key["kid"] for key in document["keys"])))
+            return self._jwks
+
+
+key_ring = KeyRing()
+
+
+class KeyRingTokenBackend(TokenBackend):
+    """
+    Signs with the key ring's active key and verifies by the token's kid.
+    Tokens without a kid were signed with SIMPLE_JWT's shared secret before the
+    switch; they still verify through the base backend until they expire.
+    """
+
+    def __init__(self, key_ring: KeyRing, **kwargs):
+        super().__init__(**kwargs)
+        self.key_ring = key_ring
+
+    def encode(self, payload):
+        key = self.key_ring.signing_key()
+        jwt_payload = payload.copy()
+        if self.audience is not None:
+            jwt_payload["aud"] = self.audience
+        if self.issuer is not None:
+            jwt_payload["iss"] = self.issuer
+        return jwt.encode(jwt_payload, key.private_key, algorithm=key.algorithm,
+                          headers={"kid": key.kid}, json_encoder=self.json_encoder)
+
+    def decode(self, token, verify=True):
+        try:
+            kid = jwt.get_unverified_header(token).get("kid")
+        except jwt.InvalidTokenError:
+            raise TokenBackendError(_("Token is invalid or expired"))
+        if kid is None:
+            if not settings.JWT_SIGNING["ACCEPT_LEGACY_TOKENS"]:
+                raise TokenBackendError(_("Token is invalid or expired"))
+            return super().decode(token, verify=verify)
+
+        key = self.key_ring.verifying_key(kid) if verify else None
+        if verify and key is None:
+            raise TokenBackendError(_("Token is invalid or expired"))
+        try:
+            return jwt.decode(
+                token,
+                key.public_key if key else None,
+                algorithms=[key.algorithm] if key else list(ASYMMETRIC_ALGORITHMS),
+                audience=self.audience,
+                issuer=self.issuer,
+                leeway=self.get_leeway(),
+                options={
+                    "verify_aud": self.audience is not None,
+                    "verify_signature": verify,
+                },
+            )
+        except jwt.InvalidTokenError:
+            raise TokenBackendError(_("Token is invalid or expired"))
+
+
+token_backend = KeyRingTokenBackend(
+    key_ring,
+    algorithm=api_settings.ALGORITHM,
+    signing_key=api_settings.SIGNING_KEY,
+    verifying_key=api_settings.VERIFYING_KEY,
+    audience=api_settings.AUDIENCE,
+    issuer=api_settings.ISSUER,
+    leeway=api_settings.LEEWAY,
+    json_encoder=api_settings.JSON_ENCODER,
+)
+
+
+def rotate_signing_keys(force: bool = False, now: datetime = None):
+    """
+    Schedule a successor once the newest key is ROTATION_INTERVAL old (or the
+    configured algorithm changed), and delete keys that can no longer verify
+    any unexpired token. With force the new key signs immediately.
+    Returns the created key, if any.
+    """
+    if not asymmetric_signing_enabled():
+        return None
+    config = settings.JWT_SIGNING
+    now = now or timezone.now()
+    newest = SigningKey.objects.order_by("-activates_at").first()
+    created = None
+    if force or newest is None:
+        created = create_signing_key(config["ALGORITHM"], activates_at=now)
+    elif (newest.algorithm != config["ALGORITHM"]
+          or newest.activates_at <= now - config["ROTATION_INTERVAL"] + config["PUBLISH_AHEAD"]):
+        created = create_signing_key(
+            config["ALGORITHM"], activates_at=max(now, newest.activates_at) + config["PUBLISH_AHEAD"])
+
+    rows = list(SigningKey.objects.order_by("activates_at"))
+    cutoff = now - max_token_lifetime()
+    expired = [row.kid for row, successor in zip(rows, rows[1:]) if successor.activates_at <= cutoff]
+    SigningKey.objects.filter(kid__in=expired).delete()
+    key_ring.clear()
+    return created
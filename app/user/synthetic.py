@@ -0,0 +1,212 @@
+"""
+Synthetic users, pending users and reset tokens for performance testing.
+
+Rows are streamed into Postgres with COPY in batches, without building model
+instances or firing signals. Every user shares one password hash, computed
+once, so the output is bound by I/O rather than PBKDF2. Output depends only
+on the seed and the index range: the same --seed and --start give the same
+ids, phones and timestamps (relative to `now`).
+
+Distributions:
+- Signups grow linearly over the window, so recent days have more of them,
+  and they follow an evening-heavy daily cycle (UTC+1).
+- Rows are generated oldest first, so the heap is ordered by created_at, as
+  it would be after real inserts.
+- Most users are verified and active, about 0.1% are admins, and most active
+  users have logged in since signing up.
+- Pending users and reset tokens are spread over the last few hours, so most
+  of them have already expired, as in a table between prunings.
+"""
+import csv
+import hashlib
+import io
+import random
+import uuid
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from faker import Faker
+
+from .enums import SystemRoleEnum, TokenEnum
+from .models import PendingUser, Token, User
+
+# Relative signup volume for each hour of the day (UTC)
+HOURLY_WEIGHTS = (2, 1, 1, 1, 1, 2, 4, 6, 7, 7, 6, 6, 6, 6, 6, 6, 7, 8, 10, 11, 10, 8, 5, 3)
+ADMIN_RATIO = 0.001
+VERIFIED_RATIO = 0.9
+ACTIVE_RATIO = 0.97 #of verified users; the rest were deactivated
+LOCKED_RATIO = 0.005
+LOGGED_IN_RATIO = 0.8 #of active users
+NAMED_RATIO = 0.6
+EMAIL_RATIO = 0.35
+NAME_POOL_SIZE = 1000
+
+
+def user_phone(index: int) -> str:
+    return f"+2347{index:09d}"
+
+
+def pending_phone(index: int) -> str:
+    return f"+2349{index:09d}"
+
+
+def csv_value(value):
+    if value is None:
+        return None  # written as an unquoted empty field, which COPY reads as NULL
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, list):
+        return "{" + ",".join(value) + "}"
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+def copy_rows(model, rows, batch_size: int, progress=None) -> int:
+    """COPY dict rows keyed by column into the model's table; one transaction per batch"""
+    columns = [field.column for field in model._meta.concrete_fields]
+    quote = connection.ops.quote_name
+    sql = (f"COPY {quote(model._meta.db_table)} ({', '.join(map(quote, columns))}) "
+           f"FROM STDIN WITH (FORMAT csv)")
+    written = 0
+    batch = io.StringIO()
+    writer = csv.writer(batch)
+    pending = 0
+
+    def flush():
+        batch.seek(0)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.copy_expert(sql, batch)
+        batch.seek(0)
+        batch.truncate()
+
+    for row in rows:
+        writer.writerow([csv_value(row.get(column)) for column in columns])
+        pending += 1
+        if pending == batch_size:
+            flush()
+            written += pending
+            pending = 0
+            if progress:
+                progress(written)
+    if pending:
+        flush()
+        written += pending
+        if progress:
+            progress(written)
+    return written
+
+
+class SyntheticData:
+
+    def __init__(self, seed: int, now, days: int, otp_window: timedelta,
+                 password: str = "passer@@@111"):
+        self.seed = seed
+        self.now = now
+        self.window = timedelta(days=days)
+        self.otp_window = otp_window
+        self.password_hash = make_password(password)
+        faker = Faker()
+        faker.seed_instance(seed)
+        self.first_names = [faker.first_name() for _ in range(NAME_POOL_SIZE)]
+        self.last_names = [faker.last_name() for _ in range(NAME_POOL_SIZE)]
+
+    def rng(self, stream: str) -> random.Random:
+        """An independent, reproducible random stream per table"""
+        return random.Random(f"{self.seed}:{stream}")
+
+    def user_id(self, index: int) -> uuid.UUID:
+        digest = hashlib.md5(f"{self.seed}:user:{index}".encode()).digest()
+        return uuid.UUID(bytes=digest, version=4)
+
+    @staticmethod
+    def ascending_uniforms(rng: random.Random, count: int):
+        """`count` sorted uniform samples in ascending order, in O(1) memory"""
+        # Descending order statistics: the max of k uniforms is U ** (1 / k)
+        current = 1.0
+        for remaining in range(count, 0, -1):
+            current *= rng.random() ** (1 / remaining)
+            yield 1.0 - current
+
+    def signup_time(self, rng: random.Random, position: float):
+        # position ~ sqrt(uniform) gives a linearly growing signup rate
+        moment = self.now - self.window + self.window * position ** 0.5
+        hour = rng.choices(range(24), HOURLY_WEIGHTS)[0]
+        moment = moment.replace(hour=hour, minute=rng.randrange(60), second=rng.randrange(60))
+        return min(moment, self.now - timedelta(seconds=rng.randrange(1, 3600)))
+
+    def users(self, start: int, count: int):
+        rng = self.rng(f"users:{start}")
+        for offset, position in enumerate(self.ascending_uniforms(rng, count)):
+            index = start + offset
+            created_at = self.signup_time(rng, position)
+            verified = rng.random() < VERIFIED_RATIO
+            is_active = verified and rng.random() < ACTIVE_RATIO
+            is_admin = rng.random() < ADMIN_RATIO
+            last_login = None
+            if is_active and rng.random() < LOGGED_IN_RATIO:
+                # Skewed towards the present: active users log in often
+                last_login = created_at + (self.now - created_at) * rng.random() ** 0.3
+            named = rng.random() < NAMED_RATIO
+            yield {
+                "id": self.user_id(index),
+                "email": f"synthetic{index}@example.com" if rng.random() < EMAIL_RATIO else None,
+                "password": self.password_hash,
+                "firstname": rng.choice(self.first_names) if named else None,
+                "lastname": rng.choice(self.last_names) if named else None,
+                "phone": user_phone(index),
+                "is_locked": rng.random() < LOCKED_RATIO,
+                "is_staff": is_admin,
+                "is_superuser": False,
+                "is_active": is_active,
+                "is_admin": is_admin,
+                "last_login": last_login,
+                "created_at": created_at,
+                "updated_at": created_at,
+                "verified": verified,
+                "totp_enabled": False,
+                "roles": [SystemRoleEnum.ADMIN if is_admin else SystemRoleEnum.CUSTOMER],
+            }
+
+    def otp_times(self, rng: random.Random, count: int):
+        start = self.now - self.otp_window
+        for position in self.ascending_uniforms(rng, count):
+            yield start + self.otp_window * position
+
+    def pending_users(self, start: int, count: int):
+        rng = self.rng(f"pending:{start}")
+        for offset, created_at in enumerate(self.otp_times(rng, count)):
+            yield {
+                "id": uuid.UUID(int=rng.getrandbits(128), version=4),
+                "created_at": created_at,
+                "updated_at": created_at,
+                "phone": pending_phone(start + offset),
+                "verification_code": f"{rng.randrange(10 ** 6):06d}",
+                "password": self.password_hash,
+            }
+
+    def tokens(self, user_start: int, user_count: int, count: int):
+        """
+        Password reset tokens for `count` distinct users drawn from
+        [user_start, user_start + user_count); a user has one live reset token.
+        """
+        if count > user_count:
+            raise ValueError("More tokens than users to give them to")
+        rng = self.rng(f"tokens:{user_start}")
+        owners = rng.sample(range(user_count), count)
+        for owner, created_at in zip(owners, self.otp_times(rng, count)):
+            yield {
+                "id": uuid.UUID(int=rng.getrandbits(128), version=4),
+                "user_id": self.user_id(user_start + owner),
+                "token": f"{rng.randrange(10 ** 6):06d}",
+                "token_type": TokenEnum.PASSWORD_RESET,
+                "created_at": created_at,
+            }
+
+
+def analyze(*models) -> None:
+    """Refresh planner statistics after a large load"""
+    with connection.cursor() as cursor:
+        for model in models:
+            cursor.execute(f"ANALYZE {connection.ops.quote_name(model._meta.db_table)}")
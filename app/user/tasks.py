@@ -1,8 +1,86 @@
+import logging
+
+from django.conf import settings
+from django.utils import timezone
+
 from core.celery import APP
+from core.metrics import observe_sms, task_published_at
+
+from . import signing
+from .models import User
+from .revocation import RevocationStateLocked, revocation_set
+from .utils import (add_bulk_job_progress, otp_partitioned_tables, rebuild_registered_phones,
+                    registered_phones, send_sms)
+
+logger = logging.getLogger(__name__)
+
+
+@APP.task(bind=True)
+def send_phone_notification(self, user_data):
+    issued_at = task_published_at(self.request)
+    try:
+        send_sms(user_data['message'], user_data['phone'])
+    except Exception:
+        observe_sms("failed", issued_at)
+        raise
+    observe_sms("sent", issued_at)
+
+
+@APP.task(bind=True)
+def send_bulk_phone_notifications(self, messages):
+    """Send a chunk of SMS; a failed number does not block the rest"""
+    issued_at = task_published_at(self.request)
+    for user_data in messages:
+        try:
+            send_sms(user_data['message'], user_data['phone'])
+        except Exception:
+            observe_sms("failed", issued_at)
+            logger.exception("SMS to %s failed", user_data['phone'])
+        else:
+            observe_sms("sent", issued_at)
 
-from .utils import send_sms
 
 
 @APP.task()
-def send_phone_notification(user_data):
-    send_sms(user_data['message'], user_data['phone'])
\ No newline at end of file
+def bulk_delete_users(job_id, user_ids):
+    """Delete one chunk of a bulk delete job and record its progress"""
+    # Tokens cascade with one DELETE ... WHERE user_id IN (chunk)
+    User.objects.filter(id__in=user_ids).delete()
+    add_bulk_job_progress(job_id, len(user_ids))
+
+
+@APP.task()
+def rotate_signing_keys():
+    created = signing.rotate_signing_keys()
+    if created:
+        logger.info("Scheduled JWT signing key %s, active from %s", created.kid, created.activates_at)
+
+
+@APP.task()
+def maintain_otp_partitions():
+    """Roll partitions of converted OTP tables; delete expired rows from the others"""
+    now = timezone.now()
+    for model, table in otp_partitioned_tables():
+        if table.is_partitioned():
+            created, dropped = table.maintain(now, settings.OTP_PARTITIONING["PRECREATE"])
+            if created or dropped:
+                logger.info("%s partitions created %s, dropped %s", table.table, created, dropped)
+        else:
+            model.objects.filter(created_at__lt=model.window_start()).delete()
+
+
+@APP.task()
+def rebuild_phone_filter():
+    """Build the registered-phone filter when it is missing or was invalidated"""
+    if registered_phones.needs_rebuild():
+        count = rebuild_registered_phones()
+        logger.info("Registered-phone filter rebuilt with %s phones", count)
+
+
+@APP.task(bind=True, max_retries=10, default_retry_delay=1)
+def apply_token_revocations(self, jtis=None, cutoffs=None):
+    """Revocations a request could not write without blocking; see user.revocation"""
+    try:
+        revocation_set.update(jtis=jtis, cutoffs=cutoffs)
+    except RevocationStateLocked as exc:
+        raise self.retry(exc=exc)
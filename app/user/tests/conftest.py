@@ -1,2 +1,30 @@
+import re
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from user.urls import QUERY_BUDGETS
+
+SAVEPOINT_SQL = re.compile(r"^(SAVEPOINT|RELEASE SAVEPOINT|ROLLBACK TO SAVEPOINT) ")
+
+
 def api_client_with_credentials(token: str, api_client):
-    return api_client.credentials(HTTP_AUTHORIZATION="Bearer " + token)
\ No newline at end of file
+    return api_client.credentials(HTTP_AUTHORIZATION="Bearer " + token)
+
+
+def assert_query_budget(send, *args, **kwargs):
+    """
+    Send a request with `send` (e.g. api_client.post) and fail when its
+    endpoint ran more queries than user.urls.QUERY_BUDGETS allows. Savepoints
+    are not counted: inside the test transaction every atomic block adds them.
+    """
+    with CaptureQueriesContext(connection) as context:
+        response = send(*args, **kwargs)
+    endpoint = f"{response.request['REQUEST_METHOD']} {response.resolver_match.view_name}"
+    assert endpoint in QUERY_BUDGETS, f"No query budget declared for {endpoint}"
+    queries = [query["sql"] for query in context.captured_queries
+               if not SAVEPOINT_SQL.match(query["sql"])]
+    budget = QUERY_BUDGETS[endpoint]
+    assert len(queries) <= budget, (
+        f"{endpoint} ran {len(queries)} queries, budget is {budget}:\n" + "\n".join(queries))
+    return response
@@ -11,7 +11,7 @@ class UserFactory(factory.django.DjangoModelFactory):
         model = User
         
     email = factory.Sequence(lambda n: 'person{}@example.com'.format(n))
-    phone = factory.Sequence(lambda n: '+234801234567{}'.format(n))
+    phone = factory.Sequence(lambda n: '+23480{:08d}'.format(n))
     password = factory.PostGenerationMethodCall('set_password','passer@@@111')
     verified='True'
     firstname = fake.name()
@@ -0,0 +1,95 @@
+import pytest
+from django.urls import reverse
+
+from core.utils.idempotency import REPLAYED_HEADER
+
+from user.enums import TokenEnum
+from user.models import PendingUser, Token, User
+
+pytestmark = pytest.mark.django_db
+
+
+class TestAsyncAuthEndpoints:
+    onboard_url = reverse("async-auth:onboard")
+    verify_account_url = reverse("async-auth:verify-account")
+    initiate_password_reset_url = reverse("async-auth:initiate-password-reset")
+    create_password_url = reverse("async-auth:create-password")
+
+    def test_onboard_user(self, client, mocker):
+        mock_send_verification_otp = mocker.patch(
+            'user.tasks.send_phone_notification.delay')
+        data = {"phone": "08198765432", "password": "simplepass@"}
+        response = client.post(self.onboard_url, data, content_type="application/json")
+        assert response.status_code == 200
+
+        pending_user = PendingUser.objects.get(phone="+2348198765432")
+        assert pending_user.password.startswith("pbkdf2_sha256$")
+        mock_send_verification_otp.assert_called_once_with({
+            'message': f"Account Verification!\nYour OTP for BotoApp is {pending_user.verification_code}.\nIt expires in 10 minutes",
+            'phone': pending_user.phone
+        })
+
+    def test_deny_onboard_duplicate_phone(self, client, active_user):
+        data = {"phone": active_user.phone, "password": "simplepass@"}
+        response = client.post(self.onboard_url, data, content_type="application/json")
+        assert response.status_code == 400
+        assert 'phone' in response.json()
+
+    def test_verify_account(self, client):
+        pending_user = PendingUser.objects.create(
+            phone='+2348157787640', verification_code=1234, password='somesecret')
+        data = {'otp': pending_user.verification_code, 'phone': pending_user.phone}
+        response = client.post(self.verify_account_url, data, content_type="application/json")
+        assert response.status_code == 200
+        assert User.objects.get(phone=pending_user.phone).verified is True
+
+    def test_password_reset_flow(self, client, active_user, mocker):
+        mocker.patch('user.tasks.send_phone_notification.delay')
+        response = client.post(self.initiate_password_reset_url,
+                               {'phone': active_user.phone}, content_type="application/json")
+        assert response.status_code == 200
+
+        token = Token.objects.get(user=active_user, token_type=TokenEnum.PASSWORD_RESET)
+        data = {"otp": token.token, "phone": active_user.phone, "new_password": "new_pass_me"}
+        response = client.post(self.create_password_url, data, content_type="application/json")
+        assert response.status_code == 200
+        active_user.refresh_from_db()
+        assert active_user.check_password('new_pass_me')
+        assert not Token.objects.filter(id=token.id).exists()
+
+    def test_deny_create_password_invalid_otp(self, client, active_user, token_factory):
+        token_factory(token_type=TokenEnum.PASSWORD_RESET, user=active_user, token=1234)
+        data = {"otp": 4321, "phone": active_user.phone, "new_password": "new_pass_me"}
+        response = client.post(self.create_password_url, data, content_type="application/json")
+        assert response.status_code == 400
+
+    def test_reject_non_post(self, client):
+        response = client.get(self.onboard_url)
+        assert response.status_code == 405
+
+    def test_onboard_retry_with_idempotency_key_is_replayed(self, client, mocker):
+        mock_send = mocker.patch('user.tasks.send_phone_notification.delay')
+        data = {"phone": "08198765432", "password": "simplepass@"}
+        headers = {"HTTP_IDEMPOTENCY_KEY": "onboard-1"}
+        first = client.post(self.onboard_url, data, content_type="application/json", **headers)
+        retry = client.post(self.onboard_url, data, content_type="application/json", **headers)
+        assert first.status_code == retry.status_code == 200
+        assert retry.json() == first.json()
+        assert retry[REPLAYED_HEADER] == "true"
+        mock_send.assert_called_once()
+
+        response = client.post(self.onboard_url, {**data, "phone": "08198765433"},
+                               content_type="application/json", **headers)
+        assert response.status_code == 422
+
+    def test_password_reset_retry_with_idempotency_key_sends_one_otp(self, client, active_user,
+                                                                     mocker):
+        mock_send = mocker.patch('user.tasks.send_phone_notification.delay')
+        headers = {"HTTP_IDEMPOTENCY_KEY": "reset-1"}
+        for _ in range(2):
+            response = client.post(self.initiate_password_reset_url, {'phone': active_user.phone},
+                                   content_type="application/json", **headers)
+            assert response.status_code == 200
+        assert response[REPLAYED_HEADER] == "true"
+        mock_send.assert_called_once()
+        assert Token.objects.filter(user=active_user, token_type=TokenEnum.PASSWORD_RESET).count() == 1
@@ -1,11 +1,28 @@
+import time
 from datetime import datetime, timedelta, timezone
 
+import jwt
+import pyotp
 import pytest
 import time_machine
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
 from django.urls import reverse
+from django.utils import timezone as django_timezone
 from rest_framework import status
-from user.enums import TokenEnum, SystemRoleEnum
-from user.models import Token, PendingUser, User
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from user.enums import AuthEventEnum, TokenEnum, SystemRoleEnum
+from user.authentication import APIKeyAuthentication, api_key_cache, revoke_api_key
+from user.events import auth_events, emit_auth_event
+from user.models import APIKey, AuthEvent, Token, PendingUser, SigningKey, User
+from user.revocation import (RevocationSet, RevocationStateLocked, revocation_set,
+                             revoke_token, revoke_user_tokens)
+from user.serializers import CustomObtainTokenPairSerializer
+from user.signing import key_ring, rotate_signing_keys
+from user.tasks import apply_token_revocations, maintain_otp_partitions
+from user.utils import otp_partitioned_tables, verify_totp
 
 from .conftest import api_client_with_credentials
 
@@ -160,6 +177,7 @@ class TestAuthEndpoints:
             user=active_user, token_type=TokenEnum.PASSWORD_RESET)
         data = {
             "otp": token.token,
+            "phone": active_user.phone,
             "new_password": "new_pass_me"
         }
         response = api_client.post(
@@ -168,13 +186,554 @@ class TestAuthEndpoints:
         active_user.refresh_from_db()
         assert active_user.check_password('new_pass_me')
 
+    def test_create_password_requires_phone(self, api_client, active_user, token_factory):
+        token: Token = token_factory(
+            user=active_user, token_type=TokenEnum.PASSWORD_RESET)
+        data = {"otp": token.token, "new_password": "new_pass_me"}
+        response = api_client.post(
+            self.create_password_via_reset_otp_url, data)
+        assert response.status_code == 400
+        assert "phone" in response.json()
+
     def test_deny_create_new_password_using_invalid_reset_otp(self, api_client, active_user, token_factory):
         token_factory(
             token_type=TokenEnum.PASSWORD_RESET, user=active_user, token=1234)
         data = {
             "otp": 4321,
+            "phone": active_user.phone,
             "new_password": "new_pass_me"
         }
         response = api_client.post(
             self.create_password_via_reset_otp_url, data)
         assert response.status_code == 400
+
+    def test_throttle_password_reset_before_db_lookup(self, api_client, settings, django_assert_num_queries):
+        settings.OTP_THROTTLE = {**settings.OTP_THROTTLE, "PHONE": (1, 600)}
+        data = {'phone': "+2348157777777"}
+        api_client.post(self.initiate_password_reset_url, data, format="json")
+        with django_assert_num_queries(0):
+            response = api_client.post(
+                self.initiate_password_reset_url, data, format="json")
+        assert response.status_code == 429
+
+    def test_lock_verify_account_after_failed_attempts(self, api_client, settings, django_assert_num_queries):
+        settings.OTP_VERIFICATION_ATTEMPTS = {
+            **settings.OTP_VERIFICATION_ATTEMPTS, "MAX_FAILURES": 3}
+        pending_user = PendingUser.objects.create(phone='+2348157787640',
+                                                  verification_code=1234,
+                                                  password='somesecret'
+                                                  )
+        for otp in [1111, 2222, 3333]:
+            response = api_client.post(
+                self.verify_account_url, {'otp': otp, 'phone': pending_user.phone})
+            assert response.status_code == 400
+        pending_user.refresh_from_db()
+        assert pending_user.verification_code is None
+
+        with django_assert_num_queries(0):
+            response = api_client.post(
+                self.verify_account_url, {'otp': 1234, 'phone': pending_user.phone})
+        assert response.status_code == 429
+
+    def test_lock_create_password_for_phone_after_failed_attempts(
+            self, api_client, settings, active_user, token_factory):
+        settings.OTP_VERIFICATION_ATTEMPTS = {
+            **settings.OTP_VERIFICATION_ATTEMPTS, "MAX_FAILURES": 2}
+        token = token_factory(
+            token_type=TokenEnum.PASSWORD_RESET, user=active_user, token=1234)
+        for otp in [4321, 5678]:
+            data = {"otp": otp, "phone": active_user.phone, "new_password": "new_pass_me"}
+            response = api_client.post(self.create_password_via_reset_otp_url, data)
+            assert response.status_code == 400
+        assert not Token.objects.filter(id=token.id).exists()
+
+        data = {"otp": 1234, "phone": active_user.phone, "new_password": "new_pass_me"}
+        response = api_client.post(self.create_password_via_reset_otp_url, data)
+        assert response.status_code == 429
+
+    def test_create_new_password_using_phone_and_valid_reset_otp(self, api_client, active_user, token_factory):
+        token: Token = token_factory(
+            user=active_user, token_type=TokenEnum.PASSWORD_RESET)
+        data = {
+            "otp": token.token,
+            "phone": active_user.phone,
+            "new_password": "new_pass_me"
+        }
+        response = api_client.post(
+            self.create_password_via_reset_otp_url, data)
+        assert response.status_code == 200
+        active_user.refresh_from_db()
+        assert active_user.check_password('new_pass_me')
+
+
+class TestTOTPEndpoints:
+    login_url = reverse("auth:login")
+    login_totp_url = reverse("auth:login-totp")
+    setup_url = reverse("auth:auth-totp-setup")
+    confirm_url = reverse("auth:auth-totp-confirm")
+    disable_url = reverse("auth:auth-totp-disable")
+
+    def enroll(self, api_client, authenticate_user) -> tuple:
+        user_data = authenticate_user()
+        api_client_with_credentials(user_data['token'], api_client)
+        response = api_client.post(self.setup_url)
+        assert response.status_code == 200
+        secret = response.json()['secret']
+        response = api_client.post(self.confirm_url, {"code": pyotp.TOTP(secret).now()})
+        assert response.status_code == 200
+        api_client.credentials()
+        return user_data, secret
+
+    def test_setup_stores_encrypted_secret(self, api_client, authenticate_user):
+        user_data = authenticate_user()
+        api_client_with_credentials(user_data['token'], api_client)
+        response = api_client.post(self.setup_url)
+        assert response.status_code == 200
+        returned_json = response.json()
+        assert returned_json['provisioning_uri'].startswith('otpauth://totp/')
+
+        user: User = user_data['user_instance']
+        user.refresh_from_db()
+        assert not user.totp_enabled
+        assert returned_json['secret'] not in user.totp_secret
+        assert user.get_totp_secret() == returned_json['secret']
+
+    def test_login_requires_totp_once_enabled(self, api_client, authenticate_user, auth_user_password):
+        user_data, secret = self.enroll(api_client, authenticate_user)
+        user = user_data['user_instance']
+        response = api_client.post(
+            self.login_url, {"phone": user.phone, "password": auth_user_password})
+        assert response.status_code == 200
+        returned_json = response.json()
+        assert returned_json['totp_required'] is True
+        assert 'access' not in returned_json
+
+        totp = pyotp.TOTP(secret)
+        # The enrollment code's time step was already used; take the next one
+        code = totp.at(time.time() + totp.interval)
+        response = api_client.post(
+            self.login_totp_url, {"challenge": returned_json['challenge'], "code": code})
+        assert response.status_code == 200
+        assert 'access' in response.json()
+
+        # The challenge is single use
+        response = api_client.post(
+            self.login_totp_url, {"challenge": returned_json['challenge'], "code": code})
+        assert response.status_code == 401
+
+    def test_deny_replayed_totp_code(self, api_client, authenticate_user, auth_user_password):
+        user_data, secret = self.enroll(api_client, authenticate_user)
+        user = user_data['user_instance']
+        response = api_client.post(
+            self.login_url, {"phone": user.phone, "password": auth_user_password})
+        # Same code (and time step) as the one used to confirm enrollment
+        response = api_client.post(
+            self.login_totp_url, {"challenge": response.json()['challenge'],
+                                  "code": pyotp.TOTP(secret).now()})
+        assert response.status_code == 400
+
+    def test_verify_totp_accepts_drift_within_window(self, active_user, settings):
+        settings.TOTP = {**settings.TOTP, "VALID_WINDOW": 1}
+        secret = pyotp.random_base32()
+        totp = pyotp.TOTP(secret)
+        now = time.time()
+        assert verify_totp(active_user, totp.at(now - totp.interval), secret, now=now)
+        assert not verify_totp(active_user, totp.at(now - 3 * totp.interval), secret, now=now)
+
+    def test_disable_totp(self, api_client, authenticate_user, auth_user_password):
+        user_data, secret = self.enroll(api_client, authenticate_user)
+        api_client_with_credentials(user_data['token'], api_client)
+        totp = pyotp.TOTP(secret)
+        response = api_client.post(self.disable_url, {"code": "000000"})
+        assert response.status_code == 400
+        response = api_client.post(self.disable_url, {"code": totp.at(time.time() + totp.interval)})
+        assert response.status_code == 200
+
+        user: User = user_data['user_instance']
+        user.refresh_from_db()
+        assert not user.totp_enabled and user.totp_secret is None
+        response = api_client.post(
+            self.login_url, {"phone": user.phone, "password": auth_user_password})
+        assert 'access' in response.json()
+
+
+class TestJWTSigning:
+    login_url = reverse("auth:login")
+    jwks_url = reverse("auth:jwks")
+
+    @pytest.fixture(autouse=True)
+    def fresh_key_ring(self):
+        key_ring.clear()
+        yield
+        key_ring.clear()
+
+    def login(self, api_client, user, password) -> str:
+        response = api_client.post(self.login_url, {"phone": user.phone, "password": password})
+        return response.json()["access"]
+
+    def test_access_token_verifies_against_jwks(self, api_client, active_user, auth_user_password):
+        access = self.login(api_client, active_user, auth_user_password)
+        response = api_client.get(self.jwks_url)
+        assert response.status_code == 200
+        assert "max-age" in response["Cache-Control"]
+
+        header = jwt.get_unverified_header(access)
+        jwk = next(key for key in response.json()["keys"] if key["kid"] == header["kid"])
+        assert header["alg"] == jwk["alg"] == "RS256"
+        claims = jwt.decode(access, jwt.PyJWK(jwk).key, algorithms=[jwk["alg"]])
+        assert claims["user_id"] == str(active_user.id)
+
+        response = api_client.get(self.jwks_url, HTTP_IF_NONE_MATCH=response["ETag"])
+        assert response.status_code == 304
+
+    def test_rotation_publishes_successor_before_it_signs(
+            self, api_client, active_user, auth_user_password, settings):
+        current = rotate_signing_keys()
+        successor = rotate_signing_keys(
+            now=django_timezone.now() + settings.JWT_SIGNING["ROTATION_INTERVAL"])
+        assert successor.activates_at > django_timezone.now()
+
+        kids = {key["kid"] for key in api_client.get(self.jwks_url).json()["keys"]}
+        assert kids == {current.kid, successor.kid}
+        access = self.login(api_client, active_user, auth_user_password)
+        assert jwt.get_unverified_header(access)["kid"] == current.kid
+
+        with time_machine.travel(successor.activates_at + timedelta(seconds=1)):
+            key_ring.clear()
+            access = self.login(api_client, active_user, auth_user_password)
+            assert jwt.get_unverified_header(access)["kid"] == successor.kid
+            api_client_with_credentials(access, api_client)
+            assert api_client.get(reverse("user:user-list")).status_code == 200
+
+    def test_rotation_drops_keys_once_their_tokens_expired(self, settings):
+        first = rotate_signing_keys()
+        second = rotate_signing_keys(force=True)
+        rotate_signing_keys(now=second.activates_at + settings.SIMPLE_JWT["REFRESH_TOKEN_LIFETIME"]
+                            + timedelta(minutes=1))
+        assert not SigningKey.objects.filter(kid=first.kid).exists()
+        assert SigningKey.objects.filter(kid=second.kid).exists()
+
+    def test_legacy_hs256_token_still_authenticates(self, api_client, active_user):
+        access = AccessToken()
+        access["user_id"] = str(active_user.id)
+        legacy = jwt.encode(access.payload, settings.SECRET_KEY, algorithm="HS256")
+        api_client_with_credentials(legacy, api_client)
+        assert api_client.get(reverse("user:user-list")).status_code == 200
+
+
+class TestTokenIntrospection:
+    introspect_url = reverse("auth:introspect-token")
+    service_token = "gateway-secret"
+
+    @pytest.fixture(autouse=True)
+    def service_tokens(self, settings):
+        settings.TOKEN_INTROSPECTION = {
+            **settings.TOKEN_INTROSPECTION, "SERVICE_TOKENS": [self.service_token]}
+
+    def introspect(self, api_client, tokens, service_token=service_token):
+        return api_client.post(self.introspect_url, {"tokens": tokens}, format="json",
+                               HTTP_X_INTERNAL_SERVICE_TOKEN=service_token)
+
+    def test_deny_introspection_without_service_token(self, api_client):
+        response = self.introspect(api_client, ["token"], service_token="wrong")
+        assert response.status_code == 403
+
+    def test_introspect_batch(self, api_client, active_user, django_assert_num_queries):
+        refresh = RefreshToken.for_user(active_user)
+        refresh["roles"] = active_user.roles
+        access = str(refresh.access_token)
+        with django_assert_num_queries(0):
+            response = self.introspect(api_client, [access, "garbage", str(refresh), access])
+        assert response.status_code == 200
+        results = response.json()["results"]
+        assert [result["active"] for result in results] == [True, False, False, True]
+        assert results[0]["user_id"] == str(active_user.id)
+        assert results[0]["roles"] == active_user.roles
+
+    def test_revoked_token_is_inactive_even_when_cached(self, api_client, active_user):
+        access = RefreshToken.for_user(active_user).access_token
+        assert self.introspect(api_client, [str(access)]).json()["results"][0]["active"]
+        revoke_token(access["jti"], access["exp"])
+        assert not self.introspect(api_client, [str(access)]).json()["results"][0]["active"]
+
+    def test_reject_oversized_batch(self, api_client, settings):
+        settings.TOKEN_INTROSPECTION = {**settings.TOKEN_INTROSPECTION, "MAX_BATCH": 2}
+        response = self.introspect(api_client, ["a", "b", "c"])
+        assert response.status_code == 400
+
+
+class TestTokenRevocation:
+    password_change_url = reverse('auth:password-change-list')
+    refresh_url = reverse("auth:refresh-token")
+    user_list_url = reverse("user:user-list")
+
+    @pytest.fixture(autouse=True)
+    def fresh_revocation_set(self):
+        revocation_set.sync(force=True)
+
+    def issue_tokens(self, user: User, seconds_ago: int = 60) -> RefreshToken:
+        with time_machine.travel(time.time() - seconds_ago):
+            return RefreshToken.for_user(user)
+
+    def test_password_change_revokes_existing_tokens(self, api_client, authenticate_user,
+                                                     auth_user_password):
+        user_data = authenticate_user()
+        older = self.issue_tokens(user_data['user_instance'])
+        api_client_with_credentials(user_data['token'], api_client)
+        response = api_client.post(self.password_change_url, {
+            'old_password': auth_user_password, 'new_password': 'new_pass_me'})
+        assert response.status_code == 200
+
+        # The token that made the change and older ones are revoked immediately
+        assert api_client.get(self.user_list_url).status_code == 401
+        api_client_with_credentials(str(older.access_token), api_client)
+        assert api_client.get(self.user_list_url).status_code == 401
+        response = api_client.post(self.refresh_url, {"refresh": str(older)})
+        assert response.status_code == 401
+
+        # A login straight after the change is not revoked with the old tokens
+        api_client.credentials()
+        response = api_client.post(reverse("auth:login"), {
+            "phone": user_data['user_instance'].phone, "password": 'new_pass_me'})
+        api_client_with_credentials(response.json()['access'], api_client)
+        assert api_client.get(self.user_list_url).status_code == 200
+        response = api_client.post(self.refresh_url, {"refresh": response.json()['refresh']})
+        assert response.status_code == 200
+
+    def test_password_reset_revokes_existing_tokens(self, api_client, active_user, token_factory):
+        older = self.issue_tokens(active_user)
+        token: Token = token_factory(user=active_user, token_type=TokenEnum.PASSWORD_RESET)
+        token.reset_user_password('new_pass_me')
+        api_client_with_credentials(str(older.access_token), api_client)
+        assert api_client.get(self.user_list_url).status_code == 401
+
+    def test_cutoff_has_sub_second_resolution(self, active_user):
+        with time_machine.travel(1_800_000_000.2, tick=False):
+            before = CustomObtainTokenPairSerializer.get_token(active_user)
+        with time_machine.travel(1_800_000_000.5, tick=False):
+            revoke_user_tokens(active_user.id)
+        with time_machine.travel(1_800_000_000.9, tick=False):
+            after = CustomObtainTokenPairSerializer.get_token(active_user)
+            assert revocation_set.is_revoked(before.payload)
+            assert revocation_set.is_revoked(before.access_token.payload)
+            assert not revocation_set.is_revoked(after.payload)
+            assert not revocation_set.is_revoked(after.access_token.payload)
+            # Without the millisecond claim, the whole second is revoked
+            assert revocation_set.is_revoked(RefreshToken.for_user(active_user).payload)
+
+    def test_update_refuses_to_write_without_the_lock(self, active_user):
+        cache.add("revocation:lock", 1)
+        with pytest.raises(RevocationStateLocked):
+            revocation_set.update(cutoffs={str(active_user.id): time.time()}, wait=0.02)
+        assert not revocation_set.cutoffs
+
+    def test_busy_state_hands_revocation_to_celery(self, active_user, mocker):
+        task = mocker.patch("user.tasks.apply_token_revocations.delay")
+        cache.add("revocation:lock", 1)
+        started = time.monotonic()
+        revoke_user_tokens(active_user.id)
+        assert time.monotonic() - started < 1
+        assert not revocation_set.cutoffs
+        cutoffs = task.call_args.kwargs["cutoffs"]
+        assert list(cutoffs) == [str(active_user.id)]
+
+        cache.delete("revocation:lock")
+        apply_token_revocations.apply(kwargs={"cutoffs": cutoffs})
+        assert revocation_set.is_revoked(self.issue_tokens(active_user).payload)
+
+    def test_revocations_reach_other_processes_after_sync(self, active_user, settings):
+        settings.TOKEN_REVOCATION = {**settings.TOKEN_REVOCATION, "SYNC_INTERVAL": 60}
+        other_process = RevocationSet()
+        older = self.issue_tokens(active_user)
+        assert not other_process.is_revoked(older.payload)
+
+        revoke_user_tokens(active_user.id)
+        assert not other_process.is_revoked(older.payload)  # still within SYNC_INTERVAL
+        other_process.sync(force=True)
+        assert other_process.is_revoked(older.payload)
+        with time_machine.travel(time.time() + 1):
+            assert not other_process.is_revoked(RefreshToken.for_user(active_user).payload)
+
+    def test_expired_entries_are_dropped(self, active_user):
+        revoke_token("a" * 32, int(time.time()) + 1)
+        with time_machine.travel(time.time() + 5):
+            revoke_token("b" * 32, int(time.time()) + 60)
+            assert set(revocation_set.jtis) == {int("b" * 32, 16)}
+
+
+class TestAPIKeys:
+    create_api_key_url = reverse("auth:create-api-key")
+    api_keys_url = reverse("auth:api-key-list")
+    user_list_url = reverse("user:user-list")
+
+    @pytest.fixture(autouse=True)
+    def empty_api_key_cache(self):
+        api_key_cache.clear()
+
+    def test_create_api_key_is_throttled_per_phone_and_ip(self, api_client, active_user, settings,
+                                                          django_assert_num_queries):
+        settings.CREDENTIAL_THROTTLE = {**settings.CREDENTIAL_THROTTLE, "PHONE": (2, 600), "IP": (4, 600)}
+        data = {"phone": active_user.phone, "password": "wrong-password"}
+        for _ in range(2):
+            assert api_client.post(self.create_api_key_url, data).status_code == 400
+        # Same phone in another format, refused before the password is checked
+        with django_assert_num_queries(0):
+            response = api_client.post(self.create_api_key_url,
+                                       {**data, "phone": "0" + active_user.phone[4:]})
+        assert response.status_code == 429
+        assert "Retry-After" in response
+
+        other_phone = {"phone": "+2348100000001", "password": "wrong-password"}
+        assert api_client.post(self.create_api_key_url, other_phone).status_code == 400
+        assert api_client.post(self.create_api_key_url, other_phone).status_code == 429
+
+    def test_create_api_key_with_credentials(self, api_client, active_user, auth_user_password):
+        response = api_client.post(self.create_api_key_url, {
+            "phone": active_user.phone, "password": auth_user_password, "name": "billing"})
+        assert response.status_code == 201
+        raw_key = response.json()["api_key"]
+        api_key = APIKey.objects.get(prefix=response.json()["prefix"])
+        assert raw_key.split(".", 1)[1] not in api_key.hashed_secret
+
+        api_client.credentials(HTTP_AUTHORIZATION=f"Api-Key {raw_key}")
+        response = api_client.get(self.user_list_url)
+        assert response.status_code == 200
+        assert response.json()["results"][0]["id"] == str(active_user.id)
+
+    def test_deny_create_api_key_with_wrong_password(self, api_client, active_user):
+        response = api_client.post(self.create_api_key_url, {
+            "phone": active_user.phone, "password": "wrong@pass"})
+        assert response.status_code == 400
+
+    def test_verified_key_is_served_from_lru_cache(self, active_user, django_assert_num_queries):
+        _, raw_key = APIKey.create_key(active_user)
+        authentication = APIKeyAuthentication()
+        assert authentication.authenticate_key(raw_key)[0] == active_user
+        with django_assert_num_queries(0):
+            assert authentication.authenticate_key(raw_key)[0] == active_user
+
+        prefix = raw_key.split(".")[0]
+        with pytest.raises(AuthenticationFailed):
+            authentication.authenticate_key(f"{prefix}.wrong-secret")
+
+    def test_revoke_in_another_process_invalidates_local_cache(
+            self, active_user, django_capture_on_commit_callbacks):
+        api_key, raw_key = APIKey.create_key(active_user)
+        authentication = APIKeyAuthentication()
+        user, cached_key = authentication.authenticate_key(raw_key)
+        stale_entry = api_key_cache.get(raw_key)
+
+        with django_capture_on_commit_callbacks(execute=True):
+            revoke_api_key(APIKey.objects.get(pk=api_key.pk))
+        # This process still holds its own copy, as another worker would
+        api_key_cache.set(raw_key, stale_entry)
+        assert cached_key.is_valid()
+        with pytest.raises(AuthenticationFailed):
+            authentication.authenticate_key(raw_key)
+
+    def test_revoked_key_is_rejected(self, api_client, authenticate_user,
+                                     django_capture_on_commit_callbacks):
+        user_data = authenticate_user()
+        api_client_with_credentials(user_data['token'], api_client)
+        response = api_client.post(self.api_keys_url, {"name": "ci"})
+        assert response.status_code == 201
+        raw_key, prefix = response.json()["api_key"], response.json()["prefix"]
+
+        api_client.credentials(HTTP_AUTHORIZATION=f"Api-Key {raw_key}")
+        assert api_client.get(self.user_list_url).status_code == 200
+        with django_capture_on_commit_callbacks(execute=True):
+            response = api_client.delete(reverse("auth:api-key-detail", args=[prefix]))
+        assert response.status_code == 204
+        assert api_client.get(self.user_list_url).status_code == 401
+
+
+class TestOTPPartitioning:
+
+    def make_token(self, user, created_at):
+        token = Token.objects.create(user=user, token="1234", token_type=TokenEnum.PASSWORD_RESET)
+        Token.objects.filter(pk=token.pk).update(created_at=created_at)
+        return token
+
+    def test_convert_keeps_unexpired_rows_and_maintain_drops_partitions(self, user_factory, settings):
+        settings.OTP_PARTITIONING = {"INTERVAL": "hourly", "PRECREATE": 2}
+        user = user_factory(is_active=True)
+        now = django_timezone.now()
+        fresh = self.make_token(user, now)
+        self.make_token(user, now - timedelta(hours=3))
+        _, table = otp_partitioned_tables()[1]
+
+        table.convert(now, precreate=2)
+        assert table.is_partitioned()
+        assert list(Token.objects.values_list("pk", flat=True)) == [fresh.pk]
+        current = table.partition_name(table.floor(now))
+        assert current in table.partitions().values()
+        plan = Token.objects.filter(created_at__gte=table.floor(now) + timedelta(hours=1)).explain()
+        assert current not in plan
+
+        created, dropped = table.maintain(now + timedelta(hours=3), precreate=2)
+        assert current in dropped
+        assert not Token.objects.filter(pk=fresh.pk).exists()
+
+    def test_task_deletes_expired_rows_from_plain_tables(self, user_factory):
+        user = user_factory(is_active=True)
+        fresh = self.make_token(user, django_timezone.now())
+        self.make_token(user, django_timezone.now() - timedelta(minutes=settings.TOKEN_LIFESPAN + 1))
+        maintain_otp_partitions()
+        assert list(Token.objects.values_list("pk", flat=True)) == [fresh.pk]
+
+
+class TestAuthEvents:
+    login_url = reverse("auth:login")
+    verify_url = reverse("auth:auth-verify-account")
+
+    @pytest.fixture(autouse=True)
+    def event_settings(self, settings):
+        settings.AUTH_EVENTS = {
+            "ENABLED": True, "BATCH_SIZE": 100, "FLUSH_INTERVAL": 60, "MAX_BUFFERED": 1000}
+        return settings.AUTH_EVENTS
+
+    def test_login_event_is_buffered_until_flushed(self, api_client, active_user, auth_user_password):
+        response = api_client.post(
+            self.login_url, {"phone": active_user.phone, "password": auth_user_password})
+        assert response.status_code == 200
+        assert not AuthEvent.objects.exists()
+        assert len(auth_events) == 1
+
+        assert auth_events.flush() == 1
+        event = AuthEvent.objects.get()
+        assert event.event_type == AuthEventEnum.LOGIN
+        assert event.user_id == active_user.id
+        assert event.metadata == {"method": "password"}
+        assert event.ip_address == "127.0.0.1"
+
+    def test_full_batch_is_flushed_when_request_finishes(self, api_client, active_user, event_settings):
+        event_settings["BATCH_SIZE"] = 2
+        for _ in range(2):
+            response = api_client.post(
+                self.login_url, {"phone": active_user.phone, "password": "wrong-password"})
+            assert response.status_code == 401
+        assert list(AuthEvent.objects.values_list("event_type", flat=True)) == [
+            AuthEventEnum.LOGIN_FAILED] * 2
+        assert len(auth_events) == 0
+
+    def test_overflow_is_flushed_after_the_emitting_transaction(
+            self, active_user, event_settings, django_capture_on_commit_callbacks):
+        event_settings["MAX_BUFFERED"] = 2
+        with django_capture_on_commit_callbacks() as callbacks:
+            with transaction.atomic():
+                for _ in range(3):
+                    emit_auth_event(AuthEventEnum.LOGIN_FAILED, user=active_user)
+        assert not AuthEvent.objects.exists()
+        assert len(callbacks) == 1
+
+        callbacks[0]()
+        assert AuthEvent.objects.count() == 3
+        assert len(auth_events) == 0
+
+    def test_failed_verification_is_recorded(self, api_client, event_settings):
+        event_settings["FLUSH_INTERVAL"] = 0
+        response = api_client.post(self.verify_url, {"phone": "08012345678", "otp": "1234"})
+        assert response.status_code == 400
+        event = AuthEvent.objects.get()
+        assert event.event_type == AuthEventEnum.VERIFICATION_FAILED
+        assert event.phone.endswith("8012345678")
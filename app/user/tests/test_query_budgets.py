@@ -0,0 +1,70 @@
+import pytest
+from django.urls import reverse
+
+from user.enums import TokenEnum
+from user.models import PendingUser
+
+from .conftest import api_client_with_credentials, assert_query_budget
+
+pytestmark = pytest.mark.django_db
+
+
+class TestQueryBudgets:
+
+    def test_login(self, api_client, active_user, auth_user_password):
+        response = assert_query_budget(
+            api_client.post, reverse("auth:login"),
+            {"phone": active_user.phone, "password": auth_user_password})
+        assert response.status_code == 200
+
+    def test_onboarding(self, api_client, mocker):
+        mocker.patch('user.tasks.send_phone_notification.delay')
+        response = assert_query_budget(
+            api_client.post, reverse("user:user-list"),
+            {"phone": "+2348198765432", "password": "simplepass@"})
+        assert response.status_code == 200
+
+    def test_verify_account(self, api_client):
+        pending_user = PendingUser.objects.create(
+            phone='+2348157787640', verification_code=1234, password='somesecret')
+        response = assert_query_budget(
+            api_client.post, reverse("auth:auth-verify-account"),
+            {"otp": pending_user.verification_code, "phone": pending_user.phone})
+        assert response.status_code == 200
+
+    def test_initiate_password_reset(self, api_client, active_user, mocker):
+        mocker.patch('user.tasks.send_phone_notification.delay')
+        response = assert_query_budget(
+            api_client.post, reverse("auth:auth-initiate-password-reset"),
+            {"phone": active_user.phone})
+        assert response.status_code == 200
+
+    def test_create_password(self, api_client, active_user, token_factory):
+        token = token_factory(user=active_user, token_type=TokenEnum.PASSWORD_RESET)
+        response = assert_query_budget(
+            api_client.post, reverse("auth:auth-create-password"),
+            {"otp": token.token, "phone": active_user.phone, "new_password": "new_pass_me"})
+        assert response.status_code == 200
+
+    def test_admin_user_list_and_detail(self, api_client, authenticate_user, user_factory):
+        user_factory.create_batch(5)
+        admin = authenticate_user(is_admin=True)
+        api_client_with_credentials(admin['token'], api_client)
+        response = assert_query_budget(api_client.get, reverse("user:user-list"))
+        assert response.status_code == 200
+        response = assert_query_budget(
+            api_client.get, reverse("user:user-detail", args=[admin['user_instance'].id]))
+        assert response.status_code == 200
+
+    def test_async_onboarding_and_verification(self, client, mocker):
+        mocker.patch('user.tasks.send_phone_notification.delay')
+        response = assert_query_budget(
+            client.post, reverse("async-auth:onboard"),
+            {"phone": "08198765432", "password": "simplepass@"}, content_type="application/json")
+        assert response.status_code == 200
+        pending_user = PendingUser.objects.get(phone="+2348198765432")
+        response = assert_query_budget(
+            client.post, reverse("async-auth:verify-account"),
+            {"otp": pending_user.verification_code, "phone": pending_user.phone},
+            content_type="application/json")
+        assert response.status_code == 200
@@ -1,8 +1,30 @@
+import csv
+import io
+import json
+import time
+from datetime import timedelta
+
 import pytest
+import time_machine
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from rest_framework.permissions import IsAuthenticated
+from rest_framework_simplejwt.tokens import RefreshToken
 
+from core.utils.reverse_querystring import reverse_querystring
 from .conftest import api_client_with_credentials
-from user.models import PendingUser
+from user.enums import FunnelStageEnum, SystemRoleEnum, TokenEnum
+from user.models import FunnelCount, PendingUser, Token, User
+from user.serializers import CustomObtainTokenPairSerializer
+from user.tasks import bulk_delete_users, rebuild_phone_filter
+from user.utils import registered_phones
+from user.views import USER_EXPORT_FIELDS
 pytestmark = pytest.mark.django_db
 
 
@@ -101,3 +123,443 @@ class TestUser:
         response = api_client.patch(url, data)
         assert response.status_code == 200
         assert response.json()['firstname'] == data["firstname"]
+
+    def test_admin_export_users_ndjson(self, api_client, user_factory, authenticate_user):
+        user_factory.create_batch(3)
+        user = authenticate_user(is_admin=True)
+        token = user['token']
+        api_client_with_credentials(token, api_client)
+        response = api_client.get(reverse("user:user-export"))
+        assert response.status_code == 200
+        assert response['Content-Type'] == 'application/x-ndjson'
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        rows = [json.loads(line) for line in lines]
+        assert len(rows) == 4  # 3 users + admin
+        assert set(rows[0]) == set(USER_EXPORT_FIELDS)
+
+    def test_admin_export_users_csv_respects_search(self, api_client, user_factory, authenticate_user):
+        user_factory(firstname="Findme")
+        user_factory.create_batch(2, firstname="Other")
+        user = authenticate_user(is_admin=True)
+        token = user['token']
+        api_client_with_credentials(token, api_client)
+        url = reverse_querystring(
+            "user:user-export", query_kwargs={"export_format": "csv", "search": "Findme"})
+        response = api_client.get(url)
+        assert response.status_code == 200
+        rows = list(csv.DictReader(
+            b''.join(response.streaming_content).decode().splitlines()))
+        assert len(rows) == 1
+        assert rows[0]['firstname'] == "Findme"
+
+    def test_deny_export_to_nonadmin(self, api_client, authenticate_user):
+        user = authenticate_user(is_admin=False)
+        token = user['token']
+        api_client_with_credentials(token, api_client)
+        response = api_client.get(reverse("user:user-export"))
+        assert response.status_code == 403
+
+    def test_admin_bulk_onboard_users(self, api_client, user_factory, authenticate_user, mocker):
+        mock_send_bulk = mocker.patch(
+            'user.tasks.send_bulk_phone_notifications.delay')
+        existing = user_factory(phone="+2348111111111")
+        user = authenticate_user(is_admin=True)
+        api_client_with_credentials(user['token'], api_client)
+        data = {"phones": ["08122222222", "+2348122222222", existing.phone, "12345", "+2348133333333"]}
+        response = api_client.post(reverse("user:user-bulk-onboard"), data)
+        assert response.status_code == 200
+        statuses = [row['status'] for row in response.json()['results']]
+        assert statuses == ['created', 'duplicate', 'exists', 'invalid', 'created']
+        assert response.json()['summary'] == {'created': 2, 'duplicate': 1, 'exists': 1, 'invalid': 1}
+        assert PendingUser.objects.filter(
+            phone__in=["+2348122222222", "+2348133333333"]).count() == 2
+        mock_send_bulk.assert_called_once()
+        assert len(mock_send_bulk.call_args[0][0]) == 2
+
+    def test_admin_bulk_onboard_users_from_file(self, api_client, authenticate_user, mocker):
+        mocker.patch('user.tasks.send_bulk_phone_notifications.delay')
+        user = authenticate_user(is_admin=True)
+        api_client_with_credentials(user['token'], api_client)
+        upload = SimpleUploadedFile("phones.csv", b"phone\n08144444444\n08155555555\n")
+        response = api_client.post(
+            reverse("user:user-bulk-onboard"), {"file": upload}, format="multipart")
+        assert response.status_code == 200
+        assert response.json()['summary'] == {'created': 2}
+
+    def test_deny_bulk_onboard_to_nonadmin(self, api_client, authenticate_user):
+        user = authenticate_user(is_admin=False)
+        api_client_with_credentials(user['token'], api_client)
+        response = api_client.post(
+            reverse("user:user-bulk-onboard"), {"phones": ["08144444444"]})
+        assert response.status_code == 403
+
+    def test_admin_bulk_update_users(self, api_client, user_factory, authenticate_user):
+        targets = user_factory.create_batch(2, verified=False)
+        untouched = user_factory(verified=False)
+        user = authenticate_user(is_admin=True)
+        api_client_with_credentials(user['token'], api_client)
+        data = {"ids": [str(target.id) for target in targets],
+                "roles": [SystemRoleEnum.ADMIN], "verified": True}
+        response = api_client.post(reverse("user:user-bulk-update"), data)
+        assert response.status_code == 200
+        assert response.json()['updated'] == 2
+        for target in targets:
+            target.refresh_from_db()
+            assert target.verified is True
+            assert target.roles == [SystemRoleEnum.ADMIN]
+        untouched.refresh_from_db()
+        assert untouched.verified is False
+
+    def test_admin_bulk_update_requires_selection(self, api_client, authenticate_user):
+        user = authenticate_user(is_admin=True)
+        api_client_with_credentials(user['token'], api_client)
+        response = api_client.post(reverse("user:user-bulk-update"), {"is_active": False})
+        assert response.status_code == 400
+
+    def test_admin_bulk_delete_users(self, api_client, user_factory, token_factory,
+                                     authenticate_user, mocker, settings):
+        settings.BULK_DELETE_CHUNK_SIZE = 2
+        mock_bulk_delete = mocker.patch('user.tasks.bulk_delete_users.delay')
+        targets = user_factory.create_batch(3)
+        token_factory(user=targets[0], token_type=TokenEnum.PASSWORD_RESET)
+        user = authenticate_user(is_admin=True)
+        api_client_with_credentials(user['token'], api_client)
+        response = api_client.post(reverse("user:user-bulk-delete"), {"all_matching": True})
+        assert response.status_code == 202
+        job_id = response.json()['job_id']
+        assert response.json()['total'] == 3  # the requesting admin is excluded
+        # One broker message per chunk, not the whole id list
+        assert [len(call.args[1]) for call in mock_bulk_delete.call_args_list] == [2, 1]
+
+        bulk_delete_users(*mock_bulk_delete.call_args_list[0].args)
+        response = api_client.get(
+            reverse("user:user-bulk-delete-status", kwargs={"job_id": job_id}))
+        assert response.json()['status'] == 'running'
+        assert response.json()['deleted'] == 2
+
+        bulk_delete_users(*mock_bulk_delete.call_args_list[1].args)
+        assert User.objects.count() == 1
+        assert Token.objects.count() == 0
+
+        response = api_client.get(
+            reverse("user:user-bulk-delete-status", kwargs={"job_id": job_id}))
+        assert response.status_code == 200
+        assert response.json()['status'] == 'completed'
+        assert response.json()['deleted'] == 3
+
+    def test_deny_bulk_update_to_nonadmin(self, api_client, authenticate_user):
+        user = authenticate_user(is_admin=False)
+        api_client_with_credentials(user['token'], api_client)
+        response = api_client.post(
+            reverse("user:user-bulk-update"), {"all_matching": True, "is_active": False})
+        assert response.status_code == 403
+
+    def test_retrieve_user_not_modified(self, api_client, authenticate_user):
+        user = authenticate_user(is_admin=False)
+        user_instance = user['user_instance']
+        api_client_with_credentials(user['token'], api_client)
+        url = reverse("user:user-detail", kwargs={"pk": user_instance.id})
+        response = api_client.get(url)
+        assert response.status_code == 200
+        etag = response['ETag']
+        assert 'Last-Modified' in response
+
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+        upper_url = reverse("user:user-detail", kwargs={"pk": str(user_instance.id).upper()})
+        response = api_client.get(upper_url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+
+        api_client.patch(url, {"firstname": "Changed"})
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert response.json()['firstname'] == "Changed"
+
+    def test_not_modified_checks_object_permissions(self, api_client, authenticate_user, mocker):
+        user = authenticate_user(is_admin=False)
+        api_client_with_credentials(user['token'], api_client)
+        url = reverse("user:user-detail", kwargs={"pk": user['user_instance'].id})
+        etag = api_client.get(url)['ETag']
+        mocker.patch.object(IsAuthenticated, "has_object_permission", return_value=False)
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 403
+
+    def test_list_users_not_modified(self, api_client, user_factory, authenticate_user,
+                                     django_capture_on_commit_callbacks):
+        user_factory.create_batch(2)
+        user = authenticate_user(is_admin=True)
+        api_client_with_credentials(user['token'], api_client)
+        response = api_client.get(self.user_list_url)
+        etag = response['ETag']
+
+        response = api_client.get(self.user_list_url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+
+        with django_capture_on_commit_callbacks(execute=True):
+            user_factory()
+        response = api_client.get(self.user_list_url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert response.json()['total'] == 4
+
+    def test_admin_list_served_from_cache_until_user_changes(
+            self, api_client, user_factory, authenticate_user, django_assert_num_queries,
+            django_capture_on_commit_callbacks):
+        app_user = user_factory(firstname="First")
+        user = authenticate_user(is_admin=True)
+        api_client_with_credentials(user['token'], api_client)
+        response = api_client.get(self.user_list_url)
+        assert response.status_code == 200
+
+        with django_assert_num_queries(1):  # authentication only
+            cached = api_client.get(self.user_list_url)
+        assert cached.json() == response.json()
+
+        app_user.firstname = "Second"
+        with django_capture_on_commit_callbacks() as callbacks:
+            app_user.save()
+            # Until the write commits, readers keep getting the cached generation
+            assert api_client.get(self.user_list_url).json() == response.json()
+        for callback in callbacks:
+            callback()
+        response = api_client.get(self.user_list_url)
+        firstnames = [row['firstname'] for row in response.json()['results']]
+        assert "Second" in firstnames
+
+        stats = api_client.get(reverse("user:user-cache-stats")).json()['data']
+        assert stats['list'] == {'hits': 2, 'misses': 2, 'hit_ratio': 0.5}
+
+    def test_admin_list_cache_invalidated_by_bulk_update(self, api_client, user_factory, authenticate_user,
+                                                         django_capture_on_commit_callbacks):
+        app_user = user_factory(verified=False)
+        user = authenticate_user(is_admin=True)
+        api_client_with_credentials(user['token'], api_client)
+        api_client.get(self.user_list_url)
+        with django_capture_on_commit_callbacks(execute=True):
+            api_client.post(reverse("user:user-bulk-update"),
+                            {"ids": [str(app_user.id)], "verified": True})
+        response = api_client.get(self.user_list_url)
+        verified = {row['id']: row['verified'] for row in response.json()['results']}
+        assert verified[str(app_user.id)] is True
+
+    def test_create_user_replays_idempotent_retry(self, api_client, mocker):
+        mock_send_verification_otp = mocker.patch(
+            'user.tasks.send_phone_notification.delay')
+        data = {"phone": "+2348198765432", "password": "simplepass@"}
+        response = api_client.post(self.user_list_url, data, HTTP_IDEMPOTENCY_KEY="retry-1")
+        assert response.status_code == 200
+        otp = PendingUser.objects.get(phone=data["phone"]).verification_code
+
+        replayed = api_client.post(self.user_list_url, data, HTTP_IDEMPOTENCY_KEY="retry-1")
+        assert replayed.status_code == 200
+        assert replayed['Idempotent-Replayed'] == 'true'
+        assert replayed.json() == response.json()
+        assert PendingUser.objects.get(phone=data["phone"]).verification_code == otp
+        mock_send_verification_otp.assert_called_once()
+
+    def test_deny_idempotency_key_reuse_with_different_body(self, api_client, mocker):
+        mocker.patch('user.tasks.send_phone_notification.delay')
+        api_client.post(self.user_list_url, {"phone": "+2348198765432", "password": "simplepass@"},
+                        HTTP_IDEMPOTENCY_KEY="retry-2")
+        response = api_client.post(
+            self.user_list_url, {"phone": "+2348198765433", "password": "simplepass@"},
+            HTTP_IDEMPOTENCY_KEY="retry-2")
+        assert response.status_code == 422
+
+    def test_idempotent_replay_of_validation_error(self, api_client, active_user):
+        data = {"phone": active_user.phone, "password": "simplepass@"}
+        response = api_client.post(self.user_list_url, data, HTTP_IDEMPOTENCY_KEY="retry-3")
+        assert response.status_code == 400
+        replayed = api_client.post(self.user_list_url, data, HTTP_IDEMPOTENCY_KEY="retry-3")
+        assert replayed.status_code == 400
+        assert replayed['Idempotent-Replayed'] == 'true'
+
+    def test_throttled_response_is_not_replayed(self, api_client, mocker, settings):
+        mocker.patch('user.tasks.send_phone_notification.delay')
+        settings.OTP_THROTTLE = {**settings.OTP_THROTTLE, "PHONE": (1, 600)}
+        data = {"phone": "+2348198765432", "password": "simplepass@"}
+        api_client.post(self.user_list_url, data)
+        response = api_client.post(self.user_list_url, data, HTTP_IDEMPOTENCY_KEY="retry-4")
+        assert response.status_code == 429
+
+        # Once the window has passed, the retry runs the view instead of replaying the 429
+        settings.OTP_THROTTLE = {**settings.OTP_THROTTLE, "PHONE": (5, 600)}
+        retried = api_client.post(self.user_list_url, data, HTTP_IDEMPOTENCY_KEY="retry-4")
+        assert retried.status_code == 200
+        assert 'Idempotent-Replayed' not in retried
+
+    def test_spoofed_forwarded_for_does_not_reset_ip_limit(self, api_client, mocker, settings):
+        mocker.patch('user.tasks.send_phone_notification.delay')
+        settings.OTP_THROTTLE = {**settings.OTP_THROTTLE, "IP": (2, 600)}
+        for index in range(3):
+            response = api_client.post(
+                self.user_list_url, {"phone": f"+234819876543{index}", "password": "simplepass@"},
+                HTTP_X_FORWARDED_FOR=f"10.0.0.{index}")
+        assert response.status_code == 429
+
+    def test_refused_requests_do_not_use_phone_allowance(self, api_client, mocker, settings):
+        mocker.patch('user.tasks.send_phone_notification.delay')
+        settings.OTP_THROTTLE = {**settings.OTP_THROTTLE, "PHONE": (1, 600), "GLOBAL_BUCKET": (1, 0.001)}
+        api_client.post(self.user_list_url, {"phone": "+2348198765430", "password": "simplepass@"})
+        data = {"phone": "+2348198765431", "password": "simplepass@"}
+        for _ in range(3):
+            assert api_client.post(self.user_list_url, data).status_code == 429
+
+        settings.OTP_THROTTLE = {**settings.OTP_THROTTLE, "GLOBAL_BUCKET": (50, 5.0)}
+        cache.delete("otp-throttle:global:bucket")
+        assert api_client.post(self.user_list_url, data).status_code == 200
+
+    def test_throttle_otp_issuance_per_phone(self, api_client, mocker):
+        mock_send_verification_otp = mocker.patch(
+            'user.tasks.send_phone_notification.delay')
+        data = {"phone": "+2348198765432", "password": "simplepass@"}
+        for _ in range(3):
+            assert api_client.post(self.user_list_url, data).status_code == 200
+        response = api_client.post(self.user_list_url, data)
+        assert response.status_code == 429
+        assert 'Retry-After' in response
+        assert mock_send_verification_otp.call_count == 3
+
+    def test_onboarding_skips_user_lookup_on_filter_miss(self, api_client, mocker, active_user):
+        mocker.patch('user.tasks.send_phone_notification.delay')
+        call_command('rebuild_phone_filter')
+        with CaptureQueriesContext(connection) as queries:
+            response = api_client.post(
+                self.user_list_url, {"phone": "+2348198765432", "password": "simplepass@"})
+        assert response.status_code == 200
+        assert not any('"user_user"' in query["sql"] for query in queries.captured_queries)
+
+        response = api_client.post(
+            self.user_list_url, {"phone": active_user.phone, "password": "simplepass@"})
+        assert response.status_code == 400
+
+    def test_verified_user_is_added_to_phone_filter(
+            self, api_client, django_capture_on_commit_callbacks):
+        call_command('rebuild_phone_filter')
+        assert not registered_phones.might_contain("+2348157787640")
+        PendingUser.objects.create(
+            phone='+2348157787640', verification_code=1234, password='somesecret')
+        with django_capture_on_commit_callbacks(execute=True):
+            api_client.post(reverse("auth:auth-verify-account"),
+                            {'otp': 1234, 'phone': '+2348157787640'})
+        assert registered_phones.might_contain("+2348157787640")
+
+    def test_invalidated_phone_filter_is_rebuilt_by_task(self, active_user):
+        rebuild_phone_filter()  # first run builds the missing filter
+        assert registered_phones.is_ready()
+        registered_phones.invalidate("state_lost")
+        assert registered_phones.needs_rebuild()
+
+        rebuild_phone_filter()
+        assert registered_phones.is_ready()
+        assert registered_phones.might_contain(active_user.phone)
+        assert not registered_phones.might_contain("+2348157787640")
+
+    def test_bulk_role_downgrade_revokes_tokens(self, api_client, user_factory, authenticate_user):
+        with time_machine.travel(time.time() - 60):
+            downgraded = user_factory(is_active=True, roles=[SystemRoleEnum.ADMIN])
+            unchanged = user_factory(is_active=True, roles=[SystemRoleEnum.CUSTOMER])
+            tokens = {user.id: str(RefreshToken.for_user(user).access_token)
+                      for user in [downgraded, unchanged]}
+        user = authenticate_user(is_admin=True)
+        api_client_with_credentials(user['token'], api_client)
+        data = {"ids": [str(downgraded.id), str(unchanged.id)], "roles": [SystemRoleEnum.CUSTOMER]}
+        assert api_client.post(reverse("user:user-bulk-update"), data).status_code == 200
+
+        api_client_with_credentials(tokens[downgraded.id], api_client)
+        assert api_client.get(self.user_list_url).status_code == 401
+        api_client_with_credentials(tokens[unchanged.id], api_client)
+        assert api_client.get(self.user_list_url).status_code == 200
+
+
+class TestOnboardingFunnel:
+    funnel_url = reverse("user:user-funnel")
+
+    def test_funnel_counts_each_stage_once(self, api_client, authenticate_user, mocker):
+        mocker.patch('user.tasks.send_phone_notification.delay')
+        admin = authenticate_user(is_admin=True)
+        FunnelCount.objects.all().delete()  # the admin's own first login
+        phone, password = "+2348198765432", "simplepass@"
+        response = api_client.post(reverse("user:user-list"), {"phone": phone, "password": password})
+        assert response.status_code == 200
+        pending_user = PendingUser.objects.get(phone=phone)
+        response = api_client.post(reverse("auth:auth-verify-account"),
+                                   {"phone": phone, "otp": pending_user.verification_code})
+        assert response.status_code == 200
+        for _ in range(2):
+            response = api_client.post(reverse("auth:login"), {"phone": phone, "password": password})
+            assert response.status_code == 200
+
+        api_client_with_credentials(admin['token'], api_client)
+        start = (timezone.now() - timedelta(days=1)).isoformat()
+        with CaptureQueriesContext(connection) as queries:
+            response = api_client.get(self.funnel_url, {"start": start, "granularity": "hour"})
+        assert response.status_code == 200
+        assert sum('"user_funnelcount"' in query["sql"] for query in queries.captured_queries) == 1
+        data = response.json()['data']
+        expected = {"OTP_ISSUED": 1, "VERIFIED": 1, "FIRST_LOGIN": 1}
+        assert data['totals'] == expected
+        assert data['conversion'] == {"VERIFIED": 1.0, "FIRST_LOGIN": 1.0}
+        assert len(data['buckets']) == 1
+        assert {stage: data['buckets'][0][stage] for stage in expected} == expected
+
+    def test_concurrent_first_logins_count_once(self, user_factory):
+        user = user_factory(is_active=True)
+        # Two requests that both loaded the user before either stamped last_login
+        copies = [User.objects.get(pk=user.pk) for _ in range(2)]
+        for copy in copies:
+            CustomObtainTokenPairSerializer.token_pair_for(copy)
+        assert FunnelCount.objects.get(stage=FunnelStageEnum.FIRST_LOGIN).count == 1
+        assert User.objects.get(pk=user.pk).last_login is not None
+
+    def test_funnel_rejects_inverted_range(self, api_client, authenticate_user):
+        admin = authenticate_user(is_admin=True)
+        api_client_with_credentials(admin['token'], api_client)
+        now = timezone.now()
+        response = api_client.get(self.funnel_url, {
+            "start": now.isoformat(), "end": (now - timedelta(hours=1)).isoformat()})
+        assert response.status_code == 400
+
+    def test_deny_funnel_to_nonadmin(self, api_client, authenticate_user):
+        user = authenticate_user(is_admin=False)
+        api_client_with_credentials(user['token'], api_client)
+        response = api_client.get(self.funnel_url, {"start": timezone.now().isoformat()})
+        assert response.status_code == 403
+
+
+class TestSyntheticData:
+
+    def test_generate_rows_usable_by_auth_flows(self, api_client):
+        call_command("generate_synthetic_data", users=200, seed=7, batch_size=64,
+                     stdout=io.StringIO())
+        assert User.objects.count() == 200
+        assert PendingUser.objects.count() == 20
+        assert Token.objects.filter(user__isnull=False).count() == 10
+        assert User.objects.filter(verified=True).count() > User.objects.filter(verified=False).count()
+
+        user = User.objects.filter(is_active=True).first()
+        assert registered_phones.might_contain(user.phone)
+        response = api_client.post(
+            reverse("auth:login"), {"phone": user.phone, "password": "passer@@@111"})
+        assert response.status_code == 200
+
+    def test_same_seed_reproduces_rows(self):
+        call_command("generate_synthetic_data", users=20, seed=3, stdout=io.StringIO())
+        first = list(User.objects.order_by("phone").values_list("id", "phone", "verified", "roles"))
+        User.objects.all().delete()
+        PendingUser.objects.all().delete()
+        call_command("generate_synthetic_data", users=20, seed=3, stdout=io.StringIO())
+        assert list(User.objects.order_by("phone").values_list("id", "phone", "verified", "roles")) == first
+
+    def test_refuse_to_reuse_phone_range(self):
+        call_command("generate_synthetic_data", users=5, stdout=io.StringIO())
+        with pytest.raises(CommandError):
+            call_command("generate_synthetic_data", users=5, start=3, stdout=io.StringIO())
+        call_command("generate_synthetic_data", users=5, start=5, stdout=io.StringIO())
+        assert User.objects.count() == 10
+
+    def test_each_token_has_its_own_user(self):
+        call_command("generate_synthetic_data", users=30, tokens=30, stdout=io.StringIO())
+        assert Token.objects.values("user").distinct().count() == 30
+        with pytest.raises(CommandError):
+            call_command("generate_synthetic_data", users=5, tokens=6, start=100,
+                         stdout=io.StringIO())
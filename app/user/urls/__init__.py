@@ -0,0 +1,14 @@
+# Most queries one request to each endpoint may run, keyed "<METHOD> <url name>".
+# Tests check them with user.tests.conftest.assert_query_budget; raise a budget
+# only together with the change that needs the extra queries.
+QUERY_BUDGETS = {
+    "POST auth:login": 6,
+    "POST user:user-list": 4,
+    "POST auth:auth-verify-account": 4,
+    "POST auth:auth-initiate-password-reset": 3,
+    "POST auth:auth-create-password": 3,
+    "GET user:user-list": 4,
+    "GET user:user-detail": 2,
+    "POST async-auth:onboard": 4,
+    "POST async-auth:verify-account": 4,
+}
@@ -0,0 +1,13 @@
+from django.urls import path
+
+from .. import async_views
+
+app_name = "async-auth"
+
+urlpatterns = [
+    path("user/", async_views.onboard_user, name="onboard"),
+    path("auth/verify-account/", async_views.verify_account, name="verify-account"),
+    path("auth/initiate-password-reset/", async_views.initiate_password_reset,
+         name="initiate-password-reset"),
+    path("auth/create-password/", async_views.create_password, name="create-password"),
+]
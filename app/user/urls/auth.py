@@ -2,18 +2,24 @@ from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import TokenRefreshView, TokenVerifyView
 
-from ..views import (AuthViewsets, CustomObtainTokenPairView,
-                     PasswordChangeView)
+from ..views import (APIKeyViewSet, AuthViewsets, CreateTokenView,
+                     CustomObtainTokenPairView, JWKSView,
+                     PasswordChangeView, TokenIntrospectionView, TOTPLoginView)
 
 app_name = "auth"
 router = DefaultRouter()
 router.register("", AuthViewsets,  basename="auth")
 router.register("change-password", PasswordChangeView, basename="password-change")
+router.register("api-keys", APIKeyViewSet, basename="api-key")
 
 urlpatterns = [
     path("login/", CustomObtainTokenPairView.as_view(), name="login"),
+    path("login/totp/", TOTPLoginView.as_view(), name="login-totp"),
+    path("api-key/", CreateTokenView.as_view(), name="create-api-key"),
     path("token/refresh/", TokenRefreshView.as_view(), name="refresh-token"),
     path("token/verify/", TokenVerifyView.as_view(), name="verify-token"),
+    path("token/introspect/", TokenIntrospectionView.as_view(), name="introspect-token"),
+    path(".well-known/jwks.json", JWKSView.as_view(), name="jwks"),
     path("", include(router.urls)),
 ]
 
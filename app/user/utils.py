@@ -1,16 +1,50 @@
 import base64
+import csv
+import hmac
+import io
 import os
 import re
+import secrets
+import time
+from abc import ABC, abstractmethod
+from datetime import timedelta
+
 import pyotp
 from django.conf import settings
-from rest_framework import permissions, serializers
+from django.core.cache import cache
+from rest_framework import exceptions, permissions, serializers
+from rest_framework.throttling import BaseThrottle
 from twilio.rest import Client
 
+from core.partitioning import PartitionedTable
+from core.utils.bloom import SharedBloomFilter
+from core.utils.response_cache import VersionedResponseCache
+from core.utils.throttling import (FailedAttemptCounter, SlidingWindowLimiter,
+                                  TokenBucket)
+
 from .enums import SystemRoleEnum
-from .models import User
+from .models import PendingUser, Token, User
 
 client = Client(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN)
 
+user_response_cache = VersionedResponseCache("user-response")
+
+registered_phones = SharedBloomFilter(
+    "registered-phones",
+    settings.REGISTERED_PHONE_FILTER["CAPACITY"],
+    settings.REGISTERED_PHONE_FILTER["ERROR_RATE"],
+    settings.REGISTERED_PHONE_FILTER["COMPACT_AFTER"],
+)
+
+
+def rebuild_registered_phones() -> int:
+    """Rebuild the registered-phone filter from the users table; returns the count"""
+    # Checks fall back to the DB while the filter is rebuilt. Users committed
+    # after the query starts are added to the pending list by the signal.
+    phones = User.objects.exclude(phone__isnull=True).values_list(
+        "phone", flat=True).iterator(chunk_size=settings.USER_EXPORT_CHUNK_SIZE)
+    return registered_phones.rebuild(phones)
+
 def get_user_role_names(user:User)->list:
     """
     Returns a list of role names for the given user.
@@ -24,6 +58,17 @@ def is_admin_user(user:User)->bool:
     return user.is_admin or SystemRoleEnum.ADMIN in user.roles
 
 
+class IsInternalService(permissions.BasePermission):
+    """Allows access to internal services presenting a configured service token."""
+    message = "Only internal services are authorized to perform this action."
+
+    def has_permission(self, request, view):
+        presented = request.headers.get("X-Internal-Service-Token", "")
+        return bool(presented) and any(
+            hmac.compare_digest(presented.encode(), token.encode())
+            for token in settings.TOKEN_INTROSPECTION["SERVICE_TOKENS"])
+
+
 class IsAdmin(permissions.BasePermission):
     """Allows access only to Admin users."""
     message = "Only Admins are authorized to perform this action."
@@ -55,7 +100,212 @@ def clean_phone(number:str):
             raise serializers.ValidationError({'phone': 'Incorrect phone number.'})    
         
 
+def read_phones_from_file(upload) -> list:
+    """Read phones from the first column of an uploaded CSV/text file"""
+    content = upload.read().decode('utf-8-sig')
+    phones = []
+    for row in csv.reader(io.StringIO(content)):
+        if not row or not row[0].strip():
+            continue
+        if not phones and row[0].strip().lower() == 'phone':
+            continue
+        phones.append(row[0].strip())
+    return phones
+
+
+def summarize_bulk_report(report: list) -> dict:
+    """Count rows of a bulk operation report by status"""
+    summary = {}
+    for row in report:
+        summary[row['status']] = summary.get(row['status'], 0) + 1
+    return summary
+
+
+def bulk_job_cache_key(job_id: str) -> str:
+    return f"bulk-user-job:{job_id}"
+
+
+def start_bulk_job(job_id: str, total: int) -> None:
+    """Record a background bulk job so admins can poll its progress"""
+    timeout = settings.BULK_JOB_PROGRESS_TTL
+    cache.set(bulk_job_cache_key(job_id), {"total": total}, timeout=timeout)
+    cache.set(f"{bulk_job_cache_key(job_id)}:done", 0, timeout=timeout)
+
+
+def add_bulk_job_progress(job_id: str, done: int) -> None:
+    """Chunks of one job run in parallel, so progress is a shared counter"""
+    try:
+        cache.incr(f"{bulk_job_cache_key(job_id)}:done", done)
+    except ValueError:
+        pass  # the job expired from the cache
+
+
+def get_bulk_job_progress(job_id: str):
+    job = cache.get(bulk_job_cache_key(job_id))
+    if job is None:
+        return None
+    done = cache.get(f"{bulk_job_cache_key(job_id)}:done", 0)
+    status = "completed" if done >= job["total"] else "running" if done else "pending"
+    return {"status": status, "total": job["total"], "deleted": done}
+
+
+def throttle_otp_issuance(phone: str, request=None) -> None:
+    """
+    Enforce per phone, per IP and global OTP issuance limits.
+    Raises Throttled (429 with Retry-After) when any limit is exceeded.
+    """
+    config = settings.OTP_THROTTLE
+    if not config["ENABLED"]:
+        return
+    windows = [(SlidingWindowLimiter("otp-throttle:phone", *config["PHONE"]), phone)]
+    if request is not None:
+        windows.append((SlidingWindowLimiter("otp-throttle:ip", *config["IP"]),
+                        BaseThrottle().get_ident(request)))
+    # Every limit is checked before any is counted, so a request refused by the
+    # IP or global limit doesn't use up the phone's allowance
+    for limiter, key in windows:
+        allowed, wait = limiter.check(key)
+        if not allowed:
+            break
+    else:
+        allowed, wait = TokenBucket("otp-throttle:global", *config["GLOBAL_BUCKET"]).consume()
+    if not allowed:
+        raise exceptions.Throttled(
+            wait=wait, detail="Too many OTP requests. Please try again later.")
+    for limiter, key in windows:
+        limiter.record(key)
+
+
+class CredentialThrottle(BaseThrottle, ABC):
+    """
+    Sliding-window limit on requests that check a phone/password pair, so the
+    password of one phone can't be guessed quickly. Subclasses pick the key.
+    """
+    scope = None
+
+    @abstractmethod
+    def get_key(self, request):
+        """Return the value to limit on, or None to let the request through"""
+
+    def allow_request(self, request, view) -> bool:
+        config = settings.CREDENTIAL_THROTTLE
+        key = self.get_key(request) if config["ENABLED"] else None
+        if key is None:
+            return True
+        allowed, self._wait = SlidingWindowLimiter(
+            f"credential-throttle:{self.scope}", *config[self.scope]).hit(key)
+        return allowed
+
+    def wait(self):
+        return self._wait
+
+
+class CredentialPhoneThrottle(CredentialThrottle):
+    scope = "PHONE"
+
+    def get_key(self, request):
+        phone = str(request.data.get("phone", "")).strip().lower()
+        if not phone:
+            return None
+        try:
+            return clean_phone(phone)
+        except serializers.ValidationError:
+            return phone
+
+
+class CredentialIPThrottle(CredentialThrottle):
+    scope = "IP"
+
+    def get_key(self, request):
+        return self.get_ident(request)
+
+
+def otp_attempt_counter() -> FailedAttemptCounter:
+    config = settings.OTP_VERIFICATION_ATTEMPTS
+    return FailedAttemptCounter("otp-attempts", config["MAX_FAILURES"], config["LOCKOUT"])
+
+
+def reject_if_locked(counter: FailedAttemptCounter, key: str) -> None:
+    """Refuse further OTP guesses for a locked key without touching the DB"""
+    wait = counter.locked_for(key)
+    if wait:
+        raise exceptions.Throttled(
+            wait=wait, detail="Too many failed attempts. Request a new OTP.")
+
+
+def otp_matches(stored_code, submitted_code) -> bool:
+    """Constant-time OTP comparison"""
+    if not stored_code or submitted_code is None:
+        return False
+    return hmac.compare_digest(str(stored_code).encode(), str(submitted_code).encode())
+
+
+def build_totp(secret: str) -> pyotp.TOTP:
+    config = settings.TOTP
+    return pyotp.TOTP(secret, digits=config["DIGITS"], interval=config["INTERVAL"],
+                      issuer=config["ISSUER"])
+
+
+def totp_provisioning_uri(user: User, secret: str) -> str:
+    """otpauth:// URI to render as a QR code for authenticator apps"""
+    return build_totp(secret).provisioning_uri(name=user.phone or user.email)
+
+
+def verify_totp(user: User, code, secret: str = None, now: float = None) -> bool:
+    """
+    Check a TOTP code against time steps within VALID_WINDOW of now. An accepted
+    step is recorded in the cache so the same code cannot be replayed while it
+    is still inside the window.
+    """
+    secret = secret or user.get_totp_secret()
+    if not secret or not code:
+        return False
+    totp = build_totp(secret)
+    window = settings.TOTP["VALID_WINDOW"]
+    current = int((time.time() if now is None else now) // totp.interval)
+    for step in range(current - window, current + window + 1):
+        if otp_matches(totp.generate_otp(step), code):
+            return cache.add(f"totp-used:{user.id}:{step}", 1,
+                             timeout=totp.interval * (2 * window + 2))
+    return False
+
+
+def create_totp_challenge(user: User) -> str:
+    """Opaque token proving the password step of a login passed"""
+    challenge = secrets.token_urlsafe(32)
+    cache.set(f"totp-challenge:{challenge}", str(user.id),
+              timeout=settings.TOTP["CHALLENGE_TTL"])
+    return challenge
+
+
+def get_totp_challenge_user(challenge: str):
+    user_id = cache.get(f"totp-challenge:{challenge}")
+    if user_id is None:
+        return None
+    return User.objects.filter(id=user_id, is_active=True, totp_enabled=True).first()
+
+
+def discard_totp_challenge(challenge: str) -> None:
+    cache.delete(f"totp-challenge:{challenge}")
+
+
 def generate_otp()->int:
     totp = pyotp.TOTP(base64.b32encode(os.urandom(16)).decode('utf-8'))
     otp = totp.now()
-    return otp
\ No newline at end of file
+    return otp
+
+
+def otp_partitioned_tables() -> list:
+    """(model, PartitionedTable) for each OTP table that can be range-partitioned"""
+    interval = settings.OTP_PARTITIONING["INTERVAL"]
+    return [
+        (PendingUser, PartitionedTable(
+            PendingUser._meta.db_table, interval,
+            retention=timedelta(minutes=settings.OTP_EXPIRE_TIME),
+            indexes=[("phone", "created_at")])),
+        (Token, PartitionedTable(
+            Token._meta.db_table, interval,
+            retention=timedelta(minutes=settings.TOKEN_LIFESPAN),
+            indexes=[("user_id", "token_type", "created_at"), ("token", "created_at")],
+            foreign_keys=[("user_id", User._meta.db_table, "id")])),
+    ]
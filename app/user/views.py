@@ -1,24 +1,63 @@
+import uuid
+from datetime import datetime
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db.models import Count, Max
+from django.utils import timezone
+from django.utils.http import parse_http_date
 from django_filters.rest_framework import DjangoFilterBackend
-from drf_spectacular.utils import extend_schema, inline_serializer
-from rest_framework import filters, serializers, status, viewsets
-from rest_framework.authtoken.views import ObtainAuthToken
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import OpenApiParameter, extend_schema, inline_serializer
+from rest_framework import filters, mixins, serializers, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
-from rest_framework.settings import api_settings
-from rest_framework_simplejwt.views import TokenObtainPairView
+from rest_framework.views import APIView
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenVerifyView
+
+from core.db import ReplicaReadMixin, use_primary_reads
+from core.utils.helpers import chunked
+from core.utils.idempotency import idempotent
+from core.utils.conditional import (has_conditional_headers, make_etag,
+                                    not_modified_response, set_validators)
+from core.utils.streaming import streaming_export_response
 
-from .enums import TokenEnum
 from .filters import UserFilter
-from .models import Token, User
-from .serializers import (AuthTokenSerializer,OnboardUserSerializer,
+from .authentication import revoke_api_key
+from .enums import AuthEventEnum
+from .events import emit_auth_event
+from .funnel import funnel_report
+from .models import APIKey, Token, User
+from .serializers import (APIKeySerializer, AuthTokenSerializer,OnboardUserSerializer,
+                          BulkOnboardUserSerializer, BulkUserSelectionSerializer,
+                          BulkUserUpdateSerializer,
                           CreatePasswordFromResetOTPSerializer,
                           CustomObtainTokenPairSerializer, EmailSerializer,
+                          FunnelQuerySerializer,
                           ListUserSerializer, PasswordChangeSerializer,
                           AccountVerificationSerializer,InitiatePasswordResetSerializer,
-                          UpdateUserSerializer)
-from .utils import IsAdmin,  is_admin_user
+                          TOTPCodeSerializer, TOTPLoginSerializer, TOTPSetupSerializer,
+                          TokenIntrospectionSerializer, UpdateUserSerializer)
+from .revocation import revoke_user_tokens
+from .signing import asymmetric_signing_enabled, key_ring
+from .tasks import bulk_delete_users
+from .utils import (CredentialIPThrottle, CredentialPhoneThrottle, IsAdmin,
+                    IsInternalService, get_bulk_job_progress, is_admin_user,
+                    start_bulk_job, summarize_bulk_report, user_response_cache)
+
+USER_EXPORT_FIELDS = [
+    "id",
+    "phone",
+    "email",
+    "firstname",
+    "lastname",
+    "verified",
+    "is_active",
+    "roles",
+    "created_at",
+]
 
 
 class CustomObtainTokenPairView(TokenObtainPairView):
@@ -26,6 +65,34 @@ class CustomObtainTokenPairView(TokenObtainPairView):
     serializer_class = CustomObtainTokenPairSerializer
 
 
+class TOTPLoginView(TokenObtainPairView):
+    """Complete a login challenge with a code from the user's authenticator app"""
+    serializer_class = TOTPLoginSerializer
+
+
+class TokenIntrospectionView(TokenVerifyView):
+    """Verify a batch of access tokens for internal services in one call"""
+    serializer_class = TokenIntrospectionSerializer
+    permission_classes = (IsInternalService,)
+
+
+class JWKSView(APIView):
+    """Public keys other services use to verify our access tokens locally"""
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    @extend_schema(responses={200: OpenApiTypes.OBJECT})
+    def get(self, request):
+        document, etag = key_ring.jwks() if asymmetric_signing_enabled() else ({"keys": []}, None)
+        response = not_modified_response(request, etag) if etag else None
+        if response is None:
+            response = Response(document)
+            if etag:
+                response["ETag"] = etag
+        response["Cache-Control"] = f"public, max-age={settings.JWT_SIGNING['JWKS_MAX_AGE']}"
+        return response
+
+
 class AuthViewsets(viewsets.GenericViewSet):
     """Auth viewsets"""
     serializer_class = EmailSerializer
@@ -43,6 +110,7 @@ class AuthViewsets(viewsets.GenericViewSet):
         serializer_class=InitiatePasswordResetSerializer,
         url_path="initiate-password-reset",
     )
+    @idempotent
     def initiate_password_reset(self, request, pk=None):
         """Send temporary OTP to user phone to be used for password reset"""
         serializer = self.get_serializer(data=request.data)
@@ -56,12 +124,12 @@ class AuthViewsets(viewsets.GenericViewSet):
         """Create a new password given the reset OTP sent to user phone number"""
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        token: Token = Token.objects.filter(
-            token=request.data['otp'],  token_type=TokenEnum.PASSWORD_RESET).first()
-        if not token or not token.is_valid():
+        token: Token = serializer.get_valid_token()
+        if not token:
             return Response({'success': False, 'errors': 'Invalid password reset otp'}, status=400)
-        token.reset_user_password(request.data['new_password'])
+        token.reset_user_password(serializer.validated_data['new_password'])
         token.delete()
+        emit_auth_event(AuthEventEnum.PASSWORD_RESET, request, token.user)
         return Response({'success': True, 'message': 'Password successfully reset'}, status=status.HTTP_200_OK)
 
     @extend_schema(
@@ -88,6 +156,44 @@ class AuthViewsets(viewsets.GenericViewSet):
         serializer.save()
         return Response({"success": True, "message": "Acount Verification Successful"}, status=200)
 
+    @extend_schema(
+        request=None,
+        responses={
+            200: inline_serializer(
+                name='TOTPSetup',
+                fields={
+                    "success": serializers.BooleanField(default=True),
+                    "secret": serializers.CharField(),
+                    "provisioning_uri": serializers.CharField(),
+                }
+            ),
+        },
+    )
+    @action(methods=["POST"], detail=False, serializer_class=TOTPSetupSerializer, url_path="totp/setup")
+    def totp_setup(self, request, pk=None):
+        """Generate an authenticator app secret; confirm it with a code to enable it"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        secret, provisioning_uri = serializer.save()
+        return Response({"success": True, "secret": secret,
+                         "provisioning_uri": provisioning_uri}, status=200)
+
+    @action(methods=["POST"], detail=False, serializer_class=TOTPCodeSerializer, url_path="totp/confirm")
+    def totp_confirm(self, request, pk=None):
+        """Enable authenticator app login using a code generated from the new secret"""
+        serializer = self.get_serializer(data=request.data, context={"request": request, "enable": True})
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response({"success": True, "message": "Authenticator app enabled"}, status=200)
+
+    @action(methods=["POST"], detail=False, serializer_class=TOTPCodeSerializer, url_path="totp/disable")
+    def totp_disable(self, request, pk=None):
+        """Disable authenticator app login using a current code"""
+        serializer = self.get_serializer(data=request.data, context={"request": request, "enable": False})
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response({"success": True, "message": "Authenticator app disabled"}, status=200)
+
 
 class PasswordChangeView(viewsets.GenericViewSet):
     '''Allows password change to authenticated user.'''
@@ -102,30 +208,64 @@ class PasswordChangeView(viewsets.GenericViewSet):
         return Response({"message": "Your password has been updated."}, status.HTTP_200_OK)
 
 
-class CreateTokenView(ObtainAuthToken):
-    """Create a new auth token for user"""
-
+class CreateTokenView(APIView):
+    """Create an API key for server-to-server clients from the user's credentials"""
     serializer_class = AuthTokenSerializer
-    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
+    authentication_classes = []
+    permission_classes = [AllowAny]
+    throttle_classes = [CredentialPhoneThrottle, CredentialIPThrottle]
 
+    @extend_schema(
+        request=AuthTokenSerializer,
+        responses={
+            201: inline_serializer(
+                name='CreatedAPIKey',
+                fields={
+                    "success": serializers.BooleanField(default=True),
+                    "api_key": serializers.CharField(),
+                    "prefix": serializers.CharField(),
+                    "roles": serializers.ListField(child=serializers.CharField()),
+                }
+            ),
+        },
+    )
     def post(self, request, *args, **kwargs):
         serializer = self.serializer_class(
             data=request.data, context={"request": request}
         )
         serializer.is_valid(raise_exception=True)
         user = serializer.validated_data["user"]
-        try:
-            token, created = Token.objects.get_or_create(user=user)
-            return Response(
-                {"token": token.key, "created": created, "roles": user.roles},
-                status=status.HTTP_200_OK,
-            )
-        except Exception as e:
-            return Response({"message": str(e)}, 500)
+        api_key, raw_key = APIKey.create_key(user, name=serializer.validated_data["name"])
+        return Response(
+            {"success": True, "api_key": raw_key, "prefix": api_key.prefix, "roles": user.roles},
+            status=status.HTTP_201_CREATED,
+        )
+
+
+class APIKeyViewSet(mixins.ListModelMixin, mixins.CreateModelMixin,
+                    mixins.DestroyModelMixin, viewsets.GenericViewSet):
+    """Manage the authenticated user's API keys; the raw key is only returned on creation"""
+    serializer_class = APIKeySerializer
+    permission_classes = [IsAuthenticated]
+    lookup_field = "prefix"
+
+    def get_queryset(self):
+        return APIKey.objects.filter(user=self.request.user)
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        api_key, raw_key = APIKey.create_key(request.user, **serializer.validated_data)
+        return Response({"success": True, "api_key": raw_key,
+                         **self.get_serializer(api_key).data}, status=status.HTTP_201_CREATED)
 
+    def perform_destroy(self, instance: APIKey):
+        revoke_api_key(instance)
 
-class UserViewsets(viewsets.ModelViewSet):
+
+class UserViewsets(ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = get_user_model().objects.all()
+    replica_actions = ("list", "retrieve", "export", "funnel")
     serializer_class = ListUserSerializer
     permission_classes = [IsAuthenticated]
     http_method_names = ["get", "post", "patch", "delete"]
@@ -163,7 +303,8 @@ class UserViewsets(viewsets.ModelViewSet):
             permission_classes = [AllowAny]
         elif self.action in ["list", "retrieve", "partial_update", "update"]:
             permission_classes = [IsAuthenticated]
-        elif self.action in ["destroy"]:
+        elif self.action in ["destroy", "export", "bulk_onboard", "bulk_update",
+                             "bulk_delete", "bulk_delete_status", "cache_stats", "funnel"]:
             permission_classes = [IsAdmin]
         return [permission() for permission in permission_classes]
     
@@ -180,6 +321,7 @@ class UserViewsets(viewsets.ModelViewSet):
         },
         description="Sign up with a validate phone number. i.e. 08130303030 or +2348130303030"
     )
+    @idempotent
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -188,4 +330,211 @@ class UserViewsets(viewsets.ModelViewSet):
 
     def list(self, request, *args, **kwargs):
         "Retrieve user lists based on assigned role"
-        return super().list(request, *args, **kwargs)
+        return self.get_cached_response(
+            request, lambda: self.build_list_response(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            request, lambda: self.build_retrieve_response(request, *args, **kwargs),
+            scope=kwargs["pk"])
+
+    def get_cached_response(self, request, build_response, scope=""):
+        """Serve admin responses from the versioned cache when the action has a timeout"""
+        timeout = settings.USER_RESPONSE_CACHE_TIMEOUTS.get(self.action)
+        if not timeout or not is_admin_user(request.user):
+            return build_response()
+        key = user_response_cache.make_key(self.action, request, scope=scope)
+        cached = user_response_cache.get(self.action, key)
+        if cached is not None:
+            data, etag, last_modified = cached
+            not_modified = not_modified_response(request, etag, last_modified)
+            if not_modified is not None:
+                return not_modified
+            return set_validators(Response(data), etag, last_modified)
+        # A lagging replica could store rows older than the generation they are
+        # cached under, so responses that will be cached are built from the primary
+        use_primary_reads()
+        response = build_response()
+        if response.status_code == status.HTTP_200_OK:
+            last_modified = response.get("Last-Modified")
+            if last_modified:
+                last_modified = datetime.fromtimestamp(
+                    parse_http_date(last_modified), tz=dt_timezone.utc)
+            user_response_cache.set(
+                key, (response.data, response["ETag"], last_modified), timeout)
+        return response
+
+    def build_list_response(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        state = queryset.aggregate(last_modified=Max("updated_at"), total=Count("id"))
+        etag = make_etag("user-list", request.user.id, request.get_full_path(),
+                         state["last_modified"], state["total"])
+        not_modified = not_modified_response(request, etag, state["last_modified"])
+        if not_modified is not None:
+            return not_modified
+        response = super().list(request, *args, **kwargs)
+        return set_validators(response, etag, state["last_modified"])
+
+    def build_retrieve_response(self, request, *args, **kwargs):
+        if has_conditional_headers(request):
+            # Validate against updated_at alone before loading and serializing the
+            # row, with the same lookup and permission checks as get_object()
+            try:
+                pk = uuid.UUID(str(kwargs["pk"]))
+            except ValueError:
+                pk = None
+            row = pk and self.filter_queryset(self.get_queryset()).only(
+                "id", "updated_at").filter(pk=pk).first()
+            if row:
+                self.check_object_permissions(request, row)
+                not_modified = not_modified_response(
+                    request, make_etag("user", row.pk, row.updated_at), row.updated_at)
+                if not_modified is not None:
+                    return not_modified
+        instance = self.get_object()
+        serializer = self.get_serializer(instance)
+        response = Response(serializer.data)
+        return set_validators(
+            response, make_etag("user", instance.pk, instance.updated_at), instance.updated_at)
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name="export_format", type=OpenApiTypes.STR,
+                enum=["ndjson", "csv"], default="ndjson"),
+        ],
+        responses={200: OpenApiTypes.BINARY},
+    )
+    @action(methods=["GET"], detail=False, url_path="export")
+    def export(self, request, *args, **kwargs):
+        """Stream all users matching the filter/search params as NDJSON or CSV"""
+        export_format = request.query_params.get("export_format", "ndjson")
+        if export_format not in ["ndjson", "csv"]:
+            return Response({"success": False,
+                             "errors": "export_format must be ndjson or csv"}, status=400)
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = queryset.values(*USER_EXPORT_FIELDS).iterator(
+            chunk_size=settings.USER_EXPORT_CHUNK_SIZE)
+        return streaming_export_response(
+            rows, USER_EXPORT_FIELDS, export_format, filename="users")
+
+    @extend_schema(
+        responses={
+            200: inline_serializer(
+                name='BulkOnboardReport',
+                fields={
+                    "success": serializers.BooleanField(default=True),
+                    "summary": serializers.DictField(child=serializers.IntegerField()),
+                    "results": serializers.ListField(child=serializers.DictField()),
+                }
+            ),
+        },
+        description="Onboard many phones at once. Send a JSON list of phones or upload a CSV file with a phone column"
+    )
+    @action(methods=["POST"], detail=False, serializer_class=BulkOnboardUserSerializer,
+            url_path="bulk-onboard")
+    def bulk_onboard(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        report = serializer.save()
+        return Response({"success": True, "summary": summarize_bulk_report(report),
+                         "results": report}, status=200)
+
+    def get_bulk_queryset(self, validated_data: dict):
+        """Users selected by a bulk action; the requesting admin is never included"""
+        queryset = self.filter_queryset(self.get_queryset())
+        if validated_data.get('ids'):
+            queryset = queryset.filter(id__in=validated_data['ids'])
+        return queryset.exclude(id=self.request.user.id)
+
+    @extend_schema(
+        responses={
+            200: inline_serializer(
+                name='BulkUpdateStatus',
+                fields={
+                    "success": serializers.BooleanField(default=True),
+                    "updated": serializers.IntegerField(),
+                }
+            ),
+        },
+        description="Set roles, is_active and/or verified on many users with a single UPDATE"
+    )
+    @action(methods=["POST"], detail=False, serializer_class=BulkUserUpdateSerializer,
+            url_path="bulk-update")
+    def bulk_update(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        queryset = self.get_bulk_queryset(serializer.validated_data)
+        changes = serializer.validated_data['changes']
+        downgraded = []
+        if 'roles' in changes:
+            downgraded = list(queryset.exclude(
+                roles__contained_by=changes['roles']).values_list('id', flat=True))
+        # update() skips auto_now and save signals, so updated_at is set and
+        # cached responses are invalidated explicitly
+        updated = queryset.update(**changes, updated_at=timezone.now())
+        user_response_cache.bump_on_commit()
+        revoke_user_tokens(*downgraded)
+        return Response({"success": True, "updated": updated}, status=200)
+
+    @extend_schema(
+        responses={
+            202: inline_serializer(
+                name='BulkDeleteJob',
+                fields={
+                    "success": serializers.BooleanField(default=True),
+                    "job_id": serializers.CharField(),
+                    "total": serializers.IntegerField(),
+                }
+            ),
+        },
+        description="Delete many users in a background job. Poll bulk-delete/{job_id}/ for progress"
+    )
+    @action(methods=["POST"], detail=False, serializer_class=BulkUserSelectionSerializer,
+            url_path="bulk-delete")
+    def bulk_delete(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user_ids = [str(user_id) for user_id in self.get_bulk_queryset(
+            serializer.validated_data).values_list('id', flat=True)]
+        job_id = uuid.uuid4().hex
+        start_bulk_job(job_id, total=len(user_ids))
+        # One message per chunk keeps broker messages small
+        for chunk in chunked(user_ids, settings.BULK_DELETE_CHUNK_SIZE):
+            bulk_delete_users.delay(job_id, chunk)
+        return Response({"success": True, "job_id": job_id, "total": len(user_ids)}, status=202)
+
+    @action(methods=["GET"], detail=False, url_path=r"bulk-delete/(?P<job_id>[0-9a-f]+)")
+    def bulk_delete_status(self, request, job_id=None, *args, **kwargs):
+        """Progress of a bulk delete job"""
+        progress = get_bulk_job_progress(job_id)
+        if progress is None:
+            return Response({"success": False, "errors": "Job not found"}, status=404)
+        return Response({"success": True, "job_id": job_id, **progress}, status=200)
+
+    @action(methods=["GET"], detail=False, url_path="cache-stats")
+    def cache_stats(self, request, *args, **kwargs):
+        """Hit/miss counts of the admin response cache per action"""
+        return Response({"success": True,
+                         "data": user_response_cache.stats(settings.USER_RESPONSE_CACHE_TIMEOUTS)},
+                        status=200)
+
+    @extend_schema(
+        parameters=[FunnelQuerySerializer],
+        responses={
+            200: inline_serializer(
+                name='OnboardingFunnel',
+                fields={
+                    "success": serializers.BooleanField(default=True),
+                    "data": serializers.DictField(),
+                }
+            ),
+        },
+    )
+    @action(methods=["GET"], detail=False, url_path="funnel")
+    def funnel(self, request, *args, **kwargs):
+        """OTP issued -> verified -> first login counts and conversion, from the hourly rollups"""
+        serializer = FunnelQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return Response({"success": True, "data": funnel_report(**serializer.validated_data)},
+                        status=200)
@@ -2,5 +2,13 @@
 python manage.py makemigrations --no-input
 python manage.py migrate --no-input
 rm celerybeat.pid
+# Metric files from previous runs would be merged into this run's values.
+# Each container gets its own subdirectory, so a shared volume is never wiped
+# or merged across containers.
+if [ -n "$PROMETHEUS_MULTIPROC_DIR" ]; then
+    export PROMETHEUS_MULTIPROC_DIR="$PROMETHEUS_MULTIPROC_DIR/$(hostname)"
+    rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+    mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+fi
 
 exec "$@"
\ No newline at end of file